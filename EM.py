@@ -64,6 +64,7 @@ from EM_FHEquiv import *
 from EM_FHSolver import *
 from EM_FHInputFile import *
 # VoxHenry specific
+from EM_VHVoxel import *
 from EM_VHSolver import *
 from EM_VHConductor import *
 from EM_VHPort import *
@@ -103,6 +104,9 @@ from EM_VHInputFile import *
 #import EM_FHInputFile
 #reload(EM_FHInputFile)
 #from EM_FHInputFile import *
+#import EM_VHVoxel
+#reload(EM_VHVoxel)
+#from EM_VHVoxel import *
 #import EM_VHSolver
 #reload(EM_VHSolver)
 #from EM_VHSolver import *
@@ -84,6 +84,14 @@ def makeFHEquiv(node1=None,node2=None,name='FHEquiv'):
     # return the newly created Python object
     return obj
 
+def serializeFHEquivs(fid,equivs):
+    ''' Serialize a list of FHEquivs to the 'fid' file descriptor, with a single write
+
+        'fid': the file descriptor
+        'equivs': the list of FHEquiv objects
+'''
+    fid.write("".join([".equiv N" + equiv.Node1.Label + " N" + equiv.Node2.Label + "\n" for equiv in equivs]))
+
 class _FHEquiv:
     '''The EM FastHenry node Equivalence object'''
     def __init__(self, obj):
@@ -147,7 +155,7 @@ class _FHEquiv:
     def serialize(self,fid):
         ''' Serialize the object to the 'fid' file descriptor
     '''
-        fid.write(".equiv N" + self.Object.Node1.Label + " N" + self.Object.Node2.Label + "\n")
+        serializeFHEquivs(fid,[self.Object])
 
     def __getstate__(self):
         return self.Type
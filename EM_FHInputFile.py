@@ -32,6 +32,7 @@ __url__ = "http://www.fastfieldsolvers.com"
 import FreeCAD, FreeCADGui, Mesh, Part, MeshPart, Draft, DraftGeomUtils, os
 from FreeCAD import Vector
 from PySide import QtCore, QtGui
+import EM
 
 if FreeCAD.GuiUp:
     import FreeCADGui
@@ -77,8 +78,12 @@ def createFHInputFile(doc=None,filename=None,folder=None):
     if not doc:
         FreeCAD.Console.PrintWarning(translate("EM","No active document available. Aborting."))
         return
+    # bucket the document objects by type in a single scan (keeping the document order)
+    objectsByType = {}
+    for obj in doc.Objects:
+        objectsByType.setdefault(Draft.getType(obj), []).append(obj)
     # get the solver object, if any
-    solver = [obj for obj in doc.Objects if Draft.getType(obj) == "FHSolver"]
+    solver = objectsByType.get("FHSolver", [])
     if solver == []:
         # error
         FreeCAD.Console.PrintWarning(translate("EM","FHSolver object not found in the document. Aborting."))
@@ -124,43 +129,37 @@ def createFHInputFile(doc=None,filename=None,folder=None):
         solver.Proxy.serialize(fid,"head")
         # now the nodes
         fid.write("* Nodes\n")
-        nodes = [obj for obj in doc.Objects if Draft.getType(obj) == "FHNode"]
-        for node in nodes:
-            node.Proxy.serialize(fid)
+        EM.serializeFHNodes(fid, objectsByType.get("FHNode", []))
         fid.write("\n")
         # then the segments
-        segments = [obj for obj in doc.Objects if Draft.getType(obj) == "FHSegment"]
+        segments = objectsByType.get("FHSegment", [])
         if segments:
             fid.write("* Segments\n")
-            for segment in segments:
-                segment.Proxy.serialize(fid)
+            EM.serializeFHSegments(fid, segments)
             fid.write("\n")
         # then the paths
-        paths = [obj for obj in doc.Objects if Draft.getType(obj) == "FHPath"]
+        paths = objectsByType.get("FHPath", [])
         if paths:
             fid.write("* Segments from paths\n")
             for path in paths:
                 path.Proxy.serialize(fid)
             fid.write("\n")
         # then the planes
-        planes = [obj for obj in doc.Objects if Draft.getType(obj) == "FHPlane"]
+        planes = objectsByType.get("FHPlane", [])
         if planes:
             fid.write("* Planes\n")
             for plane in planes:
                 plane.Proxy.serialize(fid)
             fid.write("\n")
         # then the .equiv
-        equivs = [obj for obj in doc.Objects if Draft.getType(obj) == "FHEquiv"]
+        equivs = objectsByType.get("FHEquiv", [])
         if equivs:
             fid.write("* Node shorts\n")
-            for equiv in equivs:
-                equiv.Proxy.serialize(fid)
+            EM.serializeFHEquivs(fid, equivs)
             fid.write("\n")
         # then the ports
         fid.write("* Ports\n")
-        ports = [obj for obj in doc.Objects if Draft.getType(obj) == "FHPort"]
-        for port in ports:
-            port.Proxy.serialize(fid)
+        EM.serializeFHPorts(fid, objectsByType.get("FHPort", []))
         fid.write("\n")
         # and finally the tail
         solver.Proxy.serialize(fid,"tail")
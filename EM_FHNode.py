@@ -101,6 +101,25 @@ def makeFHNode(baseobj=None,X=0.0,Y=0.0,Z=0.0,color=None,size=None,name='FHNode'
     # return the newly created Python object
     return obj
 
+def serializeFHNodes(fid,nodes,extension=""):
+    ''' Serialize a list of FHNodes to the 'fid' file descriptor, with a single write
+
+        'fid': the file descriptor
+        'nodes': the list of FHNode objects
+        'extension': any extension to add to the node names, in case of nodes
+            belonging to a conductive plane (see _FHNode.serialize())
+'''
+    # gather the labels and absolute coordinates first, then format all the lines at once
+    labels = [node.Label for node in nodes]
+    positions = [node.Placement.multVec(Vector(node.X, node.Y, node.Z)) for node in nodes]
+    if extension == "":
+        lines = ["N" + label + " x=" + str(pos.x) + " y=" + str(pos.y) + " z=" + str(pos.z) + "\n"
+                 for label, pos in zip(labels, positions)]
+    else:
+        lines = ["+         N" + label + extension + " (" + str(pos.x) + "," + str(pos.y) + "," + str(pos.z) + ")\n"
+                 for label, pos in zip(labels, positions)]
+    fid.write("".join(lines))
+
 class _FHNode:
     '''The EM FastHenry Node object'''
     def __init__(self, obj):
@@ -171,14 +190,7 @@ class _FHNode:
             the way the node is serialized, according to the plane node definition.
             Defaults to an empty string.
 '''
-        pos = self.getAbsCoord()
-        if extension == "":
-            fid.write("N" + self.Object.Label)
-            fid.write(" x=" + str(pos.x) + " y=" + str(pos.y) + " z=" + str(pos.z))
-        else:
-            fid.write("+         N" + self.Object.Label + extension)
-            fid.write(" (" + str(pos.x) + "," + str(pos.y) + "," + str(pos.z) + ")")
-        fid.write("\n")
+        serializeFHNodes(fid,[self.Object],extension)
 
     def getAbsCoord(self):
         ''' Get a FreeCAD.Vector containing the node coordinates
@@ -41,7 +41,9 @@ EMFHPATH_TIMESWIDTH = 3
 
 import FreeCAD, FreeCADGui, Mesh, Part, MeshPart, Draft, DraftGeomUtils, os
 import DraftVecUtils
+import numpy as np
 from FreeCAD import Vector
+from pivy import coin
 import EM
 
 if FreeCAD.GuiUp:
@@ -118,6 +120,7 @@ class _FHPath:
         obj.addProperty("App::PropertyInteger","nwinc","EM",QT_TRANSLATE_NOOP("App::Property","Number of filaments in the width direction ('nwinc' segment parameter)"))
         obj.addProperty("App::PropertyInteger","rh","EM",QT_TRANSLATE_NOOP("App::Property","Ratio of adjacent filaments in the height direction ('rh' segment parameter)"))
         obj.addProperty("App::PropertyInteger","rw","EM",QT_TRANSLATE_NOOP("App::Property","Ratio of adjacent filaments in the width direction ('rw' segment parameter)"))
+        obj.addProperty("App::PropertyBool","PathShape","EM",QT_TRANSLATE_NOOP("App::Property","Build the path segments as a Part compound of shells (e.g. to export them to STEP), instead of only showing them through a lightweight coin3d representation"))
         obj.Proxy = self
         self.Type = "FHPath"
         obj.Discr = EMFHPATH_DEF_DISCR
@@ -156,6 +159,89 @@ class _FHPath:
         # This last part is different from FHSegment.
         if obj.Placement != FreeCAD.Placement():
             obj.Placement = FreeCAD.Placement()
+        nodeCoords = self.getPathNodeCoords(obj)
+        if nodeCoords is None:
+            return
+        self.nodeCoords = nodeCoords
+        # get node positions in absolute coordinates (at least two nodes exist, checked above)
+        absCoords = [EM.getAbsCoordBodyPart(obj.Base,nodeCoord) for nodeCoord in self.nodeCoords]
+        # find the cross-section orientation of the segments
+        self.ww = self.getPathWW(obj,absCoords)
+        # if the geometry did not change (e.g. only 'Sigma' changed), keep the current shape.
+        pathShape = hasattr(obj,"PathShape") and obj.PathShape == True
+        signature = (tuple((coord.x,coord.y,coord.z) for coord in absCoords),obj.Width.Value,obj.Height.Value,
+                     self.ww[0].x,self.ww[0].y,self.ww[0].z,pathShape)
+        if not hasattr(self,"geometryCache"):
+            self.geometryCache = EM.GeometryCache(self.Type)
+        if self.geometryCache.isValid(signature,obj.Shape):
+            shape = None
+        else:
+            # compute the vertexes of all the segments at once
+            vertexes = self.makePathVertexes(obj,absCoords,self.ww)
+            if pathShape:
+                shape = Part.makeCompound(EM.makeSegShells(vertexes))
+                self.clearPathMesh()
+            else:
+                self.makePathMesh(vertexes)
+                # make a dummy empty shape. Representation is through custom coin3d scenegraph.
+                shape = Part.makeShell([])
+        # now create or assign FHNodes
+        nodes = obj.Nodes
+        numnodes = len(nodes)
+        modified = False
+        import EM_FHNode
+        # if there are less FHNodes than required, extend them
+        if numnodes < len(self.nodeCoords):
+            modified = True
+            for index in range(0,len(self.nodeCoords)-numnodes):
+                # create a new FHNode at the nodeCoords position
+                node = EM_FHNode.makeFHNode(X=self.nodeCoords[numnodes+index].x, Y=self.nodeCoords[numnodes+index].y, Z=self.nodeCoords[numnodes+index].z)
+                # insert the new node before the last (the last node always stays the same,
+                # to preserve FHPath attachments to other structures, if the FHPath shape changes)
+                nodes.insert(-1,node)
+        # if instead there are more FHNodes than required, must remove some of them
+        elif numnodes > len(self.nodeCoords):
+            # but do it only if there are more than two nodes left in the FHPath,
+            # otherwise we assume this is a temporary change of FHPath shape,
+            # and we preserve the end nodes (do not remove them)
+            if numnodes > 2:
+                modified = True
+                # scan backwards, skipping the last node (last element is 'numnodes-1',
+                # and range scans up to the last element before 'numnodes-len(self.nodeCoords)-1'
+                for index in range(numnodes-2,len(self.nodeCoords)-2,-1):
+                    # remove the node from the 'nodes' list, but keeping the last node
+                    node = nodes[index]
+                    nodes.pop(index)
+                    # check if we can safely remove the extra nodes from the Document;
+                    # this can be done only if they do not belong to any other object.
+                    # So if the 'InList' member contains one element only, this is
+                    # the parent FHPath (we actually check for zero as well, even if
+                    # this should never happen), so we can remove the FHNode
+                    if len(node.InList) <= 1:
+                        node.Document.removeObject(node.Name)
+        # and finally correct node positions
+        for node, nodeCoord in zip(nodes, self.nodeCoords):
+            # only if node position is not correct, change it
+            if (node.Proxy.getAbsCoord()-nodeCoord).Length > EM.EMFHSEGMENT_LENTOL:
+                node.Proxy.setAbsCoord(nodeCoord)
+        # only if we modified the list of nodes, re-assign it to the FHPath
+        if modified:
+            obj.Nodes = nodes
+        # shape may be None if the current shape is still valid. Do not assign in this case
+        if shape is not None:
+            obj.Shape = shape
+            self.geometryCache.store(signature,shape)
+        #FreeCAD.Console.PrintWarning("_FHPath execute() ends\n") #debug
+
+    def getPathNodeCoords(self,obj):
+        ''' Get the positions of the FHPath nodes along the edges of the 'Base' object,
+            without changing any property or document object
+
+            'obj': FHPath object
+
+            Returns the list of the node positions (Vector) relative to the 'Base' object
+            (see EM.getAbsCoordBodyPart()), or None if less than two nodes are found
+    '''
         # define nodes and segments
         edges_raw = []
         # checking TypeId; cannot check type(obj), too generic
@@ -179,23 +265,23 @@ class _FHPath:
                 edges_raw.extend(obj.Base.Shape.Edges)
             else:
                 FreeCAD.Console.PrintWarning(translate("EM","Unsupported base object type for FHPath"))
-                return
+                return None
         # sort the edges. Remark: the edge list might be disconnected (e.g. can happen with a compound
         # containing different edges / wires / sketches). We will join the dangling endpoints with segments later on
         edges = Part.__sortEdges__(edges_raw)
         if edges == []:
-            return
+            return None
         # get the max between the 'obj.Width' and the 'obj.Height'
         if obj.Width > obj.Height:
             geodim = obj.Width
         else:
             geodim = obj.Height
         # scan edges and derive node positions
-        self.nodeCoords = []
+        nodeCoords = []
         # initialize 'lastvertex' to the position of the first vertex,
         # (as if we had a previous segment)
         lastvertex = edges[0].valueAt(edges[0].FirstParameter)
-        self.nodeCoords.append(lastvertex)
+        nodeCoords.append(lastvertex)
         for edge in edges:
             # might also rely on "edge.Curve.discretize(Deflection=geodim)"
             # where Deflection is the max distance between any point on the curve,
@@ -237,37 +323,42 @@ class _FHPath:
                 start = 0
             for i in range(start, ddisc):
                 # always skip last vertex, will add this at the end
-                self.nodeCoords.append(edge.valueAt(edge.FirstParameter + i*step))
+                nodeCoords.append(edge.valueAt(edge.FirstParameter + i*step))
             # now add the very last vertex ('LastParameter' provides the exact position)
             lastvertex = edge.valueAt(edge.LastParameter)
-            self.nodeCoords.append(lastvertex)
-        if len(self.nodeCoords) < 2:
+            nodeCoords.append(lastvertex)
+        if len(nodeCoords) < 2:
             FreeCAD.Console.PrintWarning(translate("EM","Less than two nodes found, cannot create the FHPath"))
-            return
+            return None
+        return nodeCoords
+
+    def getPathWW(self,obj,absCoords):
+        ''' Get the cross-section orientations of the FHPath segments
+
+            'obj': FHPath object
+            'absCoords': list of the node positions in absolute coordinates (Vector)
+
+            Returns the list of the segment cross-section orientations (Vector)
+    '''
         # find the cross-section orientation of the first segment, according to the 'Base' object Placement.
         # If 'obj.ww' is not defined,  use the FastHenry default (see makeSegShape() )
-        self.ww = []
         if obj.ww.Length < EM.EMFHSEGMENT_LENTOL:
             # this is zero anyway (i.e. below 'EMFHSEGMENT_LENTOL')
-            self.ww = [Vector(0,0,0)]
+            segWW = [Vector(0,0,0)]
         else:
             # transform 'obj.ww' according to the 'Base' Placement
             # (transation is don't care, we worry about rotation)
-            self.ww = [obj.Base.Placement.multVec(obj.ww)]
-        shapes = []
-        # get node positions in absolute coordinates (at least two nodes exist, checked above)
-        n1 = EM.getAbsCoordBodyPart(obj.Base,self.nodeCoords[0])
-        n2 = EM.getAbsCoordBodyPart(obj.Base,self.nodeCoords[1])
+            segWW = [obj.Base.Placement.multVec(obj.ww)]
+        n1 = absCoords[0]
+        n2 = absCoords[1]
         vNext = n2-n1
-        for i in range(1, len(self.nodeCoords)):
+        for i in range(1, len(absCoords)):
             vPrev = vNext
-            shape = EM.makeSegShape(n1,n2,obj.Width,obj.Height,self.ww[-1])
-            shapes.append(shape)
             # now we must calculate the cross-section orientation
             # of the next segment, i.e. update 'ww'
-            if i < len(self.nodeCoords)-1:
+            if i < len(absCoords)-1:
                 n1 = n2
-                n2 = EM.getAbsCoordBodyPart(obj.Base,self.nodeCoords[i+1])
+                n2 = absCoords[i+1]
                 vNext = n2-n1
                 # get angle in radians
                 angle = vPrev.getAngle(vNext)
@@ -276,58 +367,45 @@ class _FHPath:
                 if angle*FreeCAD.Units.Radian > EM.EMFHSEGMENT_PARTOL:
                     normal = vPrev.cross(vNext)
                     # rotate 'ww'
-                    ww = DraftVecUtils.rotate(self.ww[-1],angle,normal)
+                    ww = DraftVecUtils.rotate(segWW[-1],angle,normal)
                 else:
                     # otherwise, keep the previous orientation
-                    ww = self.ww[-1]
-                self.ww.append(ww)
-        shape = Part.makeCompound(shapes)
-        # now create or assign FHNodes
-        nodes = obj.Nodes
-        numnodes = len(nodes)
-        modified = False
-        import EM_FHNode
-        # if there are less FHNodes than required, extend them
-        if numnodes < len(self.nodeCoords):
-            modified = True
-            for index in range(0,len(self.nodeCoords)-numnodes):
-                # create a new FHNode at the nodeCoords position
-                node = EM_FHNode.makeFHNode(X=self.nodeCoords[numnodes+index].x, Y=self.nodeCoords[numnodes+index].y, Z=self.nodeCoords[numnodes+index].z)
-                # insert the new node before the last (the last node always stays the same,
-                # to preserve FHPath attachments to other structures, if the FHPath shape changes)
-                nodes.insert(-1,node)
-        # if instead there are more FHNodes than required, must remove some of them
-        elif numnodes > len(self.nodeCoords):
-            # but do it only if there are more than two nodes left in the FHPath,
-            # otherwise we assume this is a temporary change of FHPath shape,
-            # and we preserve the end nodes (do not remove them)
-            if numnodes > 2:
-                modified = True
-                # scan backwards, skipping the last node (last element is 'numnodes-1',
-                # and range scans up to the last element before 'numnodes-len(self.nodeCoords)-1'
-                for index in range(numnodes-2,len(self.nodeCoords)-2,-1):
-                    # remove the node from the 'nodes' list, but keeping the last node
-                    node = nodes[index]
-                    nodes.pop(index)
-                    # check if we can safely remove the extra nodes from the Document;
-                    # this can be done only if they do not belong to any other object.
-                    # So if the 'InList' member contains one element only, this is
-                    # the parent FHPath (we actually check for zero as well, even if
-                    # this should never happen), so we can remove the FHNode
-                    if len(node.InList) <= 1:
-                        node.Document.removeObject(node.Name)
-        # and finally correct node positions
-        for node, nodeCoord in zip(nodes, self.nodeCoords):
-            # only if node position is not correct, change it
-            if (node.Proxy.getAbsCoord()-nodeCoord).Length > EM.EMFHSEGMENT_LENTOL:
-                node.Proxy.setAbsCoord(nodeCoord)
-        # only if we modified the list of nodes, re-assign it to the FHPath
-        if modified:
-            obj.Nodes = nodes
-        # shape may be None, e.g. if endpoints coincide. Do not assign in this case
-        if shape:
-            obj.Shape = shape
-        #FreeCAD.Console.PrintWarning("_FHPath execute() ends\n") #debug
+                    ww = segWW[-1]
+                segWW.append(ww)
+        return segWW
+
+    def makePathVertexes(self,obj,absCoords,segWW):
+        ''' Compute the vertexes of the FHPath segments. As makeSegShape(), skip the segments
+            with coincident nodes.
+
+            'obj': FHPath object
+            'absCoords': list of the node positions in absolute coordinates (Vector)
+            'segWW': list of the segment cross-section orientations (see getPathWW())
+
+            Returns the (N,8,3) array of the vertexes of the N valid segments (see EM.makeSegVertexes())
+    '''
+        coords = np.array([(coord.x,coord.y,coord.z) for coord in absCoords])
+        segWW = np.array([(ww.x,ww.y,ww.z) for ww in segWW])
+        valid = np.linalg.norm(coords[1:]-coords[:-1], axis=1) >= EM.EMFHSEGMENT_LENTOL
+        return EM.makeSegVertexes(coords[:-1][valid],coords[1:][valid],obj.Width.Value,obj.Height.Value,segWW[valid])
+
+    def makePathMesh(self,vertexes):
+        ''' Store the coin3d representation of the path segments, without creating
+            any OpenCascade shape
+
+            'vertexes' is the (N,8,3) array of the segment vertexes (see EM.makeSegVertexes())
+
+            The vertexes are stored in 'self.meshPoints' as a (N*8,3) float32 array,
+            and the face vertex indexes in 'self.meshFaceIndexes' (see EM.makeHexahedraFaceIndexes())
+    '''
+        self.meshPoints = vertexes.reshape(-1,3).astype(np.float32)
+        self.meshFaceIndexes = EM.makeHexahedraFaceIndexes(len(vertexes))
+
+    def clearPathMesh(self):
+        ''' Empty the coin3d representation of the path segments
+    '''
+        self.meshPoints = np.zeros((0,3),dtype=np.float32)
+        self.meshFaceIndexes = np.zeros(0,dtype=np.int32)
 
     def onChanged(self, obj, prop):
         ''' take action if an object property 'prop' changed
@@ -351,24 +429,23 @@ class _FHPath:
     def serialize(self,fid):
         ''' Serialize the object to the 'fid' file descriptor
     '''
-        if len(self.Object.Nodes) > 1:
-            if len(self.Object.Nodes) == len(self.ww)+1:
-                for index in range(0,len(self.Object.Nodes)-1):
-                    fid.write("E" + self.Object.Label + str(index) + " N" + self.Object.Nodes[index].Label + " N" + self.Object.Nodes[index+1].Label)
-                    fid.write(" w=" + str(self.Object.Width.Value) + " h=" + str(self.Object.Height.Value))
-                    if self.Object.Sigma > 0:
-                        fid.write(" sigma=" + str(self.Object.Sigma))
-                    if self.ww[index].Length >= EM.EMFHSEGMENT_LENTOL:
-                        fid.write(" wx=" + str(self.ww[index].x) + " wy=" + str(self.ww[index].y) + " wz=" + str(self.ww[index].z))
-                    if self.Object.nhinc > 0:
-                        fid.write(" nhinc=" + str(self.Object.nhinc))
-                    if self.Object.nwinc > 0:
-                        fid.write(" nwinc=" + str(self.Object.nwinc))
-                    if self.Object.rh > 0:
-                        fid.write(" rh=" + str(self.Object.rh))
-                    if self.Object.rw > 0:
-                        fid.write(" rw=" + str(self.Object.rw))
-                    fid.write("\n")
+        # retrieve the node list and the path parameters only once, as every property access
+        # builds a new copy of the value
+        nodes = self.Object.Nodes
+        if len(nodes) > 1:
+            if len(nodes) == len(self.ww)+1:
+                labels = [node.Label for node in nodes]
+                label = self.Object.Label
+                width = self.Object.Width.Value
+                height = self.Object.Height.Value
+                sigma = self.Object.Sigma
+                nhinc = self.Object.nhinc
+                nwinc = self.Object.nwinc
+                rh = self.Object.rh
+                rw = self.Object.rw
+                lines = [EM.formatFHSegment(label + str(index),labels[index],labels[index+1],width,height,sigma,
+                                            self.ww[index],nhinc,nwinc,rh,rw) for index in range(0,len(nodes)-1)]
+                fid.write("".join(lines))
             else:
                 FreeCAD.Console.PrintError(translate("EM","Error when serializing FHPath. Number of nodes does not match number of segments + 1"))
         else:
@@ -380,6 +457,34 @@ class _FHPath:
     def __setstate__(self,state):
         if state:
             self.Type = state
+        # the coin3d representation of the segments is not stored, see onDocumentRestored()
+        self.clearPathMesh()
+
+    def onDocumentRestored(self, obj):
+        ''' Called when the document containing the object has been restored
+    '''
+        self.Object = obj
+        # older FHPath objects do not have the 'PathShape' property
+        if not hasattr(obj,"PathShape"):
+            obj.addProperty("App::PropertyBool","PathShape","EM",QT_TRANSLATE_NOOP("App::Property","Build the path segments as a Part compound of shells (e.g. to export them to STEP), instead of only showing them through a lightweight coin3d representation"))
+        # the coin3d representation of the segments must be re-created, from the restored
+        # properties only: the other properties and document objects are not changed
+        if obj.PathShape == False:
+            if not obj.Base or not obj.Base.isDerivedFrom("Part::Feature"):
+                return
+            if obj.Base.Shape.isNull() or not obj.Base.Shape.isValid():
+                return
+            if obj.Width <= 0 or obj.Height <= 0:
+                return
+            nodeCoords = self.getPathNodeCoords(obj)
+            if nodeCoords is None:
+                return
+            self.nodeCoords = nodeCoords
+            absCoords = [EM.getAbsCoordBodyPart(obj.Base,nodeCoord) for nodeCoord in self.nodeCoords]
+            self.ww = self.getPathWW(obj,absCoords)
+            self.makePathMesh(self.makePathVertexes(obj,absCoords,self.ww))
+            if FreeCAD.GuiUp and obj.ViewObject is not None and hasattr(obj.ViewObject.Proxy,"updateData"):
+                obj.ViewObject.Proxy.updateData(obj,"Shape")
 
 class _ViewProviderFHPath:
     def __init__(self, obj):
@@ -393,11 +498,69 @@ class _ViewProviderFHPath:
         # members of the class, so __getstate__() and __setstate__() skip them);
         # so we must "re-attach" (re-create) the 'self.Object'
         self.Object = obj.Object
+        self.VObject = obj
+        # representation of the path segments, bypassing the Part shape (see _FHPath.makePathMesh())
+        self.switch = coin.SoSwitch()
+        self.hints = coin.SoShapeHints()
+        self.style1 = coin.SoDrawStyle()
+        self.style2 = coin.SoDrawStyle()
+        self.material = coin.SoMaterial()
+        self.linecolor = coin.SoBaseColor()
+        self.data = coin.SoCoordinate3()
+        self.face = coin.SoIndexedFaceSet()
+        # init
+        # A shape hints tells the ordering of polygons.
+        # This ensures double-sided lighting.
+        self.hints.vertexOrdering = coin.SoShapeHints.COUNTERCLOCKWISE
+        self.hints.faceType = coin.SoShapeHints.CONVEX
+        # init styles
+        self.style1.style = coin.SoDrawStyle.FILLED
+        self.style2.style = coin.SoDrawStyle.LINES
+        self.style2.lineWidth = self.VObject.LineWidth
+        # init color
+        self.material.diffuseColor.setValue(self.VObject.ShapeColor[0],self.VObject.ShapeColor[1],self.VObject.ShapeColor[2])
+        self.material.transparency = self.VObject.Transparency/100.0
+        self.linecolor.rgb.setValue(self.VObject.LineColor[0],self.VObject.LineColor[1],self.VObject.LineColor[2])
+        # instructs to visit the first child (this is used to toggle visiblity)
+        self.switch.whichChild = coin.SO_SWITCH_ALL
+        #  scene
+        # not using a separator, but a FreeCAD Selection node
+        sep = coin.SoType.fromName("SoFCSelection").createInstance()
+        sep.documentName.setValue(self.Object.Document.Name)
+        sep.objectName.setValue(self.Object.Name)
+        sep.subElementName.setValue("Face")
+        # now adding the common children
+        sep.addChild(self.hints)
+        sep.addChild(self.data)
+        sep.addChild(self.switch)
+        # and finally the two groups, the first is the contour lines,
+        # the second is the filled faces, so we can switch between
+        # "Flat Lines", "Shaded" and "Wireframe". Note: not implementing "Points"
+        group0Line = coin.SoGroup()
+        self.switch.addChild(group0Line)
+        group0Line.addChild(self.style2)
+        group0Line.addChild(self.linecolor)
+        group0Line.addChild(self.face)
+        group1Face = coin.SoGroup()
+        self.switch.addChild(group1Face)
+        group1Face.addChild(self.material)
+        group1Face.addChild(self.style1)
+        group1Face.addChild(self.face)
+        self.VObject.RootNode.addChild(sep)
         return
 
     def updateData(self, fp, prop):
         ''' If a property of the handled feature has changed we have the chance to handle this here '''
         #FreeCAD.Console.PrintMessage("ViewProvider updateData(),  property: " + str(prop) + "\n") # debug
+        if prop == "Shape" and hasattr(self,"data") and hasattr(fp.Proxy,"meshPoints"):
+            # the (N,3) float32 array is passed as it is, without per-vertex conversions
+            points = fp.Proxy.meshPoints
+            self.data.point.setNum(len(points))
+            self.data.point.setValues(0,len(points),points)
+            # must first delete all the old values, otherwise the remaining faces will still be shown
+            faceIndexes = fp.Proxy.meshFaceIndexes
+            self.face.coordIndex.deleteValues(0,-1)
+            self.face.coordIndex.setValues(0,len(faceIndexes),faceIndexes.tolist())
         return
 
     def getDefaultDisplayMode(self):
@@ -407,6 +570,27 @@ class _ViewProviderFHPath:
     def onChanged(self, vp, prop):
         ''' If the 'prop' property changed for the ViewProvider 'vp' '''
         #FreeCAD.Console.PrintMessage("ViewProvider onChanged(), property: " + str(prop) + "\n") # debug
+        # the coin3d nodes may not be there yet, if not attached
+        if not hasattr(self,"switch"):
+            return
+        if prop == "ShapeColor":
+            self.material.diffuseColor.setValue(vp.ShapeColor[0],vp.ShapeColor[1],vp.ShapeColor[2])
+        if prop == "Visibility" or prop=="DisplayMode":
+            if not vp.Visibility:
+                self.switch.whichChild = coin.SO_SWITCH_NONE
+            else:
+                if vp.DisplayMode == "Wireframe":
+                    self.switch.whichChild = 0
+                elif vp.DisplayMode == "Shaded":
+                    self.switch.whichChild = 1
+                else:
+                    self.switch.whichChild = coin.SO_SWITCH_ALL
+        if prop == "LineColor":
+            self.linecolor.rgb.setValue(vp.LineColor[0],vp.LineColor[1],vp.LineColor[2])
+        if prop == "LineWidth":
+            self.style2.lineWidth = vp.LineWidth
+        if prop == "Transparency":
+            self.material.transparency = vp.Transparency/100.0
 
     def claimChildren(self):
         ''' Used to place other objects as children in the tree'''
@@ -46,6 +46,8 @@ import FreeCAD, FreeCADGui, Mesh, Part, MeshPart, Draft, DraftGeomUtils, os
 import numpy as np
 from math import sqrt
 from FreeCAD import Vector
+from pivy import coin
+import EM
 
 if FreeCAD.GuiUp:
     import FreeCADGui
@@ -165,10 +167,12 @@ class _FHPlane:
         obj.addProperty("App::PropertyLinkList","Holes","EM",QT_TRANSLATE_NOOP("App::Property","Holes in the plane"))
         obj.addProperty("App::PropertyBool","FineMesh","EM",QT_TRANSLATE_NOOP("App::Property","Specifies if this the plane fine mesh is shown (i.e. composing segments)"))
         obj.addProperty("App::PropertyBool","ShowNodes","EM",QT_TRANSLATE_NOOP("App::Property","Show the internal node grid supporting the plane"))
+        obj.addProperty("App::PropertyBool","FineMeshShape","EM",QT_TRANSLATE_NOOP("App::Property","Build the plane fine mesh as a Part compound (e.g. to export it), instead of only showing it through a lightweight coin3d representation"))
         obj.Proxy = self
         self.Type = "FHPlane"
         self.FineMesh = False
         self.ShowNodes = True
+        self.clearFinePlaneMesh()
         # save the object in the class, to store or retrieve specific data from it
         # from within the class
         self.Object = obj
@@ -194,42 +198,22 @@ class _FHPlane:
                 if not obj.Base.Shape.isValid():
                     return
                 # ok, 'Base' is valid. Go on.
-                #
-                # Part::Box and Draft::Rectangle define the Plane width through
-                # a different property. For the Box it is the Width, but for the
-                # Rectangle this is the Height
-                if obj.Base.TypeId == "Part::Box":
-                    width = obj.Base.Width.Value
-                    # Also, if Part::Box, set the Plane thickness
-                    # to the Box thickness, no matter what the user entered as 'Thickness'
-                    obj.Thickness = obj.Base.Height
-                elif Draft.getType(obj.Base) == "Rectangle":
-                    width = obj.Base.Height.Value
-                else:
+                if obj.Base.TypeId != "Part::Box" and Draft.getType(obj.Base) != "Rectangle":
                     FreeCAD.Console.PrintWarning(translate("EM","Plane Base object is not a Part::Box nor a Draft::Rectangle"))
                     return
-                # The length property is instead the same for the Box and the Rectangle alike
-                length = obj.Base.Length.Value
-                # And thickness has been set, can get it
-                thickness = obj.Thickness.Value
-                # Let's calculate the segments width
-                segwid1 = width / obj.seg2
-                segwid2 = length / obj.seg1
-                # if the user specified a different segment width, assign it to the segments, unless
-                # the specified width is larger than the segment width needed to completely
-                # fill up the plane. In this case reset 'segwid1' to this width.
-                if obj.segwid1 > 0:
-                    if obj.segwid1 < segwid1:
-                        segwid1 = obj.segwid1.Value
-                    else:
-                        obj.segwid1 = segwid1
-                        FreeCAD.Console.PrintWarning(translate("EM","Plane segwid1 would cause segments overlap, re-setting segwid1 to the maximum possible"))
-                if obj.segwid2 > 0:
-                    if obj.segwid2 < segwid2:
-                        segwid2 = obj.segwid2.Value
-                    else:
-                        obj.segwid2 = segwid2
-                        FreeCAD.Console.PrintWarning(translate("EM","Plane segwid2 would cause segments overlap, re-setting segwid2 to the maximum possible"))
+                # if Part::Box, set the Plane thickness to the Box thickness,
+                # no matter what the user entered as 'Thickness'
+                if obj.Base.TypeId == "Part::Box":
+                    obj.Thickness = obj.Base.Height
+                length, width, thickness, segwid1, segwid2 = self.getPlaneDimensions(obj)
+                # if the user specified a segment width larger than the segment width needed
+                # to completely fill up the plane, reset 'segwid1' to this width.
+                if obj.segwid1 > 0 and obj.segwid1.Value != segwid1:
+                    obj.segwid1 = segwid1
+                    FreeCAD.Console.PrintWarning(translate("EM","Plane segwid1 would cause segments overlap, re-setting segwid1 to the maximum possible"))
+                if obj.segwid2 > 0 and obj.segwid2.Value != segwid2:
+                    obj.segwid2 = segwid2
+                    FreeCAD.Console.PrintWarning(translate("EM","Plane segwid2 would cause segments overlap, re-setting segwid2 to the maximum possible"))
                 # if needed, apply the same Placement of the Base object to the FHPlane object
                 if obj.Placement != obj.Base.Placement:
                     obj.Placement = obj.Base.Placement
@@ -249,6 +233,17 @@ class _FHPlane:
                 for hole in obj.Holes:
                     if hole.Placement != obj.Placement:
                         hole.Placement = obj.Placement
+                # if the geometry did not change (e.g. only 'Sigma' changed), keep the current shape.
+                # The shape is built in the plane local coordinate system, so the Placement is not
+                # part of the signature; also the plane nodes do not change the shape.
+                holes = tuple((hole.Name,hole.Type,hole.X.Value,hole.Y.Value,hole.Length.Value,hole.Width.Value,hole.Radius.Value,
+                               tuple((point.x,point.y) for point in hole.Points) if hasattr(hole,"Points") else ()) for hole in obj.Holes)
+                signature = (length,width,thickness,obj.seg1,obj.seg2,segwid1,segwid2,obj.FineMesh,
+                             hasattr(obj,"FineMeshShape") and obj.FineMeshShape,obj.ShowNodes,holes)
+                if not hasattr(self,"geometryCache"):
+                    self.geometryCache = EM.GeometryCache(self.Type)
+                if self.geometryCache.isValid(signature,obj.Shape):
+                    return
                 # Check if the user selected a coarse or a fine mesh.
                 if obj.FineMesh == False:
                     # Now we can define the coarse shape. A uniform plane will extend half-a-segment
@@ -263,11 +258,58 @@ class _FHPlane:
                     boxshape2 = Part.makeBox(length+segwid2,width,thickness,Vector(-segwid2/2,0,0))
                     # create the compound object
                     shape = Part.makeCompound([boxshape1,boxshape2])
-                else:
+                    self.clearFinePlaneMesh()
+                elif hasattr(obj,"FineMeshShape") and obj.FineMeshShape == True:
                     shape = self.makeFinePlane(obj,length,width,thickness,segwid1,segwid2)
+                    self.clearFinePlaneMesh()
+                else:
+                    self.makeFinePlaneMesh(obj,length,width,thickness,segwid1,segwid2)
+                    # make a dummy empty shape. Representation is through custom coin3d scenegraph.
+                    shape = Part.makeShell([])
         # and finally assign the shape
-        if shape:
+        if shape is not None:
             obj.Shape = shape
+            self.geometryCache.store(signature,shape)
+
+    def getPlaneDimensions(self,obj):
+        ''' Get the plane dimensions and the segments width from the current properties
+            of the FHPlane and of its 'Base' object, without changing any property
+
+            'obj': FHPlane object
+
+            Returns a tuple (length,width,thickness,segwid1,segwid2), or None
+            if the 'Base' object is not a valid Part::Box or Draft::Rectangle
+    '''
+        if not obj.Base or not obj.Base.isDerivedFrom("Part::Feature"):
+            return None
+        if obj.Base.Shape.isNull() or not obj.Base.Shape.isValid():
+            return None
+        # Part::Box and Draft::Rectangle define the Plane width through
+        # a different property. For the Box it is the Width, but for the
+        # Rectangle this is the Height. Also, the Box defines the Plane thickness.
+        if obj.Base.TypeId == "Part::Box":
+            width = obj.Base.Width.Value
+            thickness = obj.Base.Height.Value
+        elif Draft.getType(obj.Base) == "Rectangle":
+            width = obj.Base.Height.Value
+            thickness = obj.Thickness.Value
+        else:
+            return None
+        if thickness <= 0 or obj.seg1 <= 0 or obj.seg2 <= 0:
+            return None
+        # The length property is instead the same for the Box and the Rectangle alike
+        length = obj.Base.Length.Value
+        # Let's calculate the segments width
+        segwid1 = width / obj.seg2
+        segwid2 = length / obj.seg1
+        # if the user specified a different segment width, assign it to the segments, unless
+        # the specified width is larger than the segment width needed to completely
+        # fill up the plane
+        if obj.segwid1 > 0 and obj.segwid1 < segwid1:
+            segwid1 = obj.segwid1.Value
+        if obj.segwid2 > 0 and obj.segwid2 < segwid2:
+            segwid2 = obj.segwid2.Value
+        return length, width, thickness, segwid1, segwid2
 
     def adoptNode(self,node):
         ''' Adopt a node in the FHPlane
@@ -326,93 +368,176 @@ class _FHPlane:
             'segwid1' the width of the segments along the x dimension
             'segwid2' the width of the segments along the y dimension
 
-            The function returns a Shape object defining the plane.
+            The function returns a Shape object defining the plane, as a compound
+            of one Part box per segment (see makeFinePlaneLayout()).
 
             The plane is assumed to lie in the standard default position (default Placement)
             (with the Placement.Base in the origin, no rotation, and length along x, width along y, thickness along z)
             Its placement will be moved and rotated by the caller.
     '''
-        shapes=[]
-        # prepare the array of the internal nodes of the plane. 'True' means that the node
-        # exists, i.e. has not been removed due to holes in the plane.
-        # The number of nodes is equal to the number of segments along the edge plus one;
-        # (note that 'obj.seg1' refers to the # of segment parallel to the length, 'obj.seg2' parallel to the width)
-        nodes=np.full((obj.seg1+1,obj.seg2+1), True, bool)
+        boxMin, boxSize, nodePoints = self.makeFinePlaneLayout(obj,length,width,thickness,segwid1,segwid2)
+        shapes = [Part.Vertex(Vector(point[0],point[1],point[2])) for point in nodePoints.tolist()]
+        for corner, size in zip(boxMin.tolist(), boxSize.tolist()):
+            # makeBox(length, width, height, point, direction)
+            shapes.append(Part.makeBox(size[0],size[1],size[2],Vector(corner[0],corner[1],corner[2])))
+        shape = Part.makeCompound(shapes)
+        return shape
+
+    def makeFinePlaneMesh(self,obj,length,width,thickness,segwid1,segwid2):
+        ''' Compute the fine mesh plane as a coin3d representation, without creating
+            any OpenCascade shape. The parameters are the same as for makeFinePlane().
+
+            The box vertexes of the segments are stored in 'self.meshPoints' as a (N,3) float32 array,
+            the face vertex indexes in 'self.meshFaceIndexes' (see EM.makeHexahedraFaceIndexes())
+            and the internal plane nodes to be shown in 'self.nodePoints'.
+    '''
+        boxMin, boxSize, nodePoints = self.makeFinePlaneLayout(obj,length,width,thickness,segwid1,segwid2)
+        self.meshPoints = EM.makeBoxVertexes(boxMin,boxSize).reshape(-1,3).astype(np.float32)
+        self.meshFaceIndexes = EM.makeHexahedraFaceIndexes(len(boxMin))
+        self.nodePoints = nodePoints.astype(np.float32)
+
+    def clearFinePlaneMesh(self):
+        ''' Empty the coin3d representation of the fine mesh plane
+    '''
+        self.meshPoints = np.zeros((0,3),dtype=np.float32)
+        self.meshFaceIndexes = np.zeros(0,dtype=np.int32)
+        self.nodePoints = np.zeros((0,3),dtype=np.float32)
+
+    def makeFinePlaneLayout(self,obj,length,width,thickness,segwid1,segwid2):
+        ''' Compute the layout of the fine mesh plane segments. The parameters are the same
+            as for makeFinePlane().
+
+            A segment exists between two adjacent internal plane nodes, if both nodes
+            have not been removed by the holes (see makeNodeMask()).
+
+            The function returns a tuple (boxMin, boxSize, nodePoints) where 'boxMin' and 'boxSize'
+            are (N,3) arrays of the segment box corners (with the smallest coordinates) and dimensions,
+            first the segments along the plane length and then the ones along the width,
+            and 'nodePoints' is the (M,3) array of the internal plane node positions to be shown
+            (empty if 'ShowNodes' is False)
+    '''
         # find segment lengths
         seg1len=length/obj.seg1
         seg2len=width/obj.seg2
-        #
+        nodes = self.makeNodeMask(obj,seg1len,seg2len)
+        # layout segments along plane length (scanning the nodes along the length first)
+        seg2index, seg1index = np.nonzero((nodes[:-1,:] & nodes[1:,:]).T)
+        lengthMin = np.column_stack((seg1len*seg1index, -segwid1/2+seg2len*seg2index, np.zeros(len(seg1index))))
+        lengthSize = np.tile((seg1len,segwid1,thickness),(len(seg1index),1))
+        # layout segments along plane width (scanning the nodes along the width first)
+        seg1index, seg2index = np.nonzero(nodes[:,:-1] & nodes[:,1:])
+        widthMin = np.column_stack((-segwid2/2+seg1len*seg1index, seg2len*seg2index, np.zeros(len(seg1index))))
+        widthSize = np.tile((segwid2,seg2len,thickness),(len(seg1index),1))
+        boxMin = np.concatenate((lengthMin,widthMin)).reshape(-1,3)
+        boxSize = np.concatenate((lengthSize,widthSize)).reshape(-1,3)
         if obj.ShowNodes == True:
-            for seg1 in range(obj.seg1+1):
-                for seg2 in range(obj.seg2+1):
-                    shape = Part.Vertex(Vector(seg1len*seg1,seg2len*seg2,-0.1))
-                    shapes.append(shape)
-        # now process the holes
+            grid1, grid2 = np.meshgrid(seg1len*np.arange(obj.seg1+1), seg2len*np.arange(obj.seg2+1), indexing='ij')
+            nodePoints = np.column_stack((grid1.ravel(), grid2.ravel(), np.full(grid1.size,-0.1)))
+        else:
+            nodePoints = np.zeros((0,3))
+        return boxMin, boxSize, nodePoints
+
+    def makeNodeMask(self,obj,seg1len,seg2len):
+        ''' Compute the mask of the internal nodes of the plane, given:
+
+            'obj' the FHPlane object
+            'seg1len' and 'seg2len' the lengths of the segments along the length and width, respectively
+
+            The function returns a (obj.seg1+1,obj.seg2+1) boolean array, where 'True' means that the node
+            exists, i.e. has not been removed due to holes in the plane.
+    '''
+        # prepare the array of the internal nodes of the plane.
+        # The number of nodes is equal to the number of segments along the edge plus one;
+        # (note that 'obj.seg1' refers to the # of segment parallel to the length, 'obj.seg2' parallel to the width)
+        nodes=np.full((obj.seg1+1,obj.seg2+1), True, bool)
+        # now process the holes. The mask of each hole is cached, so when a hole changes
+        # only its own mask is computed again
+        holeMasks = {}
         for hole in obj.Holes:
-            if hole.Type == 'Point':
-                seg1seg2pos = self.findNearestNode(hole.X, hole.Y, obj, seg1len, seg2len)
-                # mark the node as deleted
-                nodes[seg1seg2pos] = False
-            elif hole.Type == 'Rect':
-                seg1seg2corner1 = self.findNearestNode(hole.X, hole.Y, obj, seg1len, seg2len)
-                seg1seg2corner2 = self.findNearestNode(hole.X + hole.Length, hole.Y + hole.Width, obj, seg1len, seg2len)
-                # hole.Length and hole.Width may be negative. Must check which comes first
-                if seg1seg2corner1[0] <= seg1seg2corner2[0]:
-                    xstart = seg1seg2corner1[0]
-                    xend = seg1seg2corner2[0]
-                else:
-                    xstart = seg1seg2corner2[0]
-                    xend = seg1seg2corner1[0]
-                if seg1seg2corner1[1] <= seg1seg2corner2[1]:
-                    ystart = seg1seg2corner1[1]
-                    yend = seg1seg2corner2[1]
-                else:
-                    ystart = seg1seg2corner2[1]
-                    yend = seg1seg2corner1[1]
-                # mark the nodes as deleted
-                nodes[xstart:xend+1,ystart:yend+1] = False
-            elif hole.Type == 'Circle':
-                seg1seg2pos = self.findNearestNode(hole.X, hole.Y, obj, seg1len, seg2len)
-                # find the offset between the center of the circle and the actual nearest plane node node
-                offsetX = seg1seg2pos[0]*seg1len - hole.X.Value
-                offsetY = seg1seg2pos[1]*seg2len - hole.Y.Value
-                # check if the offset is larger than the radius
-                if abs(offsetX) > hole.Radius.Value or abs(offsetY) > hole.Radius.Value:
-                    FreeCAD.Console.PrintWarning(translate("EM","Circular hole offset w.r.t. the nearest node plane is greater than hole radius. Hole not performed."))
-                # 'nodes_up' and 'nodes_down' are the (relative) number of hole nodes along plane width
-                # we will then step from 'nodes_down' to 'nodes_up' and for each of these values
-                # we will calculate the (relative) extent from 'nodes_left' to 'node_right' along the length
-                # corresponding to the hole radius and we will remove all the contained nodes
-                nodes_up = int( (hole.Radius.Value - offsetY)/seg2len)
-                nodes_down = int( (-hole.Radius.Value - offsetY)/seg2len)
-                for nodeY in range(nodes_down,nodes_up+1):
-                    side = sqrt(hole.Radius.Value**2 - (offsetY+nodeY*seg2len)**2)
-                    nodes_left = int( (-side - offsetX)/seg1len)
-                    nodes_right = int( (side - offsetX)/seg1len)
-                    for nodeX in range(nodes_left,nodes_right+1):
-                        # delete node, but only if internal to the plane!
-                        if nodeY+seg1seg2pos[1] >= 0 and nodeY+seg1seg2pos[1] <= obj.seg2 and nodeX+seg1seg2pos[0] >= 0 and nodeX+seg1seg2pos[0] <= obj.seg1:
-                            nodes[nodeX+seg1seg2pos[0], nodeY+seg1seg2pos[1]] = False
-            else:
-                FreeCAD.Console.PrintWarning(translate("EM","Unknown hole type in the FHPlane!"))
-        # layout segments along plane length
-        for seg2 in range(obj.seg2+1):
-            for seg1 in range(obj.seg1):
-                # if both starting and ending nodes exist
-                if nodes[seg1][seg2] and nodes[seg1+1][seg2]:
-                    # makeBox(length, width, height, point, direction)
-                    boxshape = Part.makeBox(seg1len,segwid1,thickness,Vector(seg1len*seg1,-segwid1/2+seg2len*seg2,0))
-                    shapes.append(boxshape)
-        # layout segments along plane width
-        for seg1 in range(obj.seg1+1):
-            for seg2 in range(obj.seg2):
-                # if both starting and ending nodes exist
-                if nodes[seg1][seg2] and nodes[seg1][seg2+1]:
-                    # makeBox(length, width, height, point, direction)
-                    boxshape = Part.makeBox(segwid2,seg2len,thickness,Vector(-segwid2/2+seg1len*seg1,seg2len*seg2,0))
-                    shapes.append(boxshape)
-        shape = Part.makeCompound(shapes)
-        return shape
+            mask = self.getHoleMask(obj,hole,seg1len,seg2len)
+            if mask is not None:
+                nodes &= ~mask
+                holeMasks[hole.Name] = self.holeMasks[hole.Name]
+        # drop the masks of the holes removed from the plane
+        self.holeMasks = holeMasks
+        return nodes
+
+    def getHoleMask(self,obj,hole,seg1len,seg2len):
+        ''' Compute the mask of the internal plane nodes removed by a hole, given:
+
+            'obj' the FHPlane object
+            'hole' the FHPlaneHole object
+            'seg1len' and 'seg2len' the lengths of the segments along the length and width, respectively
+
+            The masks are computed on the whole node grid with Numpy, and cached in 'self.holeMasks'
+            by hole name, together with the hole and grid parameters they depend on.
+
+            The function returns a (obj.seg1+1,obj.seg2+1) boolean array, where 'True' means that the node
+            is removed by the hole, or None if the hole type is unknown
+    '''
+        points = tuple((point.x,point.y) for point in hole.Points) if hasattr(hole,"Points") else ()
+        key = (hole.Type,hole.X.Value,hole.Y.Value,hole.Length.Value,hole.Width.Value,hole.Radius.Value,points,
+               obj.seg1,obj.seg2,seg1len,seg2len)
+        if not hasattr(self,"holeMasks"):
+            self.holeMasks = {}
+        if hole.Name in self.holeMasks and self.holeMasks[hole.Name][0] == key:
+            return self.holeMasks[hole.Name][1]
+        mask = np.full((obj.seg1+1,obj.seg2+1), False, bool)
+        if hole.Type == 'Point':
+            seg1seg2pos = self.findNearestNode(hole.X, hole.Y, obj, seg1len, seg2len)
+            # mark the node as deleted
+            mask[seg1seg2pos] = True
+        elif hole.Type == 'Rect':
+            seg1seg2corner1 = self.findNearestNode(hole.X, hole.Y, obj, seg1len, seg2len)
+            seg1seg2corner2 = self.findNearestNode(hole.X + hole.Length, hole.Y + hole.Width, obj, seg1len, seg2len)
+            # hole.Length and hole.Width may be negative. Must check which comes first
+            xstart = min(seg1seg2corner1[0],seg1seg2corner2[0])
+            xend = max(seg1seg2corner1[0],seg1seg2corner2[0])
+            ystart = min(seg1seg2corner1[1],seg1seg2corner2[1])
+            yend = max(seg1seg2corner1[1],seg1seg2corner2[1])
+            # mark the nodes as deleted
+            mask[xstart:xend+1,ystart:yend+1] = True
+        elif hole.Type == 'Circle':
+            seg1seg2pos = self.findNearestNode(hole.X, hole.Y, obj, seg1len, seg2len)
+            radius = hole.Radius.Value
+            # find the offset between the center of the circle and the actual nearest plane node node
+            offsetX = seg1seg2pos[0]*seg1len - hole.X.Value
+            offsetY = seg1seg2pos[1]*seg2len - hole.Y.Value
+            # check if the offset is larger than the radius
+            if abs(offsetX) > radius or abs(offsetY) > radius:
+                FreeCAD.Console.PrintWarning(translate("EM","Circular hole offset w.r.t. the nearest node plane is greater than hole radius. Hole not performed."))
+            # 'nodes_up' and 'nodes_down' are the (relative) number of hole nodes along plane width.
+            # For each of these values we calculate the (relative) extent from 'nodes_left' to 'nodes_right'
+            # along the length corresponding to the hole radius, and we remove all the contained nodes
+            # (all the rows at once; the int() truncation towards zero is kept, as np.trunc())
+            nodes_up = int( (radius - offsetY)/seg2len)
+            nodes_down = int( (-radius - offsetY)/seg2len)
+            nodeY = np.arange(nodes_down,nodes_up+1)
+            with np.errstate(invalid='ignore'):
+                side = np.sqrt(radius**2 - (offsetY+nodeY*seg2len)**2)
+            nodes_left = np.trunc((-side - offsetX)/seg1len)
+            nodes_right = np.trunc((side - offsetX)/seg1len)
+            # relative position of every plane node w.r.t. the nearest node
+            nodeX = np.arange(obj.seg1+1) - seg1seg2pos[0]
+            rows = nodeY + seg1seg2pos[1]
+            # delete nodes, but only if internal to the plane!
+            inside = (rows >= 0) & (rows <= obj.seg2)
+            mask[:,rows[inside]] = (nodeX[:,None] >= nodes_left[inside]) & (nodeX[:,None] <= nodes_right[inside])
+        elif hole.Type == 'Polygon':
+            if len(points) >= 3:
+                # the node grid, relative to the hole X,Y position
+                gridX = (seg1len*np.arange(obj.seg1+1) - hole.X.Value)[:,None]
+                gridY = (seg2len*np.arange(obj.seg2+1) - hole.Y.Value)[None,:]
+                # even-odd rule: count the polygon edges crossed by a ray from each node along +x
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    for (x1, y1), (x2, y2) in zip(points, points[1:] + points[:1]):
+                        crossing = ((y1 > gridY) != (y2 > gridY)) & (gridX < (x2 - x1) * (gridY - y1) / (y2 - y1) + x1)
+                        mask ^= crossing
+        else:
+            FreeCAD.Console.PrintWarning(translate("EM","Unknown hole type in the FHPlane!"))
+            return None
+        self.holeMasks[hole.Name] = (key, mask)
+        return mask
 
     def findNearestNode(self,x_coord,y_coord,obj,seg1len,seg2len):
         ''' Find the plane node nearest to the given point (in local plane coordinates)
@@ -526,24 +651,31 @@ class _FHPlane:
             fid.write("+         rh=" + str(self.Object.rh) + "\n")
         # Output the plane exposed nodes
         # Nstr (x_val,y_val,z_val)
-        if len(self.Object.Nodes) > 0:
-            for node in self.Object.Nodes:
-                # plane nodes are special nodes. We assume that a node 'N' definition already exist
-                # with the 'node.Label'; so we define an internal plane node with the same name
-                # but with an additional extension, and then we'll '.equiv' the two
-                node.Proxy.serialize(fid, EMFHNODE_DEF_NODENAMEEXT)
+        nodes = self.Object.Nodes
+        if len(nodes) > 0:
+            # plane nodes are special nodes. We assume that a node 'N' definition already exist
+            # with the 'node.Label'; so we define an internal plane node with the same name
+            # but with an additional extension, and then we'll '.equiv' the two
+            EM.serializeFHNodes(fid, nodes, EMFHNODE_DEF_NODENAMEEXT)
         # hole <hole-type> (val1,val2,....)
         #   hole point (x,y,z)
         #   hole rect (x1,y1,z1,x2,y2,z2)
         #   hole circle (x,y,z,r)
         if len(self.Object.Holes) > 0:
+            seg1len = length/self.Object.seg1
+            seg2len = width/self.Object.seg2
             for hole in self.Object.Holes:
-                hole.Proxy.serialize(fid)
+                if hole.Type == "Polygon":
+                    # FastHenry does not support polygonal holes, so pass the nodes inside the polygon
+                    mask = self.getHoleMask(self.Object,hole,seg1len,seg2len)
+                    nodePositions = [Vector(seg1len*seg1,seg2len*seg2,hole.Z.Value) for seg1, seg2 in np.argwhere(mask).tolist()]
+                    hole.Proxy.serialize(fid,nodePositions)
+                else:
+                    hole.Proxy.serialize(fid)
         fid.write("\n")
-        if len(self.Object.Nodes) > 0:
+        if len(nodes) > 0:
             fid.write("* Connecting internal plane nodes to actual nodes\n")
-            for node in self.Object.Nodes:
-                fid.write(".equiv N" + node.Label + " N" + node.Label + EMFHNODE_DEF_NODENAMEEXT + "\n")
+            fid.write("".join([".equiv N" + node.Label + " N" + node.Label + EMFHNODE_DEF_NODENAMEEXT + "\n" for node in nodes]))
             fid.write("\n")
 
     def __getstate__(self):
@@ -552,6 +684,24 @@ class _FHPlane:
     def __setstate__(self,state):
         if state:
             self.Type = state
+        # the coin3d representation of the fine mesh is not stored, see onDocumentRestored()
+        self.clearFinePlaneMesh()
+
+    def onDocumentRestored(self, obj):
+        ''' Called when the document containing the object has been restored
+    '''
+        self.Object = obj
+        # older FHPlane objects do not have the 'FineMeshShape' property
+        if not hasattr(obj,"FineMeshShape"):
+            obj.addProperty("App::PropertyBool","FineMeshShape","EM",QT_TRANSLATE_NOOP("App::Property","Build the plane fine mesh as a Part compound (e.g. to export it), instead of only showing it through a lightweight coin3d representation"))
+        # the coin3d representation of the fine mesh must be re-created, from the restored
+        # properties only: the other properties and document objects are not changed
+        if obj.FineMesh == True and obj.FineMeshShape == False:
+            dimensions = self.getPlaneDimensions(obj)
+            if dimensions is not None:
+                self.makeFinePlaneMesh(obj,*dimensions)
+                if FreeCAD.GuiUp and obj.ViewObject is not None and hasattr(obj.ViewObject.Proxy,"updateData"):
+                    obj.ViewObject.Proxy.updateData(obj,"Shape")
 
 class _ViewProviderFHPlane:
     def __init__(self, obj):
@@ -565,11 +715,88 @@ class _ViewProviderFHPlane:
         # members of the class, so __getstate__() and __setstate__() skip them);
         # so we must "re-attach" (re-create) the 'self.Object'
         self.Object = obj.Object
+        self.VObject = obj
+        # representation of the fine mesh plane, bypassing the Part shape (see _FHPlane.makeFinePlaneMesh())
+        self.switch = coin.SoSwitch()
+        self.hints = coin.SoShapeHints()
+        self.style1 = coin.SoDrawStyle()
+        self.style2 = coin.SoDrawStyle()
+        self.material = coin.SoMaterial()
+        self.linecolor = coin.SoBaseColor()
+        self.data = coin.SoCoordinate3()
+        self.face = coin.SoIndexedFaceSet()
+        self.nodeSwitch = coin.SoSwitch()
+        self.nodeStyle = coin.SoDrawStyle()
+        self.nodeColor = coin.SoBaseColor()
+        self.nodeData = coin.SoCoordinate3()
+        self.nodePoints = coin.SoPointSet()
+        # init
+        # A shape hints tells the ordering of polygons.
+        # This ensures double-sided lighting.
+        self.hints.vertexOrdering = coin.SoShapeHints.COUNTERCLOCKWISE
+        self.hints.faceType = coin.SoShapeHints.CONVEX
+        # init styles
+        self.style1.style = coin.SoDrawStyle.FILLED
+        self.style2.style = coin.SoDrawStyle.LINES
+        self.style2.lineWidth = self.VObject.LineWidth
+        self.nodeStyle.pointSize = self.VObject.PointSize
+        # init color
+        self.material.diffuseColor.setValue(self.VObject.ShapeColor[0],self.VObject.ShapeColor[1],self.VObject.ShapeColor[2])
+        self.material.transparency = self.VObject.Transparency/100.0
+        self.linecolor.rgb.setValue(self.VObject.LineColor[0],self.VObject.LineColor[1],self.VObject.LineColor[2])
+        self.nodeColor.rgb.setValue(self.VObject.PointColor[0],self.VObject.PointColor[1],self.VObject.PointColor[2])
+        # instructs to visit the first child (this is used to toggle visiblity)
+        self.switch.whichChild = coin.SO_SWITCH_ALL
+        self.nodeSwitch.whichChild = coin.SO_SWITCH_ALL
+        #  scene
+        # not using a separator, but a FreeCAD Selection node
+        sep = coin.SoType.fromName("SoFCSelection").createInstance()
+        sep.documentName.setValue(self.Object.Document.Name)
+        sep.objectName.setValue(self.Object.Name)
+        sep.subElementName.setValue("Face")
+        # now adding the common children
+        sep.addChild(self.hints)
+        sep.addChild(self.data)
+        sep.addChild(self.switch)
+        # and finally the two groups, the first is the contour lines,
+        # the second is the filled faces, so we can switch between
+        # "Flat Lines", "Shaded" and "Wireframe". Note: not implementing "Points"
+        group0Line = coin.SoGroup()
+        self.switch.addChild(group0Line)
+        group0Line.addChild(self.style2)
+        group0Line.addChild(self.linecolor)
+        group0Line.addChild(self.face)
+        group1Face = coin.SoGroup()
+        self.switch.addChild(group1Face)
+        group1Face.addChild(self.material)
+        group1Face.addChild(self.style1)
+        group1Face.addChild(self.face)
+        # the internal plane nodes
+        nodeSep = coin.SoSeparator()
+        nodeSep.addChild(self.nodeStyle)
+        nodeSep.addChild(self.nodeColor)
+        nodeSep.addChild(self.nodeData)
+        nodeSep.addChild(self.nodePoints)
+        self.nodeSwitch.addChild(nodeSep)
+        self.VObject.RootNode.addChild(sep)
+        self.VObject.RootNode.addChild(self.nodeSwitch)
         return
 
     def updateData(self, fp, prop):
         ''' If a property of the handled feature has changed we have the chance to handle this here '''
         #FreeCAD.Console.PrintMessage("ViewProvider updateData(),  property: " + str(prop) + "\n") # debug
+        if prop == "Shape" and hasattr(self,"data") and hasattr(fp.Proxy,"meshPoints"):
+            # the (N,3) float32 arrays are passed as they are, without per-vertex conversions
+            points = fp.Proxy.meshPoints
+            self.data.point.setNum(len(points))
+            self.data.point.setValues(0,len(points),points)
+            # must first delete all the old values, otherwise the remaining faces will still be shown
+            faceIndexes = fp.Proxy.meshFaceIndexes
+            self.face.coordIndex.deleteValues(0,-1)
+            self.face.coordIndex.setValues(0,len(faceIndexes),faceIndexes.tolist())
+            nodePoints = fp.Proxy.nodePoints
+            self.nodeData.point.setNum(len(nodePoints))
+            self.nodeData.point.setValues(0,len(nodePoints),nodePoints)
         return
 
     def getDefaultDisplayMode(self):
@@ -579,6 +806,33 @@ class _ViewProviderFHPlane:
     def onChanged(self, vp, prop):
         ''' If the 'prop' property changed for the ViewProvider 'vp' '''
         #FreeCAD.Console.PrintMessage("ViewProvider onChanged(), property: " + str(prop) + "\n") # debug
+        # the coin3d nodes may not be there yet, if not attached
+        if not hasattr(self,"switch"):
+            return
+        if prop == "ShapeColor":
+            self.material.diffuseColor.setValue(vp.ShapeColor[0],vp.ShapeColor[1],vp.ShapeColor[2])
+        if prop == "Visibility" or prop=="DisplayMode":
+            if not vp.Visibility:
+                self.switch.whichChild = coin.SO_SWITCH_NONE
+                self.nodeSwitch.whichChild = coin.SO_SWITCH_NONE
+            else:
+                self.nodeSwitch.whichChild = coin.SO_SWITCH_ALL
+                if vp.DisplayMode == "Wireframe":
+                    self.switch.whichChild = 0
+                elif vp.DisplayMode == "Shaded":
+                    self.switch.whichChild = 1
+                else:
+                    self.switch.whichChild = coin.SO_SWITCH_ALL
+        if prop == "LineColor":
+            self.linecolor.rgb.setValue(vp.LineColor[0],vp.LineColor[1],vp.LineColor[2])
+        if prop == "LineWidth":
+            self.style2.lineWidth = vp.LineWidth
+        if prop == "PointColor":
+            self.nodeColor.rgb.setValue(vp.PointColor[0],vp.PointColor[1],vp.PointColor[2])
+        if prop == "PointSize":
+            self.nodeStyle.pointSize = vp.PointSize
+        if prop == "Transparency":
+            self.material.transparency = vp.Transparency/100.0
 
     def claimChildren(self):
         ''' Used to place other objects as childrens in the tree'''
@@ -32,7 +32,7 @@ __url__ = "http://www.fastfieldsolvers.com"
 # defines
 #
 # default node color
-EMFHPLANEHOLE_TYPES = ["Point", "Rect", "Circle"]
+EMFHPLANEHOLE_TYPES = ["Point", "Rect", "Circle", "Polygon"]
 EMFHPLANEHOLE_DEFTYPE = "Point"
 
 import FreeCAD, FreeCADGui, Mesh, Part, MeshPart, Draft, DraftGeomUtils, os
@@ -54,7 +54,7 @@ else:
 __dir__ = os.path.dirname(__file__)
 iconPath = os.path.join( __dir__, 'Resources' )
 
-def makeFHPlaneHole(baseobj=None,X=0.0,Y=0.0,Z=0.0,holetype=None,length=None,width=None,radius=None,name='FHPlaneHole'):
+def makeFHPlaneHole(baseobj=None,X=0.0,Y=0.0,Z=0.0,holetype=None,length=None,width=None,radius=None,points=None,name='FHPlaneHole'):
     ''' Creates a FastHenry conductive plane hole (within a uniform plane 'G' statement in FastHenry)
 
         'baseobj' is the point object whose position is used as base for the FNNode.
@@ -64,12 +64,14 @@ def makeFHPlaneHole(baseobj=None,X=0.0,Y=0.0,Z=0.0,holetype=None,length=None,wid
         'Y' y coordinate of the hole, in absolute coordinate system
         'Z' z coordinate of the hole, in absolute coordinate system
         'holetype' is the type of hole. Allowed values are:
-            "Point", "Rect", "Circle"
+            "Point", "Rect", "Circle", "Polygon"
         'length' is the length of the hole (along the x dimension),
             in case of rectangular "Rect" hole
         'width' the width of the hole (along the y dimension),
             in case of rectangular "Rect" hole
         'radius' is the radius of the hole, in case of circular "Circle" hole
+        'points' is the list of the polygon vertexes (FreeCAD.Vector), relative to
+            the hole X,Y,Z position, in case of polygonal "Polygon" hole
         'name' is the name of the object
 
         The FHPlaneHole has to be used only within a FHPlane object. The FHPlaneHole
@@ -112,6 +114,8 @@ def makeFHPlaneHole(baseobj=None,X=0.0,Y=0.0,Z=0.0,holetype=None,length=None,wid
     if radius:
         # using a conversion and not catching errors, for input validation
         obj.Radius = float(radius)
+    if points:
+        obj.Points = points
     # set the hole reference point coordinates
     obj.Proxy.setAbsCoord(Vector(X,Y,Z))
     # force recompute to show the Python object
@@ -129,6 +133,7 @@ class _FHPlaneHole:
         obj.addProperty("App::PropertyLength","Length","EM",QT_TRANSLATE_NOOP("App::Property","Rectangular hole length (along x from node base point)"))
         obj.addProperty("App::PropertyLength","Width","EM",QT_TRANSLATE_NOOP("App::Property","Rectangular hole width (along y from node base point)"))
         obj.addProperty("App::PropertyLength","Radius","EM",QT_TRANSLATE_NOOP("App::Property","Circular hole radius"))
+        obj.addProperty("App::PropertyVectorList","Points","EM",QT_TRANSLATE_NOOP("App::Property","Polygonal hole vertexes (relative to the node base point)"))
         obj.addProperty("App::PropertyEnumeration","Type","EM",QT_TRANSLATE_NOOP("App::Property","The type of FastHenry plane hole"))
         obj.Proxy = self
         self.Type = "FHPlaneHole"
@@ -179,6 +184,15 @@ class _FHPlaneHole:
                 edge = circle.toShape()
                 wire = Part.Wire(edge)
                 shape = Part.Face(wire)
+        elif obj.Type == "Polygon":
+            if len(obj.Points) < 3:
+                FreeCAD.Console.PrintWarning(translate("EM","Cannot create a FHPlaneHole polygonal hole with less than three vertexes"))
+            else:
+                v0 = self.getRelCoord()
+                vertexes = [v0 + point for point in obj.Points]
+                # and create the polygon
+                poly = Part.makePolygon(vertexes + [vertexes[0]])
+                shape = Part.Face(poly)
         if shape:
             obj.Shape = shape
 
@@ -192,8 +206,28 @@ class _FHPlaneHole:
             # so we must "re-attach" (re-create) the 'self.Object'
             self.Object = obj
 
-    def serialize(self,fid):
+    def onDocumentRestored(self, obj):
+        ''' Called when the document containing the object has been restored
+'''
+        self.Object = obj
+        # older FHPlaneHole objects do not have the 'Points' property and the "Polygon" type
+        if not hasattr(obj,"Points"):
+            obj.addProperty("App::PropertyVectorList","Points","EM",QT_TRANSLATE_NOOP("App::Property","Polygonal hole vertexes (relative to the node base point)"))
+        if obj.getEnumerationsOfProperty("Type") != EMFHPLANEHOLE_TYPES:
+            holetype = obj.Type
+            obj.Type = EMFHPLANEHOLE_TYPES
+            obj.Type = holetype
+
+    def serialize(self,fid,nodePositions=None):
         ''' Serialize the object to the 'fid' file descriptor
+
+        'fid': the file descriptor
+        'nodePositions': list of the positions (FreeCAD.Vector, relative to the hole Placement)
+            of the plane nodes inside the hole. Used only by "Polygon" holes, see below.
+            Defaults to None.
+
+        FastHenry does not support polygonal holes, so the plane nodes inside a "Polygon"
+        hole (as found by the FHPlane) are removed one by one, as point holes.
 '''
         pos = self.getAbsCoord()
         if self.Object.Type == "Point":
@@ -217,6 +251,12 @@ class _FHPlaneHole:
         elif self.Object.Type == "Circle":
             # hole circle (x,y,z,r)
             fid.write("+         hole circle (" + str(pos.x) + "," + str(pos.y) + "," + str(pos.z) + "," + str(self.Object.Radius.Value) + ")")
+        elif self.Object.Type == "Polygon":
+            if not nodePositions:
+                return
+            positions = [self.Object.Placement.multVec(nodePos) for nodePos in nodePositions]
+            # hole point (x,y,z), for each node
+            fid.write("\n".join(["+         hole point (" + str(nodePos.x) + "," + str(nodePos.y) + "," + str(nodePos.z) + ")" for nodePos in positions]))
         fid.write("\n")
 
     def getAbsCoord(self):
@@ -82,6 +82,14 @@ def makeFHPort(nodePos=None,nodeNeg=None,name='FHPort'):
     # return the newly created Python object
     return obj
 
+def serializeFHPorts(fid,ports):
+    ''' Serialize a list of FHPorts to the 'fid' file descriptor, with a single write
+
+        'fid': the file descriptor
+        'ports': the list of FHPort objects
+'''
+    fid.write("".join([".external N" + port.NodePos.Label + " N" + port.NodeNeg.Label + "\n" for port in ports]))
+
 class _FHPort:
     '''The EM FastHenry Port object'''
     def __init__(self, obj):
@@ -159,7 +167,7 @@ class _FHPort:
     def serialize(self,fid):
         ''' Serialize the object to the 'fid' file descriptor
     '''
-        fid.write(".external N" + self.Object.NodePos.Label + " N" + self.Object.NodeNeg.Label + "\n")
+        serializeFHPorts(fid,[self.Object])
 
     def __getstate__(self):
         return self.Type
@@ -108,6 +108,43 @@ def makeFHSegment(baseobj=None,nodeStart=None,nodeEnd=None,width=None,height=Non
     # return the newly created Python object
     return obj
 
+def formatFHSegment(name,nodeStart,nodeEnd,width,height,sigma,ww,nhinc,nwinc,rh,rw):
+    ''' Format a FastHenry segment statement ('E' statement in FastHenry)
+
+        'name': the segment name (without the 'E' prefix)
+        'nodeStart', 'nodeEnd': the start and end node names (without the 'N' prefix)
+        'width', 'height', 'sigma', 'nhinc', 'nwinc', 'rh', 'rw': the segment parameters
+            (the optional ones are output only if greater than zero)
+        'ww': the cross-section direction (Vector), output only if not null
+
+        Returns the statement string, including the end of line
+'''
+    line = "E" + name + " N" + nodeStart + " N" + nodeEnd + " w=" + str(width) + " h=" + str(height)
+    if sigma > 0:
+        line += " sigma=" + str(sigma)
+    if ww.Length >= EM.EMFHSEGMENT_LENTOL:
+        line += " wx=" + str(ww.x) + " wy=" + str(ww.y) + " wz=" + str(ww.z)
+    if nhinc > 0:
+        line += " nhinc=" + str(nhinc)
+    if nwinc > 0:
+        line += " nwinc=" + str(nwinc)
+    if rh > 0:
+        line += " rh=" + str(rh)
+    if rw > 0:
+        line += " rw=" + str(rw)
+    return line + "\n"
+
+def serializeFHSegments(fid,segments):
+    ''' Serialize a list of FHSegments to the 'fid' file descriptor, with a single write
+
+        'fid': the file descriptor
+        'segments': the list of FHSegment objects
+'''
+    lines = [formatFHSegment(segment.Label,segment.NodeStart.Label,segment.NodeEnd.Label,
+                             segment.Width.Value,segment.Height.Value,segment.Sigma,segment.ww,
+                             segment.nhinc,segment.nwinc,segment.rh,segment.rw) for segment in segments]
+    fid.write("".join(lines))
+
 class _FHSegment:
     '''The EM FastHenry Segment object'''
     def __init__(self, obj):
@@ -192,10 +229,17 @@ class _FHSegment:
         ''' Compute and assign the shape to the object 'obj' '''
         n1 = obj.NodeStart.Proxy.getAbsCoord()
         n2 = obj.NodeEnd.Proxy.getAbsCoord()
+        # if the geometry did not change (e.g. only 'Sigma' changed), keep the current shape
+        signature = (n1.x,n1.y,n1.z,n2.x,n2.y,n2.z,obj.Width.Value,obj.Height.Value,obj.ww.x,obj.ww.y,obj.ww.z)
+        if not hasattr(self,"geometryCache"):
+            self.geometryCache = EM.GeometryCache(self.Type)
+        if self.geometryCache.isValid(signature,obj.Shape):
+            return
         shape = EM.makeSegShape(n1,n2,obj.Width,obj.Height,obj.ww)
         # shape may be None, e.g. if endpoints coincide. Do not assign in this case
         if shape:
             obj.Shape = shape
+            self.geometryCache.store(signature,shape)
 
     def onChanged(self, obj, prop):
         ''' take action if an object property 'prop' changed
@@ -211,21 +255,7 @@ class _FHSegment:
     def serialize(self,fid):
         ''' Serialize the object to the 'fid' file descriptor
     '''
-        fid.write("E" + self.Object.Label + " N" + self.Object.NodeStart.Label + " N" + self.Object.NodeEnd.Label)
-        fid.write(" w=" + str(self.Object.Width.Value) + " h=" + str(self.Object.Height.Value))
-        if self.Object.Sigma > 0:
-            fid.write(" sigma=" + str(self.Object.Sigma))
-        if self.Object.ww.Length >= EM.EMFHSEGMENT_LENTOL:
-            fid.write(" wx=" + str(self.Object.ww.x) + " wy=" + str(self.Object.ww.y) + " wz=" + str(self.Object.ww.z))
-        if self.Object.nhinc > 0:
-            fid.write(" nhinc=" + str(self.Object.nhinc))
-        if self.Object.nwinc > 0:
-            fid.write(" nwinc=" + str(self.Object.nwinc))
-        if self.Object.rh > 0:
-            fid.write(" rh=" + str(self.Object.rh))
-        if self.Object.rw > 0:
-            fid.write(" rw=" + str(self.Object.rw))
-        fid.write("\n")
+        serializeFHSegments(fid,[self.Object])
 
     def __getstate__(self):
         return self.Type
@@ -39,9 +39,12 @@ EMFHNODE_DEF_NODECOLOR = (1.0,0.0,0.0)
 EMFHSEGMENT_PARTOL = 0.01
 # tolerance in length
 EMFHSEGMENT_LENTOL = 1e-8
+# vertex indexes of the faces of a segment (front, back, left, right, top, bottom), see makeSegShape()
+EMHEXAHEDRON_FACES = [[0,1,2,3],[4,7,6,5],[0,3,7,4],[1,5,6,2],[3,2,6,7],[0,4,5,1]]
 
 import FreeCAD, Part, Draft
 from FreeCAD import Vector
+import numpy as np
 import EM
 
 if FreeCAD.GuiUp:
@@ -91,66 +94,177 @@ def makeSegShape(n1,n2,width,height,ww):
     # do not accept coincident nodes
     if (n2-n1).Length < EMFHSEGMENT_LENTOL:
         return None
+    vertexes = makeSegVertexes([[n1.x,n1.y,n1.z]],[[n2.x,n2.y,n2.z]],float(width),float(height),[[ww.x,ww.y,ww.z]])
+    segShell = makeSegShells(vertexes)[0]
+    return segShell
+
+def makeSegVertexes(n1,n2,width,height,ww):
+    ''' Compute the vertexes of a set of segments given:
+
+        'n1': (N,3) array of the start node positions
+        'n2': (N,3) array of the end node positions
+        'width': (N,) array of the segment widths, or a single width for all the segments
+        'height': (N,) array of the segment heights, or a single height for all the segments
+        'ww': (N,3) array of the cross-section directions (along width). If a direction
+            is zero, or parallel to the segment length, the FastHenry default is used (see makeSegShape())
+
+        The segments with coincident nodes give degenerate (zero length) hexahedra.
+
+        Returns a (N,8,3) array of the segment vertexes, in the order of makeSegShape()
+'''
+    n1 = np.asarray(n1, dtype=np.float64).reshape(-1,3)
+    n2 = np.asarray(n2, dtype=np.float64).reshape(-1,3)
+    ww = np.asarray(ww, dtype=np.float64).reshape(-1,3)
+    width = np.broadcast_to(np.asarray(width, dtype=np.float64), (len(n1),))
+    height = np.broadcast_to(np.asarray(height, dtype=np.float64), (len(n1),))
+    zAxis = np.array([0.0,0.0,1.0])
     # vector along length
-    wl = n2-n1;
+    wl = n2-n1
+    wlLength = np.linalg.norm(wl, axis=1)
     # calculate the vector along the height
-    wh = (ww.cross(wl))
-    # if cross-section is not defined, by default the width vector
-    # is assumed to lie in x-y plane perpendicular to the length.
-    # If the length direction is parallel to the z-axis, then
-    # the width is assumed along the x-axis.
-    # The same is done if 'ww' has been defined parallel to 'wl'
-    if ww.Length < EMFHSEGMENT_LENTOL or wh.Length < EMFHSEGMENT_LENTOL:
-        # if length parallel to the z-axis (note that getAngle() always returns a value
-        # between 0 and 180)
-        angle = wl.getAngle(Vector(0,0,1))*FreeCAD.Units.Radian
-        if angle < EMFHSEGMENT_PARTOL or angle > 180-EMFHSEGMENT_PARTOL:
-            ww = Vector(1,0,0)
-        else:
-            ww = (wl.cross(Vector(0,0,1))).normalize()
+    wh = np.cross(ww,wl)
+    # where the cross-section is not defined, or 'ww' is parallel to 'wl', use the default
+    # width vector, as in makeSegShape()
+    default = (np.linalg.norm(ww, axis=1) < EMFHSEGMENT_LENTOL) | (np.linalg.norm(wh, axis=1) < EMFHSEGMENT_LENTOL)
+    if np.any(default):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            angle = np.degrees(np.arccos(np.clip(wl[:,2] / wlLength, -1.0, 1.0)))
+            parallel = (angle < EMFHSEGMENT_PARTOL) | (angle > 180-EMFHSEGMENT_PARTOL)
+            wwDefault = np.cross(wl,zAxis)
+            wwDefault = wwDefault / np.linalg.norm(wwDefault, axis=1).reshape(-1,1)
+        wwDefault[parallel] = (1.0,0.0,0.0)
+        ww = np.where(default.reshape(-1,1), wwDefault, ww)
         # and re-calculate 'wh' since we changed 'ww'
-        wh = (ww.cross(wl))
-    # normalize the freshly calculated 'wh'
-    wh.normalize()
-    # copy ww as the multiply() method changes the vector on which is called
-    wwHalf = Vector(ww)
-    # must normalize. We don't want to touch 'ww', as this is user's defined
-    wwHalf.normalize()
-    wwHalf.multiply(width / 2)
-    # copy wh as the multiply() method changes the vector on which is called
-    whHalf = Vector(wh)
-    whHalf.multiply(height / 2)
-    # calculate the vertexes
-    v11 = n1 - wwHalf - whHalf
-    v12 = n1 + wwHalf - whHalf
-    v13 = n1 + wwHalf + whHalf
-    v14 = n1 - wwHalf + whHalf
-    v21 = n2 - wwHalf - whHalf
-    v22 = n2 + wwHalf - whHalf
-    v23 = n2 + wwHalf + whHalf
-    v24 = n2 - wwHalf + whHalf
-    # now make faces
-    # front
-    poly = Part.makePolygon( [v11,v12,v13,v14,v11])
-    face1 = Part.Face(poly)
-    # back
-    poly = Part.makePolygon( [v21,v24,v23,v22,v21])
-    face2 = Part.Face(poly)
-    # left
-    poly = Part.makePolygon( [v11,v14,v24,v21,v11])
-    face3 = Part.Face(poly)
-    # right
-    poly = Part.makePolygon( [v12,v22,v23,v13,v12])
-    face4 = Part.Face(poly)
-    # top
-    poly = Part.makePolygon( [v14,v13,v23,v24,v14])
-    face5 = Part.Face(poly)
-    # bottom
-    poly = Part.makePolygon( [v11,v21,v22,v12,v11])
-    face6 = Part.Face(poly)
-    # create a shell. Does not need to be solid.
-    segShell = Part.makeShell([face1,face2,face3,face4,face5,face6])
-    return segShell
+        wh = np.where(default.reshape(-1,1), np.cross(ww,wl), wh)
+    # normalize 'wh' and 'ww' (degenerate segments stay degenerate)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        wh = np.nan_to_num(wh / np.linalg.norm(wh, axis=1).reshape(-1,1))
+        ww = np.nan_to_num(ww / np.linalg.norm(ww, axis=1).reshape(-1,1))
+    wwHalf = ww * (width / 2).reshape(-1,1)
+    whHalf = wh * (height / 2).reshape(-1,1)
+    # calculate the vertexes: the first four around the cross-section at 'n1', the last four at 'n2'
+    signWidth = np.array([-1.0,1.0,1.0,-1.0]*2).reshape(1,8,1)
+    signHeight = np.array([-1.0,-1.0,1.0,1.0]*2).reshape(1,8,1)
+    vertexes = np.concatenate((np.repeat(n1[:,np.newaxis,:],4,axis=1),np.repeat(n2[:,np.newaxis,:],4,axis=1)),axis=1)
+    vertexes += signWidth * wwHalf[:,np.newaxis,:] + signHeight * whHalf[:,np.newaxis,:]
+    return vertexes
+
+def makeSegShells(vertexes):
+    ''' Create the Part shells of a set of segments (or any hexahedra), e.g. to export them
+
+        'vertexes': (N,8,3) array of the segment vertexes, in the order of makeSegShape()
+            (see makeSegVertexes())
+
+        Returns the list of the N created shells
+'''
+    shells = []
+    for segVertexes in np.asarray(vertexes).tolist():
+        v = [Vector(vertex[0],vertex[1],vertex[2]) for vertex in segVertexes]
+        faces = [Part.Face(Part.makePolygon([v[index] for index in face] + [v[face[0]]])) for face in EMHEXAHEDRON_FACES]
+        # create a shell. Does not need to be solid.
+        shells.append(Part.makeShell(faces))
+    return shells
+
+def makeBoxVertexes(boxMin,boxSize):
+    ''' Compute the vertexes of a set of axis-aligned boxes given:
+
+        'boxMin': (N,3) array of the box corners with the smallest coordinates
+        'boxSize': (N,3) array of the box dimensions along x, y, z
+
+        The vertexes are in the same order as the ones of the segment shape
+        (see makeSegShape()) of a segment with the length along x and the width along y
+
+        Returns a (N,8,3) array of the box vertexes
+'''
+    boxMin = np.asarray(boxMin, dtype=np.float64).reshape(-1,3)
+    boxMax = boxMin + np.asarray(boxSize, dtype=np.float64).reshape(-1,3)
+    vertexes = np.empty((len(boxMin),8,3), dtype=np.float64)
+    # x is the length: the first four vertexes are on the lower x face, the last four on the upper x face
+    vertexes[:,0:4,0] = boxMin[:,0:1]
+    vertexes[:,4:8,0] = boxMax[:,0:1]
+    # then going around the cross-section
+    vertexes[:,:,1] = np.where(np.array([False,True,True,False]*2), boxMax[:,1:2], boxMin[:,1:2])
+    vertexes[:,:,2] = np.where(np.array([True,True,False,False]*2), boxMax[:,2:3], boxMin[:,2:3])
+    return vertexes
+
+def makeHexahedraFaceIndexes(count):
+    ''' Compute the face vertex indexes of a set of hexahedra, e.g. to be used as 'coordIndex'
+        of a coin3d SoIndexedFaceSet
+
+        'count': the number of hexahedra, whose vertexes are stored consecutively, eight
+            per hexahedron, in the order of makeSegShape() (see also makeBoxVertexes())
+
+        Returns a flat int32 array of the vertex indexes of the six faces of each hexahedron,
+        every face terminated by -1
+'''
+    # front, back, left, right, top, bottom, as in makeSegShape(), each face terminated by -1
+    faces = np.hstack((np.array(EMHEXAHEDRON_FACES, dtype=np.int32), np.full((6,1), -1, dtype=np.int32)))
+    offsets = (np.arange(count, dtype=np.int32) * 8).reshape(-1,1,1)
+    indexes = np.where(faces == -1, -1, faces + offsets)
+    return indexes.astype(np.int32).ravel()
+
+class GeometryCache:
+    ''' Signature of the geometric inputs of the last shape built by an object (e.g. node positions,
+        dimensions, etc.). If the signature did not change, e.g. because only non-geometric
+        properties like 'Sigma' changed, the object can keep its current shape instead of building it again.
+
+        The cache hits and misses are counted by object type, see getGeometryCacheStats()
+'''
+    stats = {}
+
+    def __init__(self, objType):
+        ''' 'objType' is the type of the object owning the cache, e.g. "FHPlane" '''
+        self.objType = objType
+        self.clear()
+
+    def isValid(self, signature, shape):
+        ''' Check if the object shape is still the one built for the given geometric inputs
+
+            'signature' is a tuple of the geometric inputs of the shape
+            'shape' is the current object shape. It must be the stored shape, as e.g. an undo
+                may have restored a different shape
+
+            Returns True if the object can keep its shape (cache hit)
+    '''
+        stats = GeometryCache.stats.setdefault(self.objType, {'hits': 0, 'misses': 0})
+        if self.shape is not None and signature == self.signature and shape.isPartner(self.shape):
+            stats['hits'] += 1
+            return True
+        stats['misses'] += 1
+        return False
+
+    def store(self, signature, shape):
+        ''' Store the shape built for the given geometric inputs
+
+            'signature' is a tuple of the geometric inputs of the shape
+            'shape' is the shape assigned to the object
+    '''
+        self.signature = signature
+        self.shape = shape
+
+    def clear(self):
+        ''' Empty the cache
+    '''
+        self.signature = None
+        self.shape = None
+
+def getGeometryCacheStats():
+    ''' Retrieves the geometry cache statistics (see GeometryCache)
+
+        Returns a dict by object type of dicts containing the number of 'hits' and 'misses'
+        and the 'hitRate'
+'''
+    report = {}
+    for objType, stats in GeometryCache.stats.items():
+        lookups = stats['hits'] + stats['misses']
+        report[objType] = {'hits': stats['hits'], 'misses': stats['misses'],
+                           'hitRate': float(stats['hits']) / lookups if lookups > 0 else 0.0}
+    return report
+
+def clearGeometryCacheStats():
+    ''' Resets the geometry cache statistics (see GeometryCache)
+'''
+    GeometryCache.stats.clear()
 
 def getVHSolver(createIfNotExisting=False):
     ''' Retrieves the VHSolver object.
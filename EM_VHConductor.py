@@ -30,6 +30,22 @@ import math
 
 # copper conductivity 1/(m*Ohms)
 EMVHSOLVER_DEF_SIGMA = 5.8e7
+# tolerance of the analytic inside tests, relative to the voxel size
+EMVHCOND_ANALYTIC_TOL = 1e-9
+# absolute length tolerance for the geometric checks of the analytic voxelizers
+EMVHCOND_ANALYTIC_LENTOL = 1e-8
+# max mismatch between the predicted and actual bbox of an analytic shape, relative to the bbox diagonal
+EMVHCOND_ANALYTIC_BBOXTOL = 1e-4
+# inside/outside classification methods for the voxels intersecting the conductor surface
+EMVHCOND_INSIDECHECKS = ["isInside", "RayParity"]
+# maximum number of voxels of the voxel space slabs scanned at once when serializing the conductor
+EMVHCOND_SERIALIZE_SLAB = 4194304
+# max number of voxels of the voxel space written at once when applying a voxelization
+EMVHCOND_APPLY_SLAB = 4194304
+# default maximum number of faces shown by 'ShowVoxels' before switching to a coarser level of detail (0 means no limit)
+EMVHCOND_DEF_FACEBUDGET = 1000000
+# downsampling factors of the coarser levels of detail of the voxel shell
+EMVHCOND_LOD_FACTORS = [2, 4, 8]
 
 import FreeCAD, FreeCADGui, Part, Draft, DraftGeomUtils, os
 import DraftVecUtils
@@ -38,9 +54,9 @@ import MeshPart
 from FreeCAD import Vector
 import numpy as np
 import time
+import hashlib
 from pivy import coin
 import EM
-from scipy import ndimage
 
 if FreeCAD.GuiUp:
     import FreeCADGui
@@ -120,141 +136,148 @@ def makeVHConductor(baseobj=None,name='VHConductor'):
     return obj
 
 
-def intersects_box(triangle, box_center, box_extents):
-    X, Y, Z = 0, 1, 2
-
-    # Translate triangle as conceptually moving AABB to origin
-    v0 = triangle[0] - box_center
-    v1 = triangle[1] - box_center
-    v2 = triangle[2] - box_center
-
-    # Compute edge vectors for triangle
-    f0 = triangle[1] - triangle[0]
-    f1 = triangle[2] - triangle[1]
-    f2 = triangle[0] - triangle[2]
-
-    ## region Test axes a00..a22 (category 3)
-
-    # Test axis a00
-    a00 = np.array([0, -f0[Z], f0[Y]])
-    p0 = np.dot(v0, a00)
-    p1 = np.dot(v1, a00)
-    p2 = np.dot(v2, a00)
-    r = box_extents[Y] * abs(f0[Z]) + box_extents[Z] * abs(f0[Y])
-    if (max(-max(p0, p1, p2), min(p0, p1, p2))) > r:
-        return False
-
-    # Test axis a01
-    a01 = np.array([0, -f1[Z], f1[Y]])
-    p0 = np.dot(v0, a01)
-    p1 = np.dot(v1, a01)
-    p2 = np.dot(v2, a01)
-    r = box_extents[Y] * abs(f1[Z]) + box_extents[Z] * abs(f1[Y])
-    if (max(-max(p0, p1, p2), min(p0, p1, p2))) > r:
-        return False
-
-    # Test axis a02
-    a02 = np.array([0, -f2[Z], f2[Y]])
-    p0 = np.dot(v0, a02)
-    p1 = np.dot(v1, a02)
-    p2 = np.dot(v2, a02)
-    r = box_extents[Y] * abs(f2[Z]) + box_extents[Z] * abs(f2[Y])
-    if (max(-max(p0, p1, p2), min(p0, p1, p2))) > r:
-        return False
-
-    # Test axis a10
-    a10 = np.array([f0[Z], 0, -f0[X]])
-    p0 = np.dot(v0, a10)
-    p1 = np.dot(v1, a10)
-    p2 = np.dot(v2, a10)
-    r = box_extents[X] * abs(f0[Z]) + box_extents[Z] * abs(f0[X])
-    if (max(-max(p0, p1, p2), min(p0, p1, p2))) > r:
-        return False
-
-    # Test axis a11
-    a11 = np.array([f1[Z], 0, -f1[X]])
-    p0 = np.dot(v0, a11)
-    p1 = np.dot(v1, a11)
-    p2 = np.dot(v2, a11)
-    r = box_extents[X] * abs(f1[Z]) + box_extents[Z] * abs(f1[X])
-    if (max(-max(p0, p1, p2), min(p0, p1, p2))) > r:
-        return False
-
-    # Test axis a12
-    a11 = np.array([f2[Z], 0, -f2[X]])
-    p0 = np.dot(v0, a11)
-    p1 = np.dot(v1, a11)
-    p2 = np.dot(v2, a11)
-    r = box_extents[X] * abs(f2[Z]) + box_extents[Z] * abs(f2[X])
-    if (max(-max(p0, p1, p2), min(p0, p1, p2))) > r:
-        return False
-
-    # Test axis a20
-    a20 = np.array([-f0[Y], f0[X], 0])
-    p0 = np.dot(v0, a20)
-    p1 = np.dot(v1, a20)
-    p2 = np.dot(v2, a20)
-    r = box_extents[X] * abs(f0[Y]) + box_extents[Y] * abs(f0[X])
-    if (max(-max(p0, p1, p2), min(p0, p1, p2))) > r:
-        return False
-
-    # Test axis a21
-    a21 = np.array([-f1[Y], f1[X], 0])
-    p0 = np.dot(v0, a21)
-    p1 = np.dot(v1, a21)
-    p2 = np.dot(v2, a21)
-    r = box_extents[X] * abs(f1[Y]) + box_extents[Y] * abs(f1[X])
-    if (max(-max(p0, p1, p2), min(p0, p1, p2))) > r:
-        return False
-
-    # Test axis a22
-    a22 = np.array([-f2[Y], f2[X], 0])
-    p0 = np.dot(v0, a22)
-    p1 = np.dot(v1, a22)
-    p2 = np.dot(v2, a22)
-    r = box_extents[X] * abs(f2[Y]) + box_extents[Y] * abs(f2[X])
-    if (max(-max(p0, p1, p2), min(p0, p1, p2))) > r:
-        return False
-
-    ## endregion
-
-    ## region Test the three axes corresponding to the face normals of AABB b (category 1)
-
-    # Exit if...
-    # ... [-extents.X, extents.X] and [min(v0.X,v1.X,v2.X), max(v0.X,v1.X,v2.X)] do not overlap
-    if max(v0[X], v1[X], v2[X]) < -box_extents[X] or min(v0[X], v1[X], v2[X]) > box_extents[X]:
-        return False
-
-    # ... [-extents.Y, extents.Y] and [min(v0.Y,v1.Y,v2.Y), max(v0.Y,v1.Y,v2.Y)] do not overlap
-    if max(v0[Y], v1[Y], v2[Y]) < -box_extents[Y] or min(v0[Y], v1[Y], v2[Y]) > box_extents[Y]:
-        return False
-
-    # ... [-extents.Z, extents.Z] and [min(v0.Z,v1.Z,v2.Z), max(v0.Z,v1.Z,v2.Z)] do not overlap
-    if max(v0[Z], v1[Z], v2[Z]) < -box_extents[Z] or min(v0[Z], v1[Z], v2[Z]) > box_extents[Z]:
-        return False
-
-    ## endregion
-
-    ## region Test separating axis corresponding to triangle face normal (category 2)
-
-    plane_normal = np.cross(f0, f1)
-    plane_distance = np.abs(np.dot(plane_normal, v0))
-
-    # Compute the projection interval radius of b onto L(t) = b.c + t * p.n
-    r = box_extents[X] * abs(plane_normal[X]) + box_extents[Y] * abs(plane_normal[Y]) + box_extents[Z] * abs(
-        plane_normal[Z])
-
-    # Intersection occurs when plane distance falls within [-r,+r] interval
-    if plane_distance > r:
-        return False
-
-    ## endregion
-
-    return True
-
-
-def get_voxel_center(bb_min, voxel, delta):
-    return bb_min + (voxel + 0.5) * delta
+def placement_frame(placement):
+    ''' Get the local frame of a FreeCAD.Placement, for the analytic inside tests (see EM.to_local_frame())
+
+        'placement' is the FreeCAD.Placement defining the local frame
+
+        Returns a tuple (rotation, translation) of the (3,3) rotation matrix and of the (3,) translation
+        from the global to the local coordinates
+    '''
+    m = placement.inverse().toMatrix()
+    rot = np.array(((m.A11, m.A12, m.A13), (m.A21, m.A22, m.A23), (m.A31, m.A32, m.A33)))
+    return rot, np.array((m.A14, m.A24, m.A34))
+
+
+def analytic_inside_box(base, tol):
+    ''' Closed-form inside test for a Part::Box (any placement)
+    '''
+    return EM.box_inside(base.Length.Value, base.Width.Value, base.Height.Value, tol, placement_frame(base.Shape.Placement))
+
+
+def analytic_inside_cylinder(base, tol):
+    ''' Closed-form inside test for a full (360 degrees), straight (not skewed) Part::Cylinder (any placement)
+    '''
+    if base.Angle.Value < 360.0 - 1e-9:
+        return None
+    # older FreeCAD versions have no skewed cylinders
+    if hasattr(base, "FirstAngle") and (abs(base.FirstAngle.Value) > 1e-9 or abs(base.SecondAngle.Value) > 1e-9):
+        return None
+    return EM.cylinder_inside(base.Radius.Value, base.Height.Value, tol, placement_frame(base.Shape.Placement))
+
+
+def analytic_inside_prism(base, tol):
+    ''' Closed-form inside test for a straight (not skewed) regular Part::Prism (any placement)
+    '''
+    # older FreeCAD versions have no skewed prisms
+    if hasattr(base, "FirstAngle") and (abs(base.FirstAngle.Value) > 1e-9 or abs(base.SecondAngle.Value) > 1e-9):
+        return None
+    return EM.prism_inside(base.Polygon, base.Circumradius.Value, base.Height.Value, tol, placement_frame(base.Shape.Placement))
+
+
+def analytic_inside_extrusion(base, tol):
+    ''' Closed-form inside test for a Part::Extrusion (e.g. created by Draft.extrude()) of
+        a planar profile made of straight edges only, without taper
+    '''
+    if not base.Solid or abs(base.TaperAngle.Value) > 1e-9 or abs(base.TaperAngleRev.Value) > 1e-9:
+        return None
+    profile = base.Base
+    if profile is None or not hasattr(profile, "Shape") or len(profile.Shape.Wires) == 0:
+        return None
+    # collect the profile polygons
+    polygons3d = []
+    for wire in profile.Shape.Wires:
+        if not wire.isClosed():
+            return None
+        for edge in wire.Edges:
+            if not isinstance(edge.Curve, (Part.Line, Part.LineSegment)):
+                return None
+        polygons3d.append(np.array([vertex.Point for vertex in wire.OrderedVertexes]))
+    allpoints = np.concatenate(polygons3d)
+    origin = allpoints[0]
+    # profile plane normal (Newell's method on the first wire)
+    poly = polygons3d[0]
+    nextpoly = np.roll(poly, -1, axis=0)
+    normal = np.array((np.sum((poly[:, 1] - nextpoly[:, 1]) * (poly[:, 2] + nextpoly[:, 2])),
+                       np.sum((poly[:, 2] - nextpoly[:, 2]) * (poly[:, 0] + nextpoly[:, 0])),
+                       np.sum((poly[:, 0] - nextpoly[:, 0]) * (poly[:, 1] + nextpoly[:, 1]))))
+    if np.linalg.norm(normal) < EMVHCOND_ANALYTIC_LENTOL:
+        return None
+    normal = normal / np.linalg.norm(normal)
+    if np.max(np.abs((allpoints - origin) @ normal)) > EMVHCOND_ANALYTIC_LENTOL:
+        # profile is not planar
+        return None
+    # extrusion direction and lengths, following Part::Extrusion conventions
+    if base.DirMode == "Custom":
+        direction = np.array(base.Dir)
+    elif base.DirMode == "Normal":
+        direction = normal
+    else:
+        return None
+    if np.linalg.norm(direction) < EMVHCOND_ANALYTIC_LENTOL:
+        return None
+    length_fwd, length_rev = base.LengthFwd.Value, base.LengthRev.Value
+    if abs(length_fwd) < EMVHCOND_ANALYTIC_LENTOL and abs(length_rev) < EMVHCOND_ANALYTIC_LENTOL:
+        length_fwd = np.linalg.norm(direction)
+    if base.Symmetric:
+        length_fwd, length_rev = length_fwd / 2.0, length_fwd / 2.0
+    direction = direction / np.linalg.norm(direction)
+    if base.Reversed:
+        direction = -direction
+    dir_normal = direction @ normal
+    if abs(dir_normal) < EMVHCOND_ANALYTIC_LENTOL:
+        return None
+    # safety net: the predicted bounding box must match the actual one,
+    # otherwise the properties have been misinterpreted, and we fall back to the generic path
+    corners = np.concatenate((allpoints - length_rev * direction, allpoints + length_fwd * direction))
+    bbox = base.Shape.BoundBox
+    if (np.max(np.abs(corners.min(axis=0) - np.array((bbox.XMin, bbox.YMin, bbox.ZMin)))) > EMVHCOND_ANALYTIC_BBOXTOL * bbox.DiagonalLength or
+        np.max(np.abs(corners.max(axis=0) - np.array((bbox.XMax, bbox.YMax, bbox.ZMax)))) > EMVHCOND_ANALYTIC_BBOXTOL * bbox.DiagonalLength):
+        return None
+    # 2D basis in the profile plane
+    uaxis = (polygons3d[0][1] - polygons3d[0][0])
+    uaxis = uaxis - (uaxis @ normal) * normal
+    uaxis = uaxis / np.linalg.norm(uaxis)
+    vaxis = np.cross(normal, uaxis)
+    polygons = [np.stack(((poly - origin) @ uaxis, (poly - origin) @ vaxis), axis=1) for poly in polygons3d]
+    return EM.extrusion_inside(origin, uaxis, vaxis, polygons, direction, length_fwd, length_rev, tol)
+
+
+# analytic voxelizers registry: 'TypeId' of the VHConductor Base object -> function(base, tol)
+# returning a function that, given a (N,3) array of points, returns a (N,) boolean array
+# flagging the points inside the base object. If the function returns None, the base object
+# cannot be handled analytically (e.g. unsupported parameters), and the generic path is used.
+EMVHCOND_ANALYTIC_VOXELIZERS = {"Part::Box": analytic_inside_box,
+                                "Part::Cylinder": analytic_inside_cylinder,
+                                "Part::Prism": analytic_inside_prism,
+                                "Part::Extrusion": analytic_inside_extrusion}
+
+def register_analytic_voxelizer(typeId, insideFactory):
+    ''' Register an analytic voxelizer for base objects of a given type
+
+        'typeId' is the 'TypeId' string of the base object (e.g. "Part::Box")
+        'insideFactory' is a function(base, tol) returning the inside test function
+            for the points (see EMVHCOND_ANALYTIC_VOXELIZERS), or None if not applicable
+    '''
+    EMVHCOND_ANALYTIC_VOXELIZERS[typeId] = insideFactory
+
+def get_analytic_inside(base, delta):
+    ''' Retrieve the closed-form inside test for the 'base' object, if any
+
+        'base' is the VHConductor Base object
+        'delta' is the voxels size length
+
+        Returns a function of a (N,3) array of points returning a (N,) boolean array,
+        or None if the generic voxelization path must be used
+    '''
+    insideFactory = EMVHCOND_ANALYTIC_VOXELIZERS.get(base.TypeId)
+    if insideFactory is None:
+        return None
+    try:
+        return insideFactory(base, delta * EMVHCOND_ANALYTIC_TOL)
+    except (AttributeError, TypeError, ValueError, ZeroDivisionError):
+        # any unexpected object layout; fall back to the generic path
+        return None
 
 class _VHConductor:
     '''The EM VoxHenry Conductor object'''
@@ -269,11 +292,19 @@ class _VHConductor:
         obj.addProperty("App::PropertyBool","ShowVoxels","EM",QT_TRANSLATE_NOOP("App::Property","Show the voxelization"))
         obj.addProperty("App::PropertyInteger","CondIndex","EM",QT_TRANSLATE_NOOP("App::Property","Voxel space VHConductor index number (read-only)"),1)
         obj.addProperty("App::PropertyBool","isVoxelized","EM",QT_TRANSLATE_NOOP("App::Property","Flags if the conductor has been voxelized (read only)"),1)
+        obj.addProperty("App::PropertyEnumeration","InsideCheck","EM",QT_TRANSLATE_NOOP("App::Property","Method to check if the voxels on the conductor surface are inside the conductor ('RayParity' is faster, relying on 'isInside' only for ambiguous cases)"))
+        obj.addProperty("App::PropertyBool","MergeVoxelFaces","EM",QT_TRANSLATE_NOOP("App::Property","Merge the coplanar adjacent voxel faces into larger rectangles when showing the voxelization"))
+        obj.addProperty("App::PropertyInteger","VoxelFaceBudget","EM",QT_TRANSLATE_NOOP("App::Property","Maximum number of faces when showing the voxelization; if exceeded, a 2x, 4x or 8x downsampled voxelization is shown (0 means no limit)"))
         obj.ShowVoxels = False
+        obj.MergeVoxelFaces = True
+        obj.VoxelFaceBudget = EMVHCOND_DEF_FACEBUDGET
         obj.Proxy = self
         obj.isVoxelized = False
+        obj.InsideCheck = EMVHCOND_INSIDECHECKS
+        obj.InsideCheck = "isInside"
         obj.Sigma = EMVHSOLVER_DEF_SIGMA
-        self.shapePoints = []
+        self.clearShapePoints()
+        self.voxelLOD = None
         self.Type = "VHConductor"
 
     def onChanged(self, obj, prop):
@@ -324,7 +355,7 @@ class _VHConductor:
                     shape = self.createVoxelShellFastCoin(obj.Base,obj.CondIndex,gbbox,delta,voxelSpace)
         if shape is None:
             # if we don't show the voxelized view of the object, let's show the bounding box
-            self.shapePoints = []
+            self.clearShapePoints()
             bbox = obj.Base.Shape.BoundBox
             if bbox.isValid():
                 shape = Part.makeBox(bbox.XLength,bbox.YLength,bbox.ZLength,Vector(bbox.XMin,bbox.YMin,bbox.ZMin))
@@ -342,7 +373,7 @@ class _VHConductor:
         ''' Creates a shell composed by the external faces of a voxelized object.
 
             'obj' is the object whose shell must be created
-            'condIndex' (int16) is the index of the object. It defines the object conductivity.
+            'condIndex' (int) is the index of the object. It defines the object conductivity.
             'gbbox' (FreeCAD.BoundBox) is the overall bounding box
             'delta' is the voxels size length
             'voxelSpace' (Numpy 3D array) is the voxel tensor of the overall space
@@ -438,34 +469,25 @@ class _VHConductor:
         objShell = Part.makeShell(surfList)
         return objShell
 
-    def createVoxelShellFast(self,obj,condIndex,gbbox,delta,voxelSpace=None):
-        ''' Creates a shell composed by the external faces of a voxelized object.
+    def getVoxelShellMask(self,obj,condIndex,gbbox,delta,voxelSpace):
+        ''' Get the portion of the voxel space occupied by a voxelized object
 
             'obj' is the object whose shell must be created
-            'condIndex' (int16) is the index of the object. It defines the object conductivity.
+            'condIndex' (int) is the index of the object. It defines the object conductivity.
             'gbbox' (FreeCAD.BoundBox) is the overall bounding box
             'delta' is the voxels size length
             'voxelSpace' (Numpy 3D array) is the voxel tensor of the overall space
 
-            This version uses a standard Part::Shell, but calculates the VHConductor
-            boundaries by finite differences over the voxel conductor space,
-            for speed in Python. However the speed bottleneck is still the
-            use of the Part::Shell via OpenCascade
-
-            Remark: the VHConductor must have already been voxelized
+            Returns a tuple (mask, base) where 'mask' is the boolean sub-tensor of the voxel space
+            containing the object bounding box, True where the voxels belong to the object,
+            and 'base' is the (x,y,z) coordinate of the lower corner of the voxel mask[0,0,0];
+            or None if the object bounding box does not fit into the global bounding box
     '''
-        if voxelSpace is None:
-            return None
-        if not hasattr(obj,"Shape"):
-            return None
-        if self.Object.isVoxelized == False:
-            return None
-        surfList = []
         # get the object's bbox
         bbox = obj.Shape.BoundBox
         if not gbbox.isInside(bbox):
             FreeCAD.Console.PrintError(translate("EM","Conductor bounding box is larger than the global bounding box. Cannot voxelize conductor shell.\n"))
-            return
+            return None
         # now must find the voxel set that contains the object bounding box
         # find the voxel that contains the bbox min point
         min_x = int((bbox.XMin - gbbox.XMin)/delta)
@@ -479,84 +501,44 @@ class _VHConductor:
         max_y = min(int((bbox.YMax - gbbox.YMin)/delta), vs_size[1]-1)
         max_z = min(int((bbox.ZMax - gbbox.ZMin)/delta), vs_size[2]-1)
         # get the base point
-        vbase = Vector(gbbox.XMin + min_x * delta, gbbox.YMin + min_y * delta, gbbox.ZMin + min_z * delta)
-        # now get a sub-tensor out of the voxel space, containing the obj.Shape; but make it one (empty) voxel
-        # larger in every direction (that's the '+2': one voxel in the - direction, one in the +),
-        # so we can check if the object shape span up to the border
-        dim_x = max_x+1-min_x
-        dim_y = max_y+1-min_y
-        dim_z = max_z+1-min_z
-        # create the sub-tensor
-        voxSubSpace = np.full((dim_x+2,dim_y+2,dim_z+2),0,np.int32)
-        # copy the sub-tensor out of the full voxel space, after selecting the elements
-        # corresponding to 'condIndex' and converting (casting with astype() )
-        # to a matrix composed only of zeros and ones (True -> 1, False -> 0)
-        voxSubSpace[1:dim_x+1,1:dim_y+1,1:dim_z+1] = (voxelSpace[min_x:max_x+1,min_y:max_y+1,min_z:max_z+1] == condIndex).astype(np.int8)
-        # now we must find the boundaries in the three x,y,z directions. We differentiate.
-        # start from dx
-        diff = voxSubSpace[1:dim_x+2,:,:] - voxSubSpace[0:dim_x+1,:,:]
-        # and extract the non-zero elements positions
-        voxelIndices = [ [step_x,step_y,step_z] for step_x in range(0,dim_x+1) for step_y in range(0,dim_y+2) for step_z in range(0,dim_z+2) if diff[step_x,step_y,step_z] != 0]
-        # cube x side vertex points
-        vertex = [Vector(0,0,0), Vector(0,0,delta), Vector(0,delta,delta), Vector(0,delta,0)]
-        # now we can create the faces orthogonal to the current direction
-        for index in voxelIndices:
-            # calculate the base point of the vector pointed to by 'index' (remark: 'index' is not the index
-            # of the voxel, but of the surface between two voxels, for the direction along which we are operating)
-            vbaseRel = vbase + Vector(index[0]*delta,(index[1]-1)*delta,(index[2]-1)*delta)
-            # create the face
-            # calculate the vertexes
-            v11 = vbaseRel + vertex[0]
-            v12 = vbaseRel + vertex[1]
-            v13 = vbaseRel + vertex[2]
-            v14 = vbaseRel + vertex[3]
-            # now make the face
-            poly = Part.makePolygon( [v11,v12,v13,v14,v11])
-            face = Part.Face(poly)
-            surfList.append(face)
-        # then dy
-        diff = voxSubSpace[:,1:dim_y+2,:] - voxSubSpace[:,0:dim_y+1,:]
-        # and extract the non-zero elements positions
-        voxelIndices = [ [step_x,step_y,step_z] for step_x in range(0,dim_x+2) for step_y in range(0,dim_y+1) for step_z in range(0,dim_z+2) if diff[step_x,step_y,step_z] != 0]
-        # cube y side vertex points
-        vertex = [Vector(0,0,0), Vector(delta,0,0), Vector(delta,0,delta), Vector(0,0,delta)]
-        # now we can create the faces orthogonal to the current direction
-        for index in voxelIndices:
-            # calculate the base point of the vector pointed to by 'index' (remark: 'index' is not the index
-            # of the voxel, but of the surface between two voxels, for the direction along which we are operating)
-            vbaseRel = vbase + Vector((index[0]-1)*delta,index[1]*delta,(index[2]-1)*delta)
-            # create the face
-            # calculate the vertexes
-            v11 = vbaseRel + vertex[0]
-            v12 = vbaseRel + vertex[1]
-            v13 = vbaseRel + vertex[2]
-            v14 = vbaseRel + vertex[3]
-            # now make the face
-            poly = Part.makePolygon( [v11,v12,v13,v14,v11])
-            face = Part.Face(poly)
-            surfList.append(face)
-        # then dz
-        diff = voxSubSpace[:,:,1:dim_z+2] - voxSubSpace[:,:,0:dim_z+1]
-        # and extract the non-zero elements positions
-        voxelIndices = [ [step_x,step_y,step_z] for step_x in range(0,dim_x+2) for step_y in range(0,dim_y+2) for step_z in range(0,dim_z+1) if diff[step_x,step_y,step_z] != 0]
-        # cube z side vertex points
-        vertex = [Vector(0,0,0), Vector(0,delta,0), Vector(delta,delta,0), Vector(delta,0,0)]
-        # now we can create the faces orthogonal to the current direction
-        for index in voxelIndices:
-            # calculate the base point of the vector pointed to by 'index' (remark: 'index' is not the index
-            # of the voxel, but of the surface between two voxels, for the direction along which we are operating)
-            vbaseRel = vbase + Vector((index[0]-1)*delta,(index[1]-1)*delta,index[2]*delta)
-            # create the face
-            # calculate the vertexes
-            v11 = vbaseRel + vertex[0]
-            v12 = vbaseRel + vertex[1]
-            v13 = vbaseRel + vertex[2]
-            v14 = vbaseRel + vertex[3]
+        base = (gbbox.XMin + min_x * delta, gbbox.YMin + min_y * delta, gbbox.ZMin + min_z * delta)
+        # select the elements of the sub-tensor corresponding to 'condIndex'
+        mask = voxelSpace[min_x:max_x+1,min_y:max_y+1,min_z:max_z+1] == condIndex
+        return mask, base
+
+    def createVoxelShellFast(self,obj,condIndex,gbbox,delta,voxelSpace=None):
+        ''' Creates a shell composed by the external faces of a voxelized object.
+
+            'obj' is the object whose shell must be created
+            'condIndex' (int) is the index of the object. It defines the object conductivity.
+            'gbbox' (FreeCAD.BoundBox) is the overall bounding box
+            'delta' is the voxels size length
+            'voxelSpace' (Numpy 3D array) is the voxel tensor of the overall space
+
+            This version uses a standard Part::Shell, but calculates the VHConductor
+            boundaries by finite differences over the voxel conductor space,
+            for speed in Python. However the speed bottleneck is still the
+            use of the Part::Shell via OpenCascade
+
+            Remark: the VHConductor must have already been voxelized
+    '''
+        if voxelSpace is None:
+            return None
+        if not hasattr(obj,"Shape"):
+            return None
+        if self.Object.isVoxelized == False:
+            return None
+        shellMask = self.getVoxelShellMask(obj,condIndex,gbbox,delta,voxelSpace)
+        if shellMask is None:
+            return
+        points, numVertices = EM.voxel_shell_quads(shellMask[0],shellMask[1],delta,np.float64)
+        surfList = []
+        for quad in points.reshape(-1,4,3):
+            v11, v12, v13, v14 = [Vector(*point) for point in quad.tolist()]
             # now make the face
             poly = Part.makePolygon( [v11,v12,v13,v14,v11])
             face = Part.Face(poly)
             surfList.append(face)
-        #progBar.stop()
         FreeCAD.Console.PrintMessage(translate("EM","Voxelization of the shell completed.\n"))
         # create a shell. Does not need to be solid.
         objShell = Part.makeShell(surfList)
@@ -566,15 +548,19 @@ class _VHConductor:
         ''' Creates a shell composed by the external faces of a voxelized object.
 
             'obj' is the object whose shell must be created
-            'condIndex' (int16) is the index of the object. It defines the object conductivity.
+            'condIndex' (int) is the index of the object. It defines the object conductivity.
             'gbbox' (FreeCAD.BoundBox) is the overall bounding box
             'delta' is the voxels size length
             'voxelSpace' (Numpy 3D array) is the voxel tensor of the overall space
 
             This version uses a direct coin3d / pivy representation of the VHConductor
             boundaries ('shell'), and calculates the VHConductor
-            boundaries by finite differences over the voxel conductor space,
-            for speed in Python.
+            boundaries by finite differences over the voxel conductor space.
+            The face vertexes are stored in 'self.shapePoints' as a flat float32 array,
+            and the number of vertexes of each face in 'self.shapeNumVertices',
+            without creating any intermediate FreeCAD.Vector.
+            If 'MergeVoxelFaces' is True, the adjacent coplanar faces are merged
+            into larger rectangles, greatly reducing the number of faces in the scene graph.
 
             Remark: the VHConductor must have already been voxelized
     '''
@@ -584,133 +570,131 @@ class _VHConductor:
             return None
         if self.Object.isVoxelized == False:
             return None
-        self.shapePoints = []
-        # get the object's bbox
-        bbox = obj.Shape.BoundBox
-        if not gbbox.isInside(bbox):
-            FreeCAD.Console.PrintError(translate("EM","Conductor bounding box is larger than the global bounding box. Cannot voxelize conductor shell.\n"))
+        self.clearShapePoints()
+        shellMask = self.getVoxelShellMask(obj,condIndex,gbbox,delta,voxelSpace)
+        if shellMask is None:
             return
-        # now must find the voxel set that contains the object bounding box
-        # find the voxel that contains the bbox min point
-        min_x = int((bbox.XMin - gbbox.XMin)/delta)
-        min_y = int((bbox.YMin - gbbox.YMin)/delta)
-        min_z = int((bbox.ZMin - gbbox.ZMin)/delta)
-        # find the voxel that contains the bbox max point
-        # (if larger than the voxelSpace, set to voxelSpace max dim,
-        # we already verified that 'bbox' fits into 'gbbox')
-        vs_size = voxelSpace.shape
-        max_x = min(int((bbox.XMax - gbbox.XMin)/delta), vs_size[0]-1)
-        max_y = min(int((bbox.YMax - gbbox.YMin)/delta), vs_size[1]-1)
-        max_z = min(int((bbox.ZMax - gbbox.ZMin)/delta), vs_size[2]-1)
-        # get the base point
-        vbase = Vector(gbbox.XMin + min_x * delta, gbbox.YMin + min_y * delta, gbbox.ZMin + min_z * delta)
-        # now get a sub-tensor out of the voxel space, containing the obj.Shape; but make it one (empty) voxel
-        # larger in every direction (that's the '+2': one voxel in the - direction, one in the +),
-        # so we can check if the object shape span up to the border
-        dim_x = max_x+1-min_x
-        dim_y = max_y+1-min_y
-        dim_z = max_z+1-min_z
-        # create the sub-tensor
-        voxSubSpace = np.full((dim_x+2,dim_y+2,dim_z+2),0,np.int32)
-        # copy the sub-tensor out of the full voxel space, after selecting the elements
-        # corresponding to 'condIndex' and converting (casting with astype() )
-        # to a matrix composed only of zeros and ones (True -> 1, False -> 0)
-        voxSubSpace[1:dim_x+1,1:dim_y+1,1:dim_z+1] = (voxelSpace[min_x:max_x+1,min_y:max_y+1,min_z:max_z+1] == condIndex).astype(np.int8)
-        # now we must find the boundaries in the three x,y,z directions. We differentiate.
-        # start from dx
-        diff = voxSubSpace[1:dim_x+2,:,:] - voxSubSpace[0:dim_x+1,:,:]
-        # and extract the non-zero elements positions
-        voxelIndices = [ [step_x,step_y,step_z] for step_x in range(0,dim_x+1) for step_y in range(0,dim_y+2) for step_z in range(0,dim_z+2) if diff[step_x,step_y,step_z] != 0]
-        # cube x side vertex points
-        vertex = [Vector(0,0,0), Vector(0,0,delta), Vector(0,delta,delta), Vector(0,delta,0)]
-        # now we can create the faces orthogonal to the current direction
-        for index in voxelIndices:
-            # calculate the base point of the vector pointed to by 'index' (remark: 'index' is not the index
-            # of the voxel, but of the surface between two voxels, for the direction along which we are operating)
-            vbaseRel = vbase + Vector(index[0]*delta,(index[1]-1)*delta,(index[2]-1)*delta)
-            # create the face
-            # calculate the vertexes
-            v11 = vbaseRel + vertex[0]
-            v12 = vbaseRel + vertex[1]
-            v13 = vbaseRel + vertex[2]
-            v14 = vbaseRel + vertex[3]
-            # now make the face
-            self.shapePoints.extend([v11,v12,v13,v14])
-        # then dy
-        diff = voxSubSpace[:,1:dim_y+2,:] - voxSubSpace[:,0:dim_y+1,:]
-        # and extract the non-zero elements positions
-        voxelIndices = [ [step_x,step_y,step_z] for step_x in range(0,dim_x+2) for step_y in range(0,dim_y+1) for step_z in range(0,dim_z+2) if diff[step_x,step_y,step_z] != 0]
-        # cube y side vertex points
-        vertex = [Vector(0,0,0), Vector(delta,0,0), Vector(delta,0,delta), Vector(0,0,delta)]
-        # now we can create the faces orthogonal to the current direction
-        for index in voxelIndices:
-            # calculate the base point of the vector pointed to by 'index' (remark: 'index' is not the index
-            # of the voxel, but of the surface between two voxels, for the direction along which we are operating)
-            vbaseRel = vbase + Vector((index[0]-1)*delta,index[1]*delta,(index[2]-1)*delta)
-            # create the face
-            # calculate the vertexes
-            v11 = vbaseRel + vertex[0]
-            v12 = vbaseRel + vertex[1]
-            v13 = vbaseRel + vertex[2]
-            v14 = vbaseRel + vertex[3]
-            # now make the face
-            self.shapePoints.extend([v11,v12,v13,v14])
-        # then dz
-        diff = voxSubSpace[:,:,1:dim_z+2] - voxSubSpace[:,:,0:dim_z+1]
-        # and extract the non-zero elements positions
-        voxelIndices = [ [step_x,step_y,step_z] for step_x in range(0,dim_x+2) for step_y in range(0,dim_y+2) for step_z in range(0,dim_z+1) if diff[step_x,step_y,step_z] != 0]
-        # cube z side vertex points
-        vertex = [Vector(0,0,0), Vector(0,delta,0), Vector(delta,delta,0), Vector(delta,0,0)]
-        # now we can create the faces orthogonal to the current direction
-        for index in voxelIndices:
-            # calculate the base point of the vector pointed to by 'index' (remark: 'index' is not the index
-            # of the voxel, but of the surface between two voxels, for the direction along which we are operating)
-            vbaseRel = vbase + Vector((index[0]-1)*delta,(index[1]-1)*delta,index[2]*delta)
-            # create the face
-            # calculate the vertexes
-            v11 = vbaseRel + vertex[0]
-            v12 = vbaseRel + vertex[1]
-            v13 = vbaseRel + vertex[2]
-            v14 = vbaseRel + vertex[3]
-            # now make the face
-            self.shapePoints.extend([v11,v12,v13,v14])
-        #progBar.stop()
-        #FreeCAD.Console.PrintMessage(translate("EM","Voxelization of the shell completed.\n"))
+        merge = hasattr(self.Object,"MergeVoxelFaces") and self.Object.MergeVoxelFaces
+        faceBudget = self.Object.VoxelFaceBudget if hasattr(self.Object,"VoxelFaceBudget") else 0
+        # the voxel space generation changes whenever any voxel changes (see flagVoxelSpaceChanged() of the VHSolver)
+        solver = EM.getVHSolver()
+        generation = solver.Proxy.voxelSpaceGeneration if solver is not None else None
+        self.shapePoints, self.shapeNumVertices, factor = self.createVoxelShellLOD(shellMask[0],shellMask[1],(gbbox.XMin,gbbox.YMin,gbbox.ZMin),delta,merge,faceBudget,generation)
+        if factor > 1:
+            FreeCAD.Console.PrintMessage(translate("EM","VHConductor ") + self.Object.Label + translate("EM"," voxelization exceeds the face budget, showing it downsampled by a factor ") + str(factor) + "\n")
         return True
 
+    def createVoxelShellLOD(self,mask,base,origin,delta,merge,faceBudget,generation=None):
+        ''' Creates the voxel shell at the finest level of detail fitting into the face budget
+
+            'mask' is the boolean sub-tensor of the voxels belonging to the object (see getVoxelShellMask())
+            'base' is the (x,y,z) coordinate of the lower corner of the voxel mask[0,0,0]
+            'origin' is the (x,y,z) coordinate of the lower corner of the voxel space
+            'delta' is the voxels size length
+            'merge' if True, the adjacent coplanar voxel faces are merged (see voxel_shell_quads())
+            'faceBudget' is the maximum number of faces. If zero or negative, there is no limit.
+            'generation' is the generation of the voxel space content. If None, nothing is cached.
+
+            The max-pooled occupancy pyramid of the 'mask' (downsampled by EMVHCOND_LOD_FACTORS)
+            and the shells already built are cached in 'self.voxelLOD', until the voxel space
+            'generation' changes. The downsampled voxels are aligned to the voxel space origin,
+            as the downsampled VHPort contacts (see pool_contacts()), so they match.
+            The shells are built from the coarsest level, and the full resolution shell
+            is built only if the first coarser level fits into the face budget.
+
+            Returns a tuple (points, numVertices, factor) where 'points' and 'numVertices'
+            are the shell arrays (see voxel_shell_quads()) and 'factor' is the downsampling factor
+    '''
+        key = (generation, mask.shape, tuple(base), delta, merge)
+        if generation is None or not hasattr(self,"voxelLOD") or self.voxelLOD is None or self.voxelLOD['key'] != key:
+            # pad the mask in front, so its origin is on a multiple of the coarsest downsampling factor
+            # in voxel space coordinates (all the factors are divisors of the coarsest one)
+            maxFactor = EMVHCOND_LOD_FACTORS[-1]
+            pad = np.rint((np.array(base) - np.array(origin)) / delta).astype(int) % maxFactor
+            mask = np.pad(mask, [(pad[axis], 0) for axis in range(3)], mode='constant')
+            base = tuple(np.array(base) - pad * delta)
+            masks = {1: mask}
+            prevFactor = 1
+            for factor in EMVHCOND_LOD_FACTORS:
+                masks[factor] = EM.max_pool_mask(masks[prevFactor], factor // prevFactor)
+                prevFactor = factor
+            self.voxelLOD = {'key': key, 'masks': masks, 'base': base, 'shells': {}}
+        if faceBudget > 0:
+            factors = [1] + EMVHCOND_LOD_FACTORS
+        else:
+            factors = [1]
+        shells = self.voxelLOD['shells']
+        chosenFactor = None
+        for factor in reversed(factors):
+            if not factor in shells:
+                shells[factor] = EM.voxel_shell_quads(self.voxelLOD['masks'][factor],self.voxelLOD['base'],delta*factor,merge=merge)
+            # the coarsest level is always accepted
+            if chosenFactor is not None and len(shells[factor][1]) > faceBudget:
+                break
+            chosenFactor = factor
+        points, numVertices = shells[chosenFactor]
+        return points, numVertices, chosenFactor
+
+    def clearShapePoints(self):
+        ''' Empty the coin3d representation of the voxelized shell
+    '''
+        self.shapePoints = np.zeros((0,3),dtype=np.float32)
+        self.shapeNumVertices = np.zeros(0,dtype=np.int32)
+
     def voxelizeConductor(self):
         ''' Voxelize the Base (solid) object. The function will modify the 'voxelSpace'
             by marking with 'CondIndex' all the voxels that sample the Base object
             as internal.
+'''
+        job = self.prepareVoxelization()
+        if job is None:
+            return
+        if 'result' in job:
+            result = job['result']
+        else:
+            result = EM.voxelize_mesh(job)
+        self.applyVoxelization(job, result)
+
+    def prepareVoxelization(self):
+        ''' First phase of the voxelization of the Base (solid) object, to be run in the main process.
+            Removes the previous instances of the conductor from the voxel space, and collects
+            all the data needed by the voxelization, as plain Python / Numpy objects.
+
+            Returns the voxelization 'job' dict, or None if the conductor cannot be voxelized.
+            If the job contains a 'result' key, the voxelization is already done (analytic voxelizers);
+            otherwise the job must be passed to voxelize_mesh(), that can also run in a voxelization worker.
+            The result must then be applied with applyVoxelization().
 '''
         X, Y, Z = 0, 1, 2
         if self.Object.Base is None:
-            return
+            return None
         if not hasattr(self.Object.Base, "Shape"):
-            return
+            return None
         # get the VHSolver object
         solver = EM.getVHSolver()
         if solver is None:
-            return
+            return None
         FreeCAD.Console.PrintMessage(translate("EM", "Starting voxelization of conductor ") + self.Object.Label + "...\n")
+        # the profile entry of the conductor describes the latest voxelization only
+        profiler = solver.Proxy.getProfiler()
+        profiler.clear(self.Object.Name)
         # get global parameters from the VHSolver object
         gbbox = solver.Proxy.getGlobalBBox()
         gbbox_min = np.array((gbbox.XMin, gbbox.YMin, gbbox.ZMin))
-        gbbox_max = np.array((gbbox.XMax, gbbox.YMax, gbbox.ZMax))
         delta = solver.Proxy.getDelta()
         voxelSpace = solver.Proxy.getVoxelSpace()
         if voxelSpace is None:
             FreeCAD.Console.PrintWarning(translate("EM", "VoxelSpace not valid, cannot voxelize conductor\n"))
-            return
+            return None
         # get this object bbox
         bbox = self.Object.Base.Shape.BoundBox
         bbox_min = np.array((bbox.XMin, bbox.YMin, bbox.ZMin))
         bbox_max = np.array((bbox.XMax, bbox.YMax, bbox.ZMax))
         if not gbbox.isInside(bbox):
             FreeCAD.Console.PrintError(translate("EM", "Internal error: conductor bounding box is larger than the global bounding box. Cannot voxelize conductor.\n"))
-            return
+            return None
         # first of all, must remove all previous instances of the conductor in the voxel space
-        voxelSpace[voxelSpace == self.Object.CondIndex] = 0
+        solver.Proxy.clearConductorVoxels(self.Object)
         # now must find the voxel set that contains the object bounding box
         # find the voxel that contains the bbox min point
         local_vs_min = ((bbox_min - gbbox_min)/delta).astype(int)
@@ -721,154 +705,146 @@ class _VHConductor:
                               np.array(voxelSpace.shape) - 1),
                               axis=0)
         local_vs_size = local_vs_max - local_vs_min + 1
-        # if the Base object is a Part::Box, just mark all the voxels
-        # inside the bounding box as belonging to the conductor
-        if self.Object.Base.TypeId == "Part::Box" and \
-           self.Object.Base.Placement.Rotation.Angle < 1e-12:
-            box_start = time.perf_counter()
-
-            # Since we want to sample by voxel centre, our minimum/maximum voxel might be off by one in 1, 2, or dimensions.
-            # This would make the voxelized box too big. So check and offset where necessary.
-            # first, assume its correct
-            partbox_min = local_vs_min
-            partbox_max = local_vs_max
-            # get the center coordinates of our assumed min/max voxel
-            min_voxel_center = get_voxel_center(gbbox_min, local_vs_min, delta)
-            max_voxel_center = get_voxel_center(gbbox_min, local_vs_min, delta)
-            # make arrays of booleans
-            min_too_small = min_voxel_center < bbox_min
-            max_too_big = max_voxel_center > bbox_max
-            # offset where required. we should only ever be off by one.
-            partbox_min[min_too_small] += 1
-            partbox_max[max_too_big] -= 1
-
-            voxelSpace[partbox_min[X]:partbox_max[X] + 1,
-                       partbox_min[Y]:partbox_max[Y] + 1,
-                       partbox_min[Z]:partbox_max[Z] + 1] = self.Object.CondIndex
-        else:
-            #  Voxelization is done with the Shape.isInside function, sampled on voxel centers.
-            #  BUT isInside can be expensive, so to minimize calls to isInside:
-            #    1. Make a temporary mesh of the solid
-            #    2. Find the set 'A' of voxels that intersect the mesh
-            #    3. For all voxels in 'A', set (or not) its conductor index based on isInside
-            #    4. Using the voxels 'A', find sets 'B', 'C', ... that are contiguous regions split up by 'A'
-            #    5. For region 'R_' in voxel sets 'B', 'C',...
-            #      a. Set (or not) 'R_' based on a single arbitrary voxel in 'R' with inSide
-            #
-            #  The number of isInside calls should be approximately proportional to the conductor surface area.
-            #  The result should be identical to calling isInside for every voxel.
-
-            voxel_start = time.perf_counter()
-
-            make_mesh_start = time.perf_counter()
-            # make a reasonably fine mesh of the solid
+        with profiler.stage(self.Object.Name, "geometry hash"):
+            geometryHash = self.getGeometryHash()
+        job = {'name': self.Object.Name,
+               'hash': geometryHash,
+               'gbbox_min': gbbox_min,
+               'delta': delta,
+               'local_vs_min': local_vs_min,
+               'local_vs_size': local_vs_size}
+        # if the Base object is a primitive with a closed-form inside test (see EMVHCOND_ANALYTIC_VOXELIZERS),
+        # sample the test on all the voxel centers at once, without meshing and without any isInside call
+        analytic_inside = get_analytic_inside(self.Object.Base, delta)
+        if analytic_inside is not None:
+            with profiler.stage(self.Object.Name, "analytic"):
+                inside_mask = EM.analytic_voxelize(inside=analytic_inside,
+                                                gbbox_min=gbbox_min,
+                                                local_vs_min=local_vs_min,
+                                                local_vs_size=local_vs_size,
+                                                delta=delta)
+            job['result'] = {'inside_mask': inside_mask}
+            return job
+        # inside checks of the voxels intersecting the mesh: 'isInside' for every voxel,
+        # or 'RayParity' classification against the mesh (isInside only for the ambiguous voxels)
+        insideCheck = self.Object.InsideCheck if hasattr(self.Object, "InsideCheck") else "isInside"
+        job['use_ray_parity'] = insideCheck == "RayParity"
+        # look for the same solid, voxelized on the same grid with the same inside check,
+        # in the on-disk voxelization cache
+        voxelCache = solver.Proxy.getVoxelCache()
+        if voxelCache is not None and job['hash'] is not None:
+            cacheKey = voxelCache.makeKey(job['hash'], delta, gbbox_min + local_vs_min * delta - bbox_min, local_vs_size, insideCheck)
+            with profiler.stage(self.Object.Name, "cache lookup"):
+                inside_mask = voxelCache.get(cacheKey, local_vs_size)
+            if inside_mask is not None:
+                FreeCAD.Console.PrintMessage(translate("EM", "Voxelization of the conductor found in the voxelization cache\n"))
+                job['result'] = {'inside_mask': inside_mask}
+                return job
+            # store the final voxelization in the cache, in applyVoxelization()
+            job['cache_key'] = cacheKey
+
+        # make a reasonably fine mesh of the solid
+        linear_deflection = delta / 5.0
+        with profiler.stage(self.Object.Name, "mesh"):
             meshed = MeshPart.meshFromShape(Shape=self.Object.Base.Shape,
-                                            LinearDeflection=(delta / 5.0),
+                                            LinearDeflection=linear_deflection,
                                             AngularDeflection=math.radians(30),
                                             Relative=False)
-            make_mesh_time = time.perf_counter() - make_mesh_start
-            # FreeCAD.Console.PrintMessage(f"make_mesh_time {make_mesh_time:.1f}, n_facets {meshed.CountFacets}\n")
-
             # collect all the mesh facet coordinates (these must be triangles)
-            facets = np.zeros((meshed.CountFacets, 3, 3))
-            for index, facet in enumerate(meshed.Facets):
-                facets[index, :, :] = np.array(facet.Points)
-
-            # collect all the voxel-center coordinates
-            voxel_centers = np.zeros((local_vs_size[X], local_vs_size[Y], local_vs_size[Z], 3))
-            for x in range(local_vs_size[X]):
-                for y in range(local_vs_size[Y]):
-                    for z in range(local_vs_size[Z]):
-                        voxel_centers[x, y, z, :] = get_voxel_center(bb_min=gbbox_min,
-                                                                     voxel=np.array((x, y, z)) + local_vs_min,
-                                                                     delta=delta)
-
-            # consider every mesh facet, and check for mesh intersections with voxels
-            intersection_start = time.perf_counter()
-            mesh_intersections = np.zeros(local_vs_size, dtype=bool)
-            half_el_size_eps = delta / 2.0 + 1e-14
-            half_el_size = np.array((half_el_size_eps, half_el_size_eps, half_el_size_eps))
-            for facet_index in range(np.size(facets, 0)):
-                # get facet bounding box
-                facet_bb_min = np.min(facets[facet_index], 0)
-                facet_bb_max = np.max(facets[facet_index], 0)
-
-                # get voxel indices of facet bb points, in conductor-local voxel coordinates
-                facet_min_possible_voxel = np.floor((facet_bb_min - gbbox_min) / delta).astype(int) - local_vs_min
-                facet_max_possible_voxel = np.floor((facet_bb_max - gbbox_min) / delta).astype(int) - local_vs_min
-
-                # facet_min_possible_voxel = grid.get_voxel_containing_point(facet_bb_min) - np.array((1, 1, 1))
-                # facet_min_possible_voxel[facet_min_possible_voxel < 0] = 0  # limit to vox space
-                # facet_max_possible_voxel = grid.get_voxel_containing_point(facet_bb_max) + np.array((1, 1, 1))
-                # facet_max_possible_voxel = np.min(np.stack((facet_max_possible_voxel, max_vox_index)), 0)  # limit to vox space
-                for x in range(facet_min_possible_voxel[X], facet_max_possible_voxel[X] + 1):
-                    for y in range(facet_min_possible_voxel[Y], facet_max_possible_voxel[Y] + 1):
-                        for z in range(facet_min_possible_voxel[Z], facet_max_possible_voxel[Z] + 1):
-                            if mesh_intersections[(x, y, z)]:
-                                continue  # already filled. skip checking again
-
-                            # n_intersection_checks = n_intersection_checks + 1
-                            if intersects_box(triangle=facets[facet_index, :, :],
-                                              box_center=voxel_centers[x, y, z, :],
-                                              box_extents=half_el_size):
-                                mesh_intersections[(x, y, z)] = True
-
-            intersection_end = time.perf_counter() - intersection_start
-            # FreeCAD.Console.PrintMessage(f"intersection time {intersection_end:.1f}\n")
-
-            # Identify contiguous voxel regions
-            region_labels, n_features = ndimage.label(~mesh_intersections)
-            # FreeCAD.Console.PrintMessage(f"regions: {n_features}\n")
-
-            # Check each region
-            for label_index in range(n_features + 1):
-                region_indices = np.nonzero(region_labels == label_index)
-                region_indices_global = (region_indices[X] + local_vs_min[X],
-                                         region_indices[Y] + local_vs_min[Y],
-                                         region_indices[Z] + local_vs_min[Z])
-
-                # special case of label == 0. these are the voxels that intersected with the mesh. check each of these
-                # voxels individually
-                if label_index == 0:
-                    region_voxel_count = np.size(region_indices[0])
-                    progress_bar = FreeCAD.Base.ProgressIndicator()
-                    progress_bar.start(f"Voxelizing {self.Object.Name}...", region_voxel_count)
-                    # FreeCAD.Console.PrintMessage(f"Doing {region_voxel_count} isInside checks...\n")
-                    inside_checks_start = time.perf_counter()
-                    for x, y, z in zip(*region_indices_global):
-                        progress_bar.next(True)  # next(True) -> no cancel button on progress bar
-                        if self.Object.Base.Shape.isInside(Vector(get_voxel_center(bb_min=gbbox_min,
-                                                                                   voxel=np.array((x, y, z)),
-                                                                                   delta=delta)),
-                                                           0.0,  # tolerance
-                                                           True  # check points on faces
-                                                           ):
-                            voxelSpace[(x, y, z)] = self.Object.CondIndex
-                    inside_checks_end = time.perf_counter()
-                    # FreeCAD.Console.PrintMessage(f"Average isInside time {1000*(inside_checks_end - inside_checks_start)/region_voxel_count:.3g} milliseconds\n")
-                    progress_bar.stop()
-
-                # a contiguous region of voxels that did NOT intersect with the mesh. these can be set all at once
-                else:
-                    # Check if this whole region should be set by sampling a single voxel
-                    first_voxel_coord = np.array((region_indices_global[X][0],
-                                                  region_indices_global[Y][0],
-                                                  region_indices_global[Z][0]))
-                    if self.Object.Base.Shape.isInside(Vector(get_voxel_center(bb_min=gbbox_min,
-                                                                               voxel=first_voxel_coord,
-                                                                               delta=delta)),
-                                                       0.0,  # tolerance
-                                                       True  # check points on faces
-                                                       ):
-                        # This whole region is part of the conductor
-                        voxelSpace[region_indices_global] = self.Object.CondIndex
-
-            voxel_end = time.perf_counter()
-            n_vox_checks = np.prod(local_vs_size)
-            tot_time = voxel_end - voxel_start
-            time_per_check_us = 1000000 * tot_time / n_vox_checks
-            # FreeCAD.Console.PrintMessage(f"time per vox {time_per_check_us:.2f} usec, {n_vox_checks} vox\n")
-            # FreeCAD.Console.PrintMessage(f"tot time {tot_time:.2f} sec\n")
+            points, triangles = meshed.Topology
+            job['facets'] = np.array(points)[np.array(triangles, dtype=np.int64).reshape(-1, 3)]
+        job['linear_deflection'] = linear_deflection
+        return job
+
+    def applyVoxelization(self, job, result):
+        ''' Last phase of the voxelization of the Base (solid) object, to be run in the main process.
+            Checks the voxels left undecided by voxelize_mesh() with Shape.isInside, and marks
+            with 'CondIndex' all the voxels inside the Base object in the 'voxelSpace'.
+
+            'job' is the voxelization job returned by prepareVoxelization()
+            'result' is the voxelization result returned by voxelize_mesh() (possibly in compact form,
+                see EM.compact_voxelization()), or the job 'result'
+'''
+        X, Y, Z = 0, 1, 2
+        solver = EM.getVHSolver()
+        if solver is None:
+            return
+        # results of the voxelization workers are in compact form
+        if 'inside_indexes' in result:
+            result = EM.expand_voxelization(result, job['local_vs_size'])
+        # stages and counters of voxelize_mesh(), possibly timed by a voxelization worker
+        profiler = solver.Proxy.getProfiler()
+        stats = result.get('stats', {'times': {}, 'counts': {}})
+        for stage, duration in stats['times'].items():
+            # the memory is measured by voxelize_mesh() itself, as the workers are not traced separately
+            profiler.addTime(self.Object.Name, stage, duration, stats.get('memory', {}).get(stage))
+        for counter, value in stats['counts'].items():
+            profiler.count(self.Object.Name, counter, value)
+        voxelSpace = solver.Proxy.voxelSpace
+        gbbox_min = job['gbbox_min']
+        delta = job['delta']
+        local_vs_min = job['local_vs_min']
+        local_vs_max = local_vs_min + job['local_vs_size'] - 1
+        inside_mask = result['inside_mask']
+        check_voxels = result.get('check_voxels', np.zeros((0, 3), dtype=np.int64))
+        region_check_samples = result.get('region_check_samples', np.zeros((0, 3), dtype=np.int64))
+        # voxels to be checked individually with isInside. These are the voxels that intersected with the mesh
+        # (and that could not be classified by ray parity), plus one sample voxel for each contiguous region
+        # of voxels that did NOT intersect with the mesh (and that could not be classified by ray parity)
+        region_voxel_count = np.size(check_voxels, 0) + np.size(region_check_samples, 0)
+        if region_voxel_count > 0:
+            progress_bar = FreeCAD.Base.ProgressIndicator()
+            progress_bar.start(f"Voxelizing {self.Object.Name}...", region_voxel_count)
+            profiler.count(self.Object.Name, "isInside", region_voxel_count)
+            inside_checks_start = time.perf_counter()
+            for x, y, z in check_voxels:
+                progress_bar.next(True)  # next(True) -> no cancel button on progress bar
+                if self.Object.Base.Shape.isInside(Vector(EM.get_voxel_center(bb_min=gbbox_min,
+                                                                           voxel=np.array((x, y, z)) + local_vs_min,
+                                                                           delta=delta)),
+                                                   0.0,  # tolerance
+                                                   True  # check points on faces
+                                                   ):
+                    inside_mask[x, y, z] = True
+            inside_labels = []
+            for label_index, (x, y, z) in zip(result.get('region_check_labels', []), region_check_samples):
+                progress_bar.next(True)
+                if self.Object.Base.Shape.isInside(Vector(EM.get_voxel_center(bb_min=gbbox_min,
+                                                                           voxel=np.array((x, y, z)) + local_vs_min,
+                                                                           delta=delta)),
+                                                   0.0,  # tolerance
+                                                   True  # check points on faces
+                                                   ):
+                    inside_labels.append(label_index)
+            if len(inside_labels) > 0:
+                # These whole regions are part of the conductor
+                inside_mask |= EM.regions_mask(result['region_labels'], inside_labels)
+            profiler.addTime(self.Object.Name, "isInside", time.perf_counter() - inside_checks_start)
+            progress_bar.stop()
+        apply_start = time.perf_counter()
+        # read, modify and write back the sub-space, as a sparse voxel space slice is a copy, not a view.
+        # The sub-space is written in slabs along x, so a memory-mapped voxel space is never loaded
+        # in memory at once
+        slabThickness = max(1, EMVHCOND_APPLY_SLAB // int(job['local_vs_size'][Y] * job['local_vs_size'][Z]))
+        for slab_x in range(0, int(job['local_vs_size'][X]), slabThickness):
+            slab_mask = inside_mask[slab_x:slab_x + slabThickness]
+            if not slab_mask.any():
+                continue
+            subSpaceSlices = (slice(local_vs_min[X] + slab_x, local_vs_min[X] + slab_x + slab_mask.shape[X]),
+                              slice(local_vs_min[Y], local_vs_max[Y] + 1),
+                              slice(local_vs_min[Z], local_vs_max[Z] + 1))
+            voxelSubSpace = voxelSpace[subSpaceSlices]
+            voxelSubSpace[slab_mask] = self.Object.CondIndex
+            voxelSpace[subSpaceSlices] = voxelSubSpace
+        # store the voxelization in the on-disk voxelization cache
+        if 'cache_key' in job:
+            voxelCache = solver.Proxy.getVoxelCache()
+            if voxelCache is not None:
+                voxelCache.put(job['cache_key'], inside_mask)
+        profiler.addTime(self.Object.Name, "apply", time.perf_counter() - apply_start)
+        profiler.count(self.Object.Name, "voxels", np.count_nonzero(inside_mask))
+        # record the geometry and the voxel sub-box, for the incremental re-voxelization
+        solver.Proxy.registerConductorVoxelization(self.Object, job['hash'], local_vs_min, local_vs_max)
         # flag as voxelized
         self.Object.isVoxelized = True
         # if just voxelized, cannot show voxeld; and if there was an old shell representing
@@ -889,6 +865,30 @@ class _VHConductor:
     '''
         return self.Object.Base
 
+    def getGeometryHash(self):
+        ''' Computes a hash of the Base object geometry, including its placement.
+            The hash changes if the Base object shape or position changes.
+
+            The BREP of the shape is hashed only when the Base object shape is not the same
+            (see Part.Shape.isSame()) as the one of the last call, e.g. after a recompute of the Base object.
+
+            Returns the hash as an hexadecimal string, or None if there is no Base shape
+    '''
+        if self.Object.Base is None:
+            return None
+        if not hasattr(self.Object.Base,"Shape"):
+            return None
+        shape = self.Object.Base.Shape
+        # the shape is kept with its hash, so the underlying geometry cannot be released and re-used
+        # by a different shape
+        if hasattr(self,"hashedShape") and self.hashedShape[0].isSame(shape):
+            return self.hashedShape[1]
+        geometryHash = hashlib.sha1(shape.exportBrepToString().encode())
+        placement = shape.Placement
+        geometryHash.update(repr((tuple(placement.Base), tuple(placement.Rotation.Q))).encode())
+        self.hashedShape = (shape, geometryHash.hexdigest())
+        return self.hashedShape[1]
+
     def getBBox(self):
         ''' Retrieves the bounding box containing the base objects
 
@@ -903,7 +903,7 @@ class _VHConductor:
     def getCondIndex(self):
         ''' Retrieves the conductor index.
 
-            Returns the int16 conductor index.
+            Returns the conductor index.
     '''
         return self.Object.CondIndex
 
@@ -918,11 +918,13 @@ class _VHConductor:
         'fid' is the file descriptor
         'isSupercond' is a boolean indicating if the input file must contain
             superconductor lambda values (even if for some conductors this may be zero)
+
+        Returns the number of voxels written
     '''
         if self.Object.isVoxelized == True:
             solver = EM.getVHSolver()
             if solver is None:
-                 return
+                 return 0
             # get global parameters from the VHSolver object
             gbbox = solver.Proxy.getGlobalBBox()
             delta = solver.Proxy.getDelta()
@@ -931,7 +933,7 @@ class _VHConductor:
             bbox = self.Object.Base.Shape.BoundBox
             if not gbbox.isInside(bbox):
                 FreeCAD.Console.PrintError(translate("EM","Conductor bounding box is larger than the global bounding box. Cannot serialize VHConductor.\n"))
-                return
+                return 0
             # now must find the voxel set that contains the object bounding box
             # find the voxel that contains the bbox min point
             min_x = int((bbox.XMin - gbbox.XMin)/delta)
@@ -944,43 +946,36 @@ class _VHConductor:
             max_x = min(int((bbox.XMax - gbbox.XMin)/delta), vs_size[0]-1)
             max_y = min(int((bbox.YMax - gbbox.YMin)/delta), vs_size[1]-1)
             max_z = min(int((bbox.ZMax - gbbox.ZMin)/delta), vs_size[2]-1)
-            # and now find which voxel belongs to this VHConductor
-            voxCoords = np.argwhere(voxelSpace[min_x:max_x+1, min_y:max_y+1, min_z:max_z+1]==self.Object.CondIndex)
-            # remark: VoxHenry voxel tensor is 1-based, not 0-based. Must add 1
-            voxCoords = voxCoords + 1
-            # and add the base offset
-            voxCoords[:,0] = voxCoords[:,0]+min_x
-            voxCoords[:,1] = voxCoords[:,1]+min_y
-            voxCoords[:,2] = voxCoords[:,2]+min_z
-            # now must add the information about the 'CondIndex' value:
-            voxCoordsSize = voxCoords.shape
-            # check if we must output lambda values or not
+            # format the conductivity (and lambda) values once, as they are common to all the voxels
+            # (same format as the previous np.savetxt() implementation, i.e. "%g")
             if isSupercond:
-                # first create a new matrix with an additional column full of 'Sigma'
-                voxCoordsAndCond = np.full((voxCoordsSize[0],voxCoordsSize[1]+2),self.Object.Sigma,np.float64)
-                # add the lambda values (note that since there is one column only, this is treated as an array in numpy, i.e. row-like)
-                voxCoordsAndCond[:,-1] = np.full(voxCoordsSize[0],self.Object.Lambda.getValueAs('m'),np.float64)
-                # then copy in the first 2 columns the voxCoords
-                # REMARK: this is now a float64 array! Cannot contain int64 values without loss of precision
-                # but up to 32 bits this should be ok
-                voxCoordsAndCond[:,:-2] = voxCoords
-                # finally output the voxels
-                np.savetxt(fid, voxCoordsAndCond, fmt="V %d %d %d %g %g")
+                condStr = "%g %g" % (float(self.Object.Sigma), float(self.Object.Lambda.getValueAs('m')))
             else:
-                # first create a new matrix with an additional column full of 'Sigma'
-                voxCoordsAndCond = np.full((voxCoordsSize[0],voxCoordsSize[1]+1),self.Object.Sigma,np.float64)
-                # then copy in the first 2 columns the voxCoords
-                # REMARK: this is now a float64 array! Cannot contain int64 values without loss of precision
-                # but up to 32 bits this should be ok
-                voxCoordsAndCond[:,:-1] = voxCoords
-                # finally output the voxels
-                np.savetxt(fid, voxCoordsAndCond, fmt="V %d %d %d %g")
+                condStr = "%g" % float(self.Object.Sigma)
+            # stream the voxels in slabs along x. As 'x' is the slowest varying index
+            # of np.argwhere(), the voxel order in the file is the same as scanning the whole box at once.
+            slabThickness = max(1, EMVHCOND_SERIALIZE_SLAB // ((max_y-min_y+1)*(max_z-min_z+1)))
+            voxelCount = 0
+            for slab_x in range(min_x, max_x+1, slabThickness):
+                slab_max_x = min(slab_x+slabThickness-1, max_x)
+                # find which voxels of the slab belong to this VHConductor
+                voxCoords = np.argwhere(voxelSpace[slab_x:slab_max_x+1, min_y:max_y+1, min_z:max_z+1]==self.Object.CondIndex)
+                if voxCoords.shape[0] == 0:
+                    continue
+                # remark: VoxHenry voxel tensor is 1-based, not 0-based. Must add 1,
+                # and add the base offset
+                voxCoords = voxCoords + np.array((slab_x+1, min_y+1, min_z+1))
+                # write the whole slab at once
+                fid.write(EM.format_voxel_lines(voxCoords, condStr))
+                voxelCount = voxelCount + voxCoords.shape[0]
+            return voxelCount
         else:
             FreeCAD.Console.PrintWarning(translate("EM","VHConductor object not voxelized, cannot serialize ") + str(self.Object.Label) + "\n")
+            return 0
 
     def __getstate__(self):
-        # JSON does not understand FreeCAD.Vector, so need to convert to tuples
-        shapePointsJSON = [(x[0],x[1],x[2]) for x in self.shapePoints]
+        # JSON does not understand numpy arrays, so need to convert to lists
+        shapePointsJSON = self.shapePoints.tolist()
         dictForJSON = {'sp':shapePointsJSON,'type':self.Type}
         #FreeCAD.Console.PrintMessage("Save\n"+str(dictForJSON)+"\n") #debug
         return dictForJSON
@@ -988,8 +983,11 @@ class _VHConductor:
     def __setstate__(self,dictForJSON):
         if dictForJSON:
             #FreeCAD.Console.PrintMessage("Load\n"+str(dictForJSON)+"\n") #debug
-            # no need to convert back to FreeCAD.Vectors, 'shapePoints' can also be tuples
-            self.shapePoints = dictForJSON['sp']
+            # older versions stored 'shapePoints' as a list of FreeCAD.Vector tuples; the format is the same
+            self.shapePoints = np.array(dictForJSON['sp'],dtype=np.float32).reshape(-1,3)
+            # all the faces are quadrilaterals
+            self.shapeNumVertices = np.full(self.shapePoints.shape[0]//4,4,dtype=np.int32)
+            self.voxelLOD = None
             self.Type = dictForJSON['type']
 
 class _ViewProviderVHConductor:
@@ -1066,7 +1064,9 @@ class _ViewProviderVHConductor:
     '''
         #FreeCAD.Console.PrintMessage("ViewProvider updateData(),  property: " + str(prop) + "\n") # debug
         if prop == "Shape":
-            numpoints = len(self.Object.Proxy.shapePoints)
+            points = self.Object.Proxy.shapePoints
+            # 'numvertices' contains the number of vertices used for each face
+            numvertices = self.Object.Proxy.shapeNumVertices
             # this can be used to reset the number of points to the value actually needed
             # (e.g. shorten the array, or pre-allocate it). However setValue() will automatically
             # increase the array size if needed, and will NOT shorten it if less values are inserted
@@ -1074,16 +1074,15 @@ class _ViewProviderVHConductor:
             # we specify how many points (vertices) we want out of the total array, so no issue
             # if the array is longer
             #self.data.point.setNum(numpoints)
-            self.data.point.setValues(0,numpoints,self.Object.Proxy.shapePoints)
-            # 'numvertices' contains the number of vertices used for each face.
-            # Here all faces are quadrilaterals, so this is a long array of number '4's
-            numvertices = [4 for i in range(int(numpoints/4))]
+            # the (N,3) float32 array is passed as is, without per-vertex conversions
+            self.data.point.setValues(0,len(points),points)
             # set the number of vertices per each face, for a total of len(numvertices) faces, starting from 0
             # but must first delete all the old values, otherwise the remaining panels with vertices from
             # 'numvertices+1' will still be shown
             self.face.numVertices.deleteValues(0,-1)
-            self.face.numVertices.setValues(0,len(numvertices),numvertices)
-            #FreeCAD.Console.PrintMessage("numpoints " + str(numpoints) + "; numvertices " + str(numvertices) + "\n") # debug
+            # pivy does not convert the Numpy int32 scalars, so the counts are passed as a list of Python ints
+            self.face.numVertices.setValues(0,len(numvertices),numvertices.tolist())
+            #FreeCAD.Console.PrintMessage("numpoints " + str(len(points)) + "; numvertices " + str(numvertices) + "\n") # debug
             #FreeCAD.Console.PrintMessage("self.Object.Proxy.shapePoints " + str(self.Object.Proxy.shapePoints) + "\n") # debug
             #FreeCAD.Console.PrintMessage("self.data.point " + str(self.data.point.get()) + "\n") # debug
             #FreeCAD.Console.PrintMessage("updateData() shape!\n") # debug
@@ -1215,8 +1214,10 @@ class _CommandVHCondPortVoxelize:
         if len(conds) > 0 or len(ports) > 0:
             FreeCAD.ActiveDocument.openTransaction(translate("EM","Voxelize VHConductors and VHPorts"))
             FreeCADGui.addModule("EM")
-            for cond in conds:
-                FreeCADGui.doCommand('FreeCAD.ActiveDocument.'+cond.Name+'.Proxy.voxelizeConductor()')
+            if len(conds) > 0 and EM.getVHSolver() is not None:
+                # voxelize all the conductors together, so they can be voxelized in parallel
+                # according to the VHSolver 'Workers' property
+                FreeCADGui.doCommand('EM.getVHSolver().Proxy.voxelizeConductors([' + ','.join(['FreeCAD.ActiveDocument.'+cond.Name for cond in conds]) + '])')
             for port in ports:
                 FreeCADGui.doCommand('FreeCAD.ActiveDocument.'+port.Name+'.Proxy.voxelizePort()')
             FreeCAD.ActiveDocument.commitTransaction()
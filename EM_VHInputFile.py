@@ -26,7 +26,13 @@ __title__="FreeCAD E.M. Workbench VoxHenry create input file command"
 __author__ = "FastFieldSolvers S.R.L."
 __url__ = "http://www.fastfieldsolvers.com"
 
+# defines
+#
+# size of the write buffer of the VoxHenry input file
+EMVHINPUTFILE_WRITE_BUFFER = 16777216
+
 import FreeCAD, FreeCADGui, Mesh, Part, MeshPart, Draft, DraftGeomUtils, os
+import time
 from FreeCAD import Vector
 from PySide import QtCore, QtGui
 
@@ -116,7 +122,7 @@ def createVHInputFile(doc=None,filename=None,folder=None):
         if ret == QtGui.QMessageBox.Cancel:
             return
     FreeCAD.Console.PrintMessage(QT_TRANSLATE_NOOP("EM","Exporting to VoxHenry file ") + "'" + folder + os.sep + filename + "'\n")
-    with open(folder + os.sep + filename, 'w') as fid:
+    with open(folder + os.sep + filename, 'w', buffering=EMVHINPUTFILE_WRITE_BUFFER) as fid:
         # serialize the header
         solver.Proxy.serialize(fid)
         # check if there are superconductors
@@ -132,9 +138,16 @@ def createVHInputFile(doc=None,filename=None,folder=None):
         fid.write("*\n")
         fid.write("StartVoxelList\n")
         conds = [obj for obj in doc.Objects if Draft.getType(obj) == "VHConductor"]
+        profiler = solver.Proxy.getProfiler()
+        profiler.clearStage("export")
+        voxelCount = 0
+        voxelsStart = time.perf_counter()
         for cond in conds:
             FreeCAD.Console.PrintMessage(QT_TRANSLATE_NOOP("EM","  Exporting conductor ") + "'" + cond.Label + "'\n")
-            cond.Proxy.serialize(fid, isSupercond)
+            with profiler.stage(cond.Name, "export"):
+                condVoxelCount = cond.Proxy.serialize(fid, isSupercond)
+            voxelCount = voxelCount + condVoxelCount
+        voxelsTime = time.perf_counter() - voxelsStart
         fid.write("EndVoxelList\n")
         fid.write("\n")
         # then the ports
@@ -145,9 +158,13 @@ def createVHInputFile(doc=None,filename=None,folder=None):
             fid.write("* N <portname> <excitation or ground (P/N)> <voxel_index_x> <voxel_index_y> <voxel_index_z> <node (+z,-z,+x,-x,+y,-y)>\n")
             fid.write("*\n")
             for port in ports:
-                port.Proxy.serialize(fid)
+                with profiler.stage(port.Name, "export"):
+                    port.Proxy.serialize(fid)
             fid.write("\n")
     FreeCAD.Console.PrintMessage(QT_TRANSLATE_NOOP("EM","Finished exporting")+"\n")
+    solver.Proxy.dumpProfile(folder + os.sep + filename)
+    if voxelsTime > 0.0:
+        FreeCAD.Console.PrintMessage(QT_TRANSLATE_NOOP("EM","  Exported ") + str(voxelCount) + QT_TRANSLATE_NOOP("EM"," voxels in ") + "{:.3g}".format(voxelsTime) + " s (" + "{:.3g}".format(voxelCount/voxelsTime) + QT_TRANSLATE_NOOP("EM"," voxels/s)") + "\n")
 
 class _CommandVHInputFile:
     ''' The EM VoxHenry create input file command definition
@@ -34,11 +34,20 @@ EMVHPORT_DEF_LINECOLOR = (0.25, 0.25, 0.25)
 EMVHPORT_EPSDELTA = 10.0
 # side strings
 EMVHPORT_SIDESTRS = ['+x', '-x', '+y', '-y', '+z', '-z']
+# tessellation tolerance of the port faces, as a fraction of the contact distance threshold.
+# Voxel sides whose distance from the tessellation is within twice this tolerance from
+# the threshold are checked against the exact faces
+EMVHPORT_TESS_TOL = 0.05
+# default maximum number of contact faces shown by 'ShowVoxels' before switching to a coarser level of detail (0 means no limit)
+EMVHPORT_DEF_FACEBUDGET = 1000000
+# downsampling factors of the coarser levels of detail of the contact faces
+EMVHPORT_LOD_FACTORS = [2, 4, 8]
 
 import FreeCAD, FreeCADGui, Part, Draft, DraftGeomUtils, os
 import DraftVecUtils
 from FreeCAD import Vector
 import time
+import numpy as np
 from pivy import coin
 import EM
 
@@ -149,14 +158,16 @@ class _VHPort:
         obj.addProperty("App::PropertyBool","isVoxelized","EM",QT_TRANSLATE_NOOP("App::Property","Flags if the port has been voxelized (read only)"),1)
         obj.addProperty("App::PropertyIntegerList","PosVoxelContacts","EM",QT_TRANSLATE_NOOP("App::Property","Positive Contacts (hidden)"),4)
         obj.addProperty("App::PropertyIntegerList","NegVoxelContacts","EM",QT_TRANSLATE_NOOP("App::Property","Negative Contacts (hidden)"),4)
+        obj.addProperty("App::PropertyInteger","VoxelFaceBudget","EM",QT_TRANSLATE_NOOP("App::Property","Maximum number of contact faces when showing the voxelization; if exceeded, a 2x, 4x or 8x downsampled voxelization is shown (0 means no limit)"))
         obj.ShowVoxels = False
+        obj.VoxelFaceBudget = EMVHPORT_DEF_FACEBUDGET
         obj.Proxy = self
         obj.DeltaDist = int(50 + 50/EMVHPORT_EPSDELTA)
         obj.isVoxelized = False
         obj.PosVoxelContacts = []
         obj.NegVoxelContacts = []
-        self.posContactShapePoints = []
-        self.negContactShapePoints = []
+        self.clearShapePoints()
+        self.contactLOD = None
         self.Type = "VHPort"
 
     def onChanged(self, obj, prop):
@@ -170,6 +181,9 @@ class _VHPort:
             self.Object = obj
         if prop == "DeltaDist":
             self.flagVoxelizationInvalid()
+        if prop == "PosVoxelContacts" or prop == "NegVoxelContacts":
+            # invalidates the downsampled contacts (see getContactsLOD())
+            self.contactsGeneration = getattr(self,"contactsGeneration",0) + 1
 
     def execute(self, obj):
         ''' this method is mandatory. It is called on Document.recompute()
@@ -192,18 +206,22 @@ class _VHPort:
                 if obj.isVoxelized == False:
                     FreeCAD.Console.PrintWarning(translate("EM","Cannot fulfill 'ShowVoxels', VHPort objects has not been voxelized, or voxelization is invalid (e.g. change in voxel space dimensions or no voxelized conductor). Voxelize it first.\n"))
                 else:
-                    self.posContactShapePoints = []
-                    posContact = self.createVoxelShellFastCoin(self.posContactShapePoints, obj.PosVoxelContacts,gbbox,delta,voxelSpace)
-                    self.negContactShapePoints = []
-                    negContact = self.createVoxelShellFastCoin(self.negContactShapePoints, obj.NegVoxelContacts,gbbox,delta,voxelSpace)
-                    if posContact and negContact:
+                    self.clearShapePoints()
+                    faceBudget = obj.VoxelFaceBudget if hasattr(obj,"VoxelFaceBudget") else 0
+                    posContacts, negContacts, factor = self.getContactsLOD(obj.PosVoxelContacts,obj.NegVoxelContacts,faceBudget)
+                    if factor > 1:
+                        FreeCAD.Console.PrintMessage(translate("EM","VHPort ") + obj.Label + translate("EM"," voxelization exceeds the face budget, showing it downsampled by a factor ") + str(factor) + "\n")
+                    posContact = self.createVoxelShellFastCoin(posContacts,gbbox,delta*factor,voxelSpace)
+                    negContact = self.createVoxelShellFastCoin(negContacts,gbbox,delta*factor,voxelSpace)
+                    if posContact is not None and negContact is not None:
+                        self.posContactShapePoints, self.posContactNumVertices = posContact
+                        self.negContactShapePoints, self.negContactNumVertices = negContact
                         shape = True
                     else:
                         FreeCAD.Console.PrintWarning(translate("EM","Cannot create VHPort shell, voxelized pos or neg contact shell creation failed"))
         if shape is None:
             # if we don't show the voxelized view of the object, let's show the faces
-            self.posContactShapePoints = []
-            self.negContactShapePoints = []
+            self.clearShapePoints()
             faces = self.getFaces(obj.PosFaces)
             posContact = Part.makeCompound(faces)
             faces = self.getFaces(obj.NegFaces)
@@ -285,7 +303,7 @@ class _VHPort:
             contactShell = Part.makeShell(surfList)
         return contactShell
 
-    def createVoxelShellFastCoin(self,shapePoints,contacts,gbbox,delta,voxelSpace=None):
+    def createVoxelShellFastCoin(self,contacts,gbbox,delta,voxelSpace=None):
         ''' Creates a shell composed by the external faces of a voxelized port.
 
             'contacts' is the list of contacts (see voxelizeContact() for the format)
@@ -293,39 +311,53 @@ class _VHPort:
             'delta' is the voxels size length
             'voxelSpace' (Numpy 3D array) is the voxel tensor of the overall space
 
+            Returns a tuple (points, numVertices) of the coin3d face vertexes (flat float32 array)
+            and of the number of vertexes of each face, or None if there are no contacts
+
             Remark: the VHPort must have already been voxelized
     '''
         if voxelSpace is None:
             return None
-        # small displacement w.r.t. delta
-        epsdelta = delta/EMVHPORT_EPSDELTA
-        # vertexes of the six faces (with a slight offset)
-        vertexes = [[Vector(delta+epsdelta,0,0), Vector(delta+epsdelta,delta,0), Vector(delta+epsdelta,delta,delta), Vector(delta+epsdelta,0,delta)],
-                    [Vector(-epsdelta,0,0), Vector(-epsdelta,0,delta), Vector(-epsdelta,delta,delta), Vector(-epsdelta,delta,0)],
-                    [Vector(0,delta+epsdelta,0), Vector(0,delta+epsdelta,delta), Vector(delta,delta+epsdelta,delta), Vector(delta,delta+epsdelta,0)],
-                    [Vector(0,-epsdelta,0), Vector(delta,-epsdelta,0), Vector(delta,-epsdelta,delta), Vector(0,-epsdelta,delta)],
-                    [Vector(0,0,delta+epsdelta), Vector(delta,0,delta+epsdelta), Vector(delta,delta,delta+epsdelta), Vector(0,delta,delta+epsdelta)],
-                    [Vector(0,0,-epsdelta), Vector(0,delta,-epsdelta), Vector(delta,delta,-epsdelta), Vector(delta,0,-epsdelta)]]
-        # and now iterate through all the contact faces, and create FreeCAD Part.Faces
-        # The contact list is flat (to be able to store it as a PropertyIntegerList) so must go in steps of 4
-        for contactIndex in range(0,len(contacts),4):
-            vbase = Vector(gbbox.XMin + contacts[contactIndex] * delta, gbbox.YMin + contacts[contactIndex+1] * delta, gbbox.ZMin + contacts[contactIndex+2] * delta)
-            # the third element of 'contact' is the
-            # index of the sides, order is ['+x', '-x', '+y', '-y', '+z', '-z']
-            vertex = vertexes[contacts[contactIndex+3]]
-            # create the face
-            # calculate the vertexes
-            v11 = vbase + vertex[0]
-            v12 = vbase + vertex[1]
-            v13 = vbase + vertex[2]
-            v14 = vbase + vertex[3]
-            # now make the face
-            shapePoints.extend([v11,v12,v13,v14])
-        # create the shell out of the list of faces
-        if len(shapePoints) > 0:
-            return True
-        else:
+        # the contact list is flat (to be able to store it as a PropertyIntegerList)
+        if len(contacts) == 0:
             return None
+        return EM.contact_shell_quads(contacts,(gbbox.XMin,gbbox.YMin,gbbox.ZMin),delta,1.0/EMVHPORT_EPSDELTA)
+
+    def getContactsLOD(self,posContacts,negContacts,faceBudget):
+        ''' Get the contacts at the finest level of detail fitting into the face budget
+
+            'posContacts', 'negContacts' are the lists of positive and negative contacts
+                (see voxelizeContact() for the format)
+            'faceBudget' is the maximum number of faces. If zero or negative, there is no limit.
+
+            The downsampled contacts (see pool_contacts() and EMVHPORT_LOD_FACTORS)
+            are cached in 'self.contactLOD', until the contacts change ('self.contactsGeneration').
+            The downsampled voxels are aligned to the voxel space origin.
+
+            Returns a tuple (posContacts, negContacts, factor) of the contacts
+            and of the downsampling factor
+    '''
+        numFaces = (len(posContacts) + len(negContacts)) // 4
+        if faceBudget <= 0 or numFaces <= faceBudget:
+            return posContacts, negContacts, 1
+        key = getattr(self,"contactsGeneration",0)
+        if not hasattr(self,"contactLOD") or self.contactLOD is None or self.contactLOD['key'] != key:
+            self.contactLOD = {'key': key, 'levels': {}}
+        levels = self.contactLOD['levels']
+        for factor in EMVHPORT_LOD_FACTORS:
+            if not factor in levels:
+                levels[factor] = (EM.pool_contacts(posContacts,factor), EM.pool_contacts(negContacts,factor))
+            # the coarsest level is always accepted
+            if (len(levels[factor][0]) + len(levels[factor][1])) // 4 <= faceBudget or factor == EMVHPORT_LOD_FACTORS[-1]:
+                return levels[factor][0], levels[factor][1], factor
+
+    def clearShapePoints(self):
+        ''' Empty the coin3d representation of the voxelized contacts
+    '''
+        self.posContactShapePoints = np.zeros((0,3),dtype=np.float32)
+        self.posContactNumVertices = np.zeros(0,dtype=np.int32)
+        self.negContactShapePoints = np.zeros((0,3),dtype=np.float32)
+        self.negContactNumVertices = np.zeros(0,dtype=np.int32)
 
     def voxelizePort(self):
         ''' Voxelize the port object, i.e. find all the voxel faces belonging to the port
@@ -340,6 +372,8 @@ class _VHPort:
         if solver is None:
              return
         FreeCAD.Console.PrintMessage(translate("EM","Starting voxelization of port ") + self.Object.Label + "...\n")
+        # the profile entry of the port describes the latest voxelization only
+        solver.Proxy.getProfiler().clear(self.Object.Name)
         # get global parameters from the VHSolver object
         gbbox = solver.Proxy.getGlobalBBox()
         delta = solver.Proxy.getDelta()
@@ -414,53 +448,47 @@ class _VHPort:
         # to the face (as it is a TopoShape)
         vec = FreeCAD.Vector(0,0,0)
         testVertex = Part.Vertex(vec)
-        # this is half the side of the voxel
-        halfdelta = delta/2.0
-        # array to find the six neighbors
-        sides = [(1,0,0), (-1,0,0), (0,1,0), (0,-1,0), (0,0,1), (0,0,-1)]
-        # index of the sides, order is ['+x', '-x', '+y', '-y', '+z', '-z']
-        sideStrs = range(6)
-        # centers of the sides, with respect to the lower corner (with the smallest coordinates)
-        sideCenters = [Vector(delta,halfdelta,halfdelta), Vector(0.0,halfdelta,halfdelta),
-                        Vector(halfdelta,delta,halfdelta), Vector(halfdelta,0.0,halfdelta),
-                        Vector(halfdelta,halfdelta,delta), Vector(halfdelta,halfdelta,0.0)]
-        # and now iterate to find which voxel is inside the bounding box of the 'face',
-        vbase = Vector(gbbox.XMin + min_x * delta, gbbox.YMin + min_y * delta, gbbox.ZMin + min_z * delta)
-        for step_x in range(min_x,max_x+1):
-            vbase.y = gbbox.YMin + min_y * delta
-            for step_y in range(min_y,max_y+1):
-                vbase.z = gbbox.ZMin + min_z * delta
-                for step_z in range(min_z,max_z+1):
-                    # check if voxel is belonging to an object
-                    if voxelSpace[step_x,step_y,step_z] != 0:
-                        # scan the six neighbor voxels, to see if they are belonging to the conductor or not.
-                        # If they are not belonging to the conductor, or if the voxel space is finished, the current voxel
-                        # side in the direction of the empty voxel is an external surface
-                        for side, sideStr, sideCenter in zip(sides,sideStrs,sideCenters):
-                            is_surface = False
-                            nextVoxelIndexes = [step_x+side[0],step_y+side[1],step_z+side[2]]
-                            if (nextVoxelIndexes[0] > max_x or nextVoxelIndexes[0] < 0 or
-                               nextVoxelIndexes[1] > max_y or nextVoxelIndexes[1] < 0 or
-                               nextVoxelIndexes[2] > max_z or nextVoxelIndexes[2] < 0):
-                                is_surface = True
-                            else:
-                                if voxelSpace[nextVoxelIndexes[0],nextVoxelIndexes[1],nextVoxelIndexes[2]] == 0:
-                                    is_surface = True
-                            if is_surface == True:
-                                testVertex.Placement.Base = vbase + sideCenter
-                                # if the point is close enough to the face(s), we consider
-                                # the voxel surface as belonging to the voxelized face(s);
-                                # to this goal, take the shortest distance from any of the faces
-                                mindist = bbox.DiagonalLength
-                                for face in faces:
-                                    dist = abs(testVertex.distToShape(face)[0])
-                                    if dist < mindist:
-                                        mindist = dist
-                                if mindist < (delta*deltadist):
-                                    contactList.extend([step_x,step_y,step_z,sideStr])
-                    vbase.z += delta
-                vbase.y += delta
-            vbase.x += delta
+        # if the side center is close enough to the face(s), we consider the voxel side
+        # as belonging to the voxelized face(s). First compute the distances in batch against
+        # a tessellation of the faces; only the distances too close to the threshold to be decided
+        # with the tessellation are computed again exactly, with distToShape()
+        threshold = delta*deltadist
+        tessTol = threshold * EMVHPORT_TESS_TOL
+        profiler = EM.getVHSolver().Proxy.getProfiler()
+        triangles = []
+        with profiler.stage(self.Object.Name, "tessellation"):
+            for face in faces:
+                points, facets = face.tessellate(tessTol)
+                if len(facets) > 0:
+                    triangles.append(np.array(points)[np.array(facets, dtype=np.int64)])
+            if len(triangles) > 0:
+                triangles = np.concatenate(triangles)
+            else:
+                triangles = np.zeros((0,3,3))
+        profiler.count(self.Object.Name, "facets", len(triangles))
+        with profiler.stage(self.Object.Name, "contact sides"):
+            result = EM.voxelize_contact_mesh(voxelSpace,(gbbox.XMin,gbbox.YMin,gbbox.ZMin),delta,(min_x,min_y,min_z),(max_x,max_y,max_z),
+                                              triangles,threshold,tessTol)
+        candidates = result['sides']
+        profiler.count(self.Object.Name, "surface sides", len(candidates))
+        if len(candidates) == 0:
+            return []
+        sidePoints = result['side_points']
+        isContact = result['is_contact']
+        with profiler.stage(self.Object.Name, "distToShape"):
+            for index in result['check']:
+                testVertex.Placement.Base = Vector(sidePoints[index])
+                # take the shortest distance from any of the faces
+                mindist = bbox.DiagonalLength
+                for face in faces:
+                    dist = abs(testVertex.distToShape(face)[0])
+                    if dist < mindist:
+                        mindist = dist
+                if mindist < threshold:
+                    isContact[index] = True
+        profiler.count(self.Object.Name, "distToShape", len(result['check']) * len(faces))
+        profiler.count(self.Object.Name, "contacts", np.count_nonzero(isContact))
+        contactList = candidates[isContact].ravel().tolist()
         return contactList
 
     def flagVoxelizationInvalid(self):
@@ -469,6 +497,29 @@ class _VHPort:
         self.Object.isVoxelized = False
         self.Object.ShowVoxels = False
 
+    def shiftVoxelization(self,offset,vs_size):
+        ''' Shifts the voxel contacts, when the voxel space is re-embedded with a different origin
+
+        'offset' is the (x,y,z) integer offset to add to the voxel indexes
+        'vs_size' is the (x,y,z) size of the re-embedded voxel space
+
+        If any contact falls outside the voxel space, the voxelization is flagged as invalid
+    '''
+        if self.Object.isVoxelized == False:
+            return
+        shiftedContacts = []
+        for contacts in [self.Object.PosVoxelContacts, self.Object.NegVoxelContacts]:
+            shifted = list(contacts)
+            for contactIndex in range(0,len(shifted),4):
+                for axis in range(3):
+                    shifted[contactIndex+axis] = shifted[contactIndex+axis] + int(offset[axis])
+                    if shifted[contactIndex+axis] < 0 or shifted[contactIndex+axis] >= vs_size[axis]:
+                        self.flagVoxelizationInvalid()
+                        return
+            shiftedContacts.append(shifted)
+        self.Object.PosVoxelContacts = shiftedContacts[0]
+        self.Object.NegVoxelContacts = shiftedContacts[1]
+
     def getBaseObj(self):
         ''' Retrieves the Base object.
 
@@ -479,7 +530,7 @@ class _VHPort:
     def getCondIndex(self):
         ''' Retrieves the conductor index.
 
-            Returns the int16 conductor index.
+            Returns the conductor index.
     '''
         return self.Object.CondIndex
 
@@ -514,9 +565,9 @@ class _VHPort:
             fid.write(name + " " + str(contacts[contactIndex+0]+1) + " " + str(contacts[contactIndex+1]+1) + " " + str(contacts[contactIndex+2]+1) + " " + EMVHPORT_SIDESTRS[contacts[contactIndex+3]] + "\n")
 
     def __getstate__(self):
-        # JSON does not understand FreeCAD.Vector, so need to convert to tuples
-        negConShapePointsJSON = [(x[0],x[1],x[2]) for x in self.negContactShapePoints]
-        posConShapePointsJSON = [(x[0],x[1],x[2]) for x in self.posContactShapePoints]
+        # JSON does not understand numpy arrays, so need to convert to lists
+        negConShapePointsJSON = self.negContactShapePoints.tolist()
+        posConShapePointsJSON = self.posContactShapePoints.tolist()
         dictForJSON = {'nsp':negConShapePointsJSON,'psp':posConShapePointsJSON,'type':self.Type}
         #FreeCAD.Console.PrintMessage("Save\n"+str(dictForJSON)+"\n") #debug
         return dictForJSON
@@ -524,9 +575,13 @@ class _VHPort:
     def __setstate__(self,dictForJSON):
         if dictForJSON:
             #FreeCAD.Console.PrintMessage("Load\n"+str(dictForJSON)+"\n") #debug
-            # no need to convert back to FreeCAD.Vectors, 'shapePoints' can also be tuples
-            self.negContactShapePoints = dictForJSON['nsp']
-            self.posContactShapePoints = dictForJSON['psp']
+            # older versions stored the points as lists of FreeCAD.Vector tuples; the format is the same
+            self.negContactShapePoints = np.array(dictForJSON['nsp'],dtype=np.float32).reshape(-1,3)
+            self.posContactShapePoints = np.array(dictForJSON['psp'],dtype=np.float32).reshape(-1,3)
+            # all the faces are quadrilaterals
+            self.negContactNumVertices = np.full(self.negContactShapePoints.shape[0]//4,4,dtype=np.int32)
+            self.posContactNumVertices = np.full(self.posContactShapePoints.shape[0]//4,4,dtype=np.int32)
+            self.contactLOD = None
             self.Type = dictForJSON['type']
 
 class _ViewProviderVHPort:
@@ -622,8 +677,7 @@ class _ViewProviderVHPort:
     '''
         #FreeCAD.Console.PrintMessage("ViewProvider updateData(),  property: " + str(prop) + "\n") # debug
         if prop == "Shape":
-            numpointsPos = len(self.Object.Proxy.posContactShapePoints)
-            numpointsNeg = len(self.Object.Proxy.negContactShapePoints)
+            proxy = self.Object.Proxy
             # this can be used to reset the number of points to the value actually needed
             # (e.g. shorten the array, or pre-allocate it). However setValue() will automatically
             # increase the array size if needed, and will NOT shorten it if less values are inserted
@@ -631,19 +685,17 @@ class _ViewProviderVHPort:
             # we specify how many points (vertices) we want out of the total array, so no issue
             # if the array is longer
             #self.data.point.setNum(numpoints)
-            self.dataPos.point.setValues(0,numpointsPos,self.Object.Proxy.posContactShapePoints)
-            self.dataNeg.point.setValues(0,numpointsNeg,self.Object.Proxy.negContactShapePoints)
-            # 'numvertices' contains the number of vertices used for each face.
-            # Here all faces are quadrilaterals, so this is a long array of number '4's
-            numverticesPos = [4 for i in range(int(numpointsPos/4))]
-            numverticesNeg = [4 for i in range(int(numpointsNeg/4))]
+            # the (N,3) float32 arrays are passed as they are, without per-vertex conversions
+            self.dataPos.point.setValues(0,len(proxy.posContactShapePoints),proxy.posContactShapePoints)
+            self.dataNeg.point.setValues(0,len(proxy.negContactShapePoints),proxy.negContactShapePoints)
             # set the number of vertices per each face, for a total of len(numvertices) faces, starting from 0
             # but must first delete all the old values, otherwise the remaining panels with vertices from
             # 'numvertices+1' will still be shown
             self.facePos.numVertices.deleteValues(0,-1)
-            self.facePos.numVertices.setValues(0,len(numverticesPos),numverticesPos)
+            # pivy does not convert the Numpy int32 scalars, so the counts are passed as lists of Python ints
+            self.facePos.numVertices.setValues(0,len(proxy.posContactNumVertices),proxy.posContactNumVertices.tolist())
             self.faceNeg.numVertices.deleteValues(0,-1)
-            self.faceNeg.numVertices.setValues(0,len(numverticesNeg),numverticesNeg)
+            self.faceNeg.numVertices.setValues(0,len(proxy.negContactNumVertices),proxy.negContactNumVertices.tolist())
             #FreeCAD.Console.PrintMessage("numpoints " + str(numpoints) + "; numvertices " + str(numvertices) + "\n") # debug
             #FreeCAD.Console.PrintMessage("self.Object.Proxy.shapePoints " + str(self.Object.Proxy.shapePoints) + "\n") # debug
             #FreeCAD.Console.PrintMessage("self.data.point " + str(self.data.point.get()) + "\n") # debug
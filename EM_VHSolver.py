@@ -36,8 +36,11 @@ EMVHSOLVER_DEF_TRANSPARENCY = 90
 EMVHSOLVER_DEF_DELTA = 1.0
 # minimum frequency that can be specified
 EMVHSOLVER_DEF_MINFREQ = 1e-6
-# maximum index value that can be contained in the voxel space array (made of int16)
-EMVHSOLVER_COND_ID_OVERFLOW = 65535
+# unsigned integer types of the voxel space. The narrowest type that can contain
+# all the conductor indexes is used (see getVoxelSpaceDtype())
+EMVHSOLVER_VOXELSPACE_DTYPES = ["uint8", "uint16", "uint32"]
+# maximum index value that can be contained in the voxel space array (of the widest type)
+EMVHSOLVER_COND_ID_OVERFLOW = 4294967295
 # allowed .units
 EMVHSOLVER_UNITS = ["km", "m", "cm", "mm", "um", "nm", "in", "mils"]
 EMVHSOLVER_UNITS_VALS = [1e3, 1, 1e-2, 1e-3, 1e-6, 1e-9, 2.54e-2, 1e-3]
@@ -51,11 +54,59 @@ EMVHSOLVER_DEFFMAX = 1.0e+10
 EMVHSOLVER_DEFNDEC = 1
 # default input file name
 EMVHSOLVER_DEF_FILENAME = "voxhenry_input_file.vhr"
+# default number of workers for the voxelization (1 means voxelize in the main thread)
+EMVHSOLVER_DEF_WORKERS = 1
+# voxel space storage backends. 'Dense' is a plain Numpy 3D array, 'Sparse' allocates only
+# the tiles of the voxel space containing conductor voxels (see SparseVoxelSpace), 'Octree'
+# also stores the uniform blocks inside the tiles, e.g. the conductor interiors, as single values
+# (see OctreeVoxelSpace), 'Memmap' is a Numpy 3D array mapped on a scratch file, for voxel spaces
+# larger than the available memory
+EMVHSOLVER_VOXELSPACE_BACKENDS = ["Dense", "Sparse", "Octree", "Memmap"]
+EMVHSOLVER_DEF_VOXELSPACE_BACKEND = "Dense"
+# edge length, in voxels, of the tiles of the sparse voxel space
+EMVHSOLVER_SPARSE_TILE = 32
+# edge length, in voxels, of the tiles of the octree voxel space, and of the smallest
+# octree blocks (stored as dense arrays). Both must be powers of two
+EMVHSOLVER_OCTREE_TILE = 64
+EMVHSOLVER_OCTREE_LEAF = 8
+# suffix of the scratch files of the memory-mapped voxel space (in the document transient folder)
+EMVHSOLVER_MEMMAP_SUFFIX = ".voxels"
+# max number of voxels copied at once to or from a memory-mapped voxel space
+EMVHSOLVER_MEMMAP_SLAB = 16777216
+# tolerance, relative to 'delta', when comparing voxel grid origins
+EMVHSOLVER_GRID_TOL = 1e-6
+# on-disk voxelization cache: default enable state (the cache is opt-in, as it writes to disk
+# outside the document), maximum total size (MB), and sub-folder of the user application data folder
+# used if no cache folder is specified
+EMVHSOLVER_DEF_VOXELCACHE = False
+EMVHSOLVER_DEF_VOXELCACHE_SIZE = 1024
+EMVHSOLVER_VOXELCACHE_FOLDER = "EM_VoxelCache"
+# number of decimal digits (relative to 'delta') of the voxel grid offset used in the cache keys
+EMVHSOLVER_VOXELCACHE_DIGITS = 9
+# version of the format of the binary voxel space file stored in the FreeCAD document
+EMVHSOLVER_VOXELSPACE_FILE_VERSION = 1
+# default enable state of the dump of the voxelization and export profile, and suffix of
+# the JSON profile file name (written next to the VoxHenry input file)
+EMVHSOLVER_DEF_DUMPPROFILE = False
+EMVHSOLVER_PROFILE_SUFFIX = "_profile.json"
 
 import FreeCAD, FreeCADGui, Mesh, Part, MeshPart, Draft, DraftGeomUtils, os
 from FreeCAD import Vector
 import math
 import numpy as np
+import hashlib
+import copy
+import tempfile
+import shutil
+import atexit
+import time
+import json
+import contextlib
+import multiprocessing
+import concurrent.futures
+import tracemalloc
+from scipy import ndimage
+import EM
 
 if FreeCAD.GuiUp:
     import FreeCADGui
@@ -73,6 +124,682 @@ else:
 __dir__ = os.path.dirname(__file__)
 iconPath = os.path.join( __dir__, 'Resources' )
 
+class SparseVoxelSpace:
+    ''' Sparse, tiled voxel space
+
+    Stores the voxel tensor as a dictionary of dense cubic tiles, allocating only the tiles
+    that contain at least one non-zero voxel. Implements the subset of the Numpy array interface
+    used on the voxel space: 'shape', 'size', 'dtype', slicing (returning dense copies),
+    slice assignment, integer element access, 'nonzero()', coordinate-list ('fancy') indexing,
+    and masked assignment in the form 'voxelSpace[voxelSpace == value] = newValue'
+    (comparisons return an EM.VoxelMask).
+    Note that, unlike Numpy, slicing returns a copy and not a view, so to modify a sub-box
+    the caller must assign it back.
+    '''
+    def __init__(self, shape, dtype=np.uint8, tile=EMVHSOLVER_SPARSE_TILE):
+        ''' 'shape' is the (x,y,z) tuple of the voxel space dimensions
+            'dtype' is the Numpy type of the voxels
+            'tile' is the tile edge length, in voxels
+    '''
+        self.shape = tuple(int(dim) for dim in shape)
+        self.dtype = np.dtype(dtype)
+        self.tile = int(tile)
+        self.tiles = {}
+
+    @classmethod
+    def fromArray(cls, array, tile=EMVHSOLVER_SPARSE_TILE):
+        ''' Creates a sparse voxel space from a dense Numpy 3D array
+
+            'array' is the dense voxel tensor
+            'tile' is the tile edge length, in voxels
+
+            Returns the SparseVoxelSpace object
+    '''
+        voxelSpace = cls(array.shape, array.dtype, tile)
+        if isinstance(array, SparseVoxelSpace):
+            # copy the allocated tiles only
+            ranges = [(0, dim) for dim in array.shape]
+            for tileKey in sorted(array.tiles):
+                tileKey, tileSlices, boxSlices = array._tileOverlap(tileKey, ranges)
+                voxelSpace[boxSlices] = array._getTile(tileKey)[tileSlices]
+        else:
+            voxelSpace[:,:,:] = array
+        return voxelSpace
+
+    @property
+    def size(self):
+        return self.shape[0]*self.shape[1]*self.shape[2]
+
+    @property
+    def ndim(self):
+        return 3
+
+    def toArray(self):
+        ''' Returns the voxel space as a dense Numpy 3D array
+    '''
+        return self[:,:,:]
+
+    def _getTile(self, tileKey):
+        ''' Returns the tile 'tileKey' as a dense array, or None if not allocated.
+            The caller must store back any change with _putTile()
+    '''
+        return self.tiles.get(tileKey)
+
+    def _putTile(self, tileKey, tile):
+        ''' Stores the dense array 'tile' as the tile 'tileKey', releasing the tile if empty
+    '''
+        if tile.any():
+            self.tiles[tileKey] = tile
+        else:
+            self.tiles.pop(tileKey, None)
+
+    def _readTile(self, tileKey, tileSlices, out):
+        ''' Copies the 'tileSlices' part of the allocated tile 'tileKey' into the 'out' array
+    '''
+        out[...] = self.tiles[tileKey][tileSlices]
+
+    def _normalizeKey(self, key):
+        ''' Converts an indexing key into three (start, stop) ranges
+
+            'key' is a tuple of three slices or integers
+
+            Returns a tuple (ranges, squeeze) where 'ranges' is a list of three (start, stop) tuples
+            and 'squeeze' is a tuple of the axes indexed by an integer, to be removed from the result
+    '''
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) < 3:
+            key = key + (slice(None),) * (3 - len(key))
+        if len(key) != 3:
+            raise IndexError("SparseVoxelSpace supports only 3D indexing")
+        ranges = []
+        squeeze = []
+        for axis, index in enumerate(key):
+            if isinstance(index, slice):
+                start, stop, step = index.indices(self.shape[axis])
+                if step != 1:
+                    raise IndexError("SparseVoxelSpace does not support slices with step different from 1")
+                ranges.append((start, max(start, stop)))
+            else:
+                index = int(index)
+                if index < 0:
+                    index = index + self.shape[axis]
+                if index < 0 or index >= self.shape[axis]:
+                    raise IndexError("index " + str(index) + " is out of bounds for axis " + str(axis) + " with size " + str(self.shape[axis]))
+                ranges.append((index, index + 1))
+                squeeze.append(axis)
+        return ranges, tuple(squeeze)
+
+    def _tileOverlap(self, tileKey, ranges):
+        ''' Computes the overlap between a tile and a box
+
+            'tileKey' is the (x,y,z) tuple identifying the tile
+            'ranges' is a list of three (start, stop) tuples, as returned by _normalizeKey()
+
+            Returns a (tileKey, tileSlices, boxSlices) tuple, or None if the tile does not overlap the box
+    '''
+        tileSlices = []
+        boxSlices = []
+        for axis in range(3):
+            origin = tileKey[axis] * self.tile
+            start = max(ranges[axis][0], origin)
+            stop = min(ranges[axis][1], origin + self.tile)
+            if start >= stop:
+                return None
+            tileSlices.append(slice(start - origin, stop - origin))
+            boxSlices.append(slice(start - ranges[axis][0], stop - ranges[axis][0]))
+        return (tileKey, tuple(tileSlices), tuple(boxSlices))
+
+    def _tilesInRange(self, ranges, allocatedOnly=False):
+        ''' Lists the tiles overlapping a box, with the overlapping sub-ranges
+
+            'ranges' is a list of three (start, stop) tuples, as returned by _normalizeKey()
+            'allocatedOnly' if True limits the list to the allocated tiles
+
+            Returns a list of (tileKey, tileSlices, boxSlices) tuples
+    '''
+        if any(start >= stop for start, stop in ranges):
+            return []
+        tileRanges = [range(start // self.tile, (stop - 1) // self.tile + 1) for start, stop in ranges]
+        tileCount = len(tileRanges[0]) * len(tileRanges[1]) * len(tileRanges[2])
+        if allocatedOnly and tileCount > len(self.tiles):
+            # the box covers more tiles than the allocated ones, so scan the allocated tiles instead
+            keys = sorted(self.tiles)
+        else:
+            keys = [(tx, ty, tz) for tx in tileRanges[0] for ty in tileRanges[1] for tz in tileRanges[2]]
+            if allocatedOnly:
+                keys = [tileKey for tileKey in keys if tileKey in self.tiles]
+        overlaps = [self._tileOverlap(tileKey, ranges) for tileKey in keys]
+        return [overlap for overlap in overlaps if overlap is not None]
+
+    def _coordsToTiles(self, coords):
+        ''' Groups voxel coordinates per tile
+
+            'coords' is a tuple of three Numpy arrays of voxel indexes
+
+            Returns a list of (tileKey, positions, localCoords) tuples, where 'positions'
+            are the indexes of the coordinates belonging to the tile and 'localCoords'
+            are the coordinates relative to the tile origin
+    '''
+        coords = [np.asarray(coord, dtype=np.int64).ravel() for coord in coords]
+        for axis in range(3):
+            coords[axis] = np.where(coords[axis] < 0, coords[axis] + self.shape[axis], coords[axis])
+            if coords[axis].size > 0 and (coords[axis].min() < 0 or coords[axis].max() >= self.shape[axis]):
+                raise IndexError("index out of bounds for axis " + str(axis) + " with size " + str(self.shape[axis]))
+        tileCoords = [coord // self.tile for coord in coords]
+        if coords[0].size == 0:
+            return []
+        tileIds = np.ravel_multi_index(tileCoords, [(dim - 1) // self.tile + 1 for dim in self.shape])
+        order = np.argsort(tileIds, kind='stable')
+        uniqueIds, starts = np.unique(tileIds[order], return_index=True)
+        stops = np.append(starts[1:], order.size)
+        groups = []
+        for tileIndex, start, stop in zip(uniqueIds, starts, stops):
+            positions = order[start:stop]
+            tileKey = tuple(int(tileCoord[positions[0]]) for tileCoord in tileCoords)
+            localCoords = tuple(coords[axis][positions] - tileKey[axis] * self.tile for axis in range(3))
+            groups.append((tileKey, positions, localCoords))
+        return groups
+
+    def _isCoordList(self, key):
+        return isinstance(key, tuple) and len(key) == 3 and all(isinstance(index, (np.ndarray, list)) for index in key)
+
+    def __getitem__(self, key):
+        if self._isCoordList(key):
+            values = np.zeros(np.asarray(key[0]).size, self.dtype)
+            for tileKey, positions, localCoords in self._coordsToTiles(key):
+                tile = self._getTile(tileKey)
+                if tile is not None:
+                    values[positions] = tile[localCoords]
+            return values
+        ranges, squeeze = self._normalizeKey(key)
+        box = np.zeros([stop - start for start, stop in ranges], self.dtype)
+        for tileKey, tileSlices, boxSlices in self._tilesInRange(ranges, allocatedOnly=True):
+            self._readTile(tileKey, tileSlices, box[boxSlices])
+        if len(squeeze) == 3:
+            return box[0,0,0]
+        if len(squeeze) > 0:
+            box = box.squeeze(axis=squeeze)
+        return box
+
+    def __setitem__(self, key, value):
+        if isinstance(key, EM.VoxelMask):
+            self._setMasked(key, value)
+            return
+        if self._isCoordList(key):
+            values = np.broadcast_to(np.asarray(value, self.dtype), np.asarray(key[0]).shape).ravel()
+            for tileKey, positions, localCoords in self._coordsToTiles(key):
+                tile = self._getTile(tileKey)
+                if tile is None:
+                    if not values[positions].any():
+                        continue
+                    tile = np.zeros((self.tile,)*3, self.dtype)
+                tile[localCoords] = values[positions]
+                self._putTile(tileKey, tile)
+            return
+        ranges, squeeze = self._normalizeKey(key)
+        boxShape = [stop - start for start, stop in ranges]
+        value = np.asarray(value, self.dtype)
+        if value.ndim > 0 and len(squeeze) > 0:
+            value = np.expand_dims(value, squeeze)
+        value = np.broadcast_to(value, boxShape)
+        if value.ndim == 3 and value.strides == (0, 0, 0) and value.size > 0 and value.flat[0] == 0:
+            # assigning zero: only the allocated tiles may change
+            overlaps = self._tilesInRange(ranges, allocatedOnly=True)
+        else:
+            overlaps = self._tilesInRange(ranges)
+        for tileKey, tileSlices, boxSlices in overlaps:
+            tile = self._getTile(tileKey)
+            boxValue = value[boxSlices]
+            if tile is None:
+                if not boxValue.any():
+                    continue
+                tile = np.zeros((self.tile,)*3, self.dtype)
+            tile[tileSlices] = boxValue
+            self._putTile(tileKey, tile)
+
+    def __eq__(self, value):
+        return EM.VoxelMask.compare(self, value)
+
+    def __ne__(self, value):
+        return EM.VoxelMask.compare(self, value, equal=False)
+
+    __hash__ = None
+
+    def _setMasked(self, mask, value):
+        ''' Assigns 'value' to all the voxels selected by the 'mask' comparison
+    '''
+        if mask.voxel_space is not self:
+            raise IndexError("SparseVoxelSpace mask refers to a different voxel space")
+        if mask.selects_empty:
+            # the mask would also select the non-allocated (zero) tiles
+            raise IndexError("SparseVoxelSpace does not support masked assignment of the empty voxels")
+        for tileKey in list(self.tiles):
+            tile = self._getTile(tileKey)
+            tile[mask.evaluate(tile)] = value
+            self._putTile(tileKey, tile)
+
+    def nonzero(self):
+        ''' Returns a tuple of three Numpy arrays with the indexes of the non-zero voxels,
+            in C (row-major) order, as numpy.nonzero()
+    '''
+        coords = [[], [], []]
+        for tileKey in sorted(self.tiles):
+            tileCoords = self._getTile(tileKey).nonzero()
+            for axis in range(3):
+                coords[axis].append(tileCoords[axis] + tileKey[axis] * self.tile)
+        if len(coords[0]) == 0:
+            return tuple(np.zeros(0, np.intp) for axis in range(3))
+        coords = [np.concatenate(coord) for coord in coords]
+        order = np.lexsort((coords[2], coords[1], coords[0]))
+        return tuple(coord[order] for coord in coords)
+
+    def count_nonzero(self):
+        ''' Returns the number of non-zero voxels
+    '''
+        return sum(int(np.count_nonzero(self._getTile(tileKey))) for tileKey in self.tiles)
+
+    def max(self):
+        ''' Returns the maximum voxel value
+    '''
+        return max([self._getTile(tileKey).max() for tileKey in self.tiles] + [self.dtype.type(0)])
+
+    def mapValues(self, function, dtype=None):
+        ''' Creates a copy of the voxel space, with the voxel values transformed by 'function'
+
+            'function' maps an array of voxel values to an array of the same shape and of type 'dtype'.
+                The empty voxels (zero) must be mapped to zero
+            'dtype' is the Numpy type of the new voxel space. If None, the type is not changed
+
+            Returns the new voxel space
+    '''
+        voxelSpace = copy.copy(self)
+        voxelSpace.tiles = {}
+        if dtype is not None:
+            voxelSpace.dtype = np.dtype(dtype)
+        for tileKey in sorted(self.tiles):
+            voxelSpace._putTile(tileKey, function(self._getTile(tileKey)).astype(voxelSpace.dtype, copy=False))
+        return voxelSpace
+
+    @property
+    def nbytes(self):
+        return sum(tile.nbytes for tile in self.tiles.values())
+
+class OctreeVoxelSpace(SparseVoxelSpace):
+    ''' Adaptive (octree) tiled voxel space
+
+    As SparseVoxelSpace, allocates only the tiles that contain at least one non-zero voxel.
+    Each tile is stored as an octree: a uniform block (e.g. the interior of a conductor, or
+    the empty space around it) is stored as a single value, while a block containing different
+    values is split in eight sub-blocks, down to dense arrays of EMVHSOLVER_OCTREE_LEAF voxels
+    per side. So the fine voxels are stored only close to the conductor surfaces, and
+    to the boundaries between different conductors.
+    The voxel space still represents the uniform 'delta' grid: reading a box (e.g. the slabs
+    streamed by the VoxHenry exporter) expands only the blocks overlapping the box.
+    '''
+    def __init__(self, shape, dtype=np.uint8, tile=EMVHSOLVER_OCTREE_TILE, leaf=EMVHSOLVER_OCTREE_LEAF):
+        ''' 'shape' is the (x,y,z) tuple of the voxel space dimensions
+            'dtype' is the Numpy type of the voxels
+            'tile' is the tile edge length, in voxels (a power of two)
+            'leaf' is the edge length of the smallest blocks, in voxels (a power of two)
+    '''
+        super().__init__(shape, dtype, tile)
+        self.leaf = min(int(leaf), self.tile)
+        # last decoded tile, as the voxel space is usually accessed with spatial locality
+        self.cachedKey = None
+        self.cachedTile = None
+
+    def _encodeNode(self, block):
+        ''' Builds the octree node of a cubic block
+
+            Returns the single value of a uniform block, the copy of the block if not larger
+            than a leaf, or the list of the eight sub-block nodes in x, y, z order
+    '''
+        value = block.flat[0]
+        if not (block != value).any():
+            return self.dtype.type(value)
+        if block.shape[0] <= self.leaf:
+            return block.copy()
+        half = block.shape[0] // 2
+        return [self._encodeNode(block[x:x+half, y:y+half, z:z+half]) for x in (0, half) for y in (0, half) for z in (0, half)]
+
+    def _readNode(self, node, nodeMin, nodeSize, ranges, out):
+        ''' Copies the part of a node overlapping a box into the 'out' array
+
+            'node' is the octree node (see _encodeNode())
+            'nodeMin' is the (x,y,z) position of the node in the tile
+            'nodeSize' is the node edge length
+            'ranges' is a list of three (start, stop) tuples of the box in the tile
+            'out' is the array of the box
+    '''
+        low = [max(ranges[axis][0], nodeMin[axis]) for axis in range(3)]
+        high = [min(ranges[axis][1], nodeMin[axis] + nodeSize) for axis in range(3)]
+        if any(low[axis] >= high[axis] for axis in range(3)):
+            return
+        if isinstance(node, list):
+            half = nodeSize // 2
+            for index, child in enumerate(node):
+                childMin = (nodeMin[0] + half * ((index >> 2) & 1), nodeMin[1] + half * ((index >> 1) & 1), nodeMin[2] + half * (index & 1))
+                self._readNode(child, childMin, half, ranges, out)
+            return
+        outSlices = tuple(slice(low[axis] - ranges[axis][0], high[axis] - ranges[axis][0]) for axis in range(3))
+        if isinstance(node, np.ndarray):
+            out[outSlices] = node[tuple(slice(low[axis] - nodeMin[axis], high[axis] - nodeMin[axis]) for axis in range(3))]
+        else:
+            out[outSlices] = node
+
+    def _getTile(self, tileKey):
+        if tileKey == self.cachedKey:
+            return self.cachedTile.copy()
+        node = self.tiles.get(tileKey)
+        if node is None:
+            return None
+        tile = np.zeros((self.tile,)*3, self.dtype)
+        self._readNode(node, (0, 0, 0), self.tile, [(0, self.tile)]*3, tile)
+        self.cachedKey = tileKey
+        self.cachedTile = tile
+        return tile.copy()
+
+    def _putTile(self, tileKey, tile):
+        node = self._encodeNode(tile)
+        if isinstance(node, list) or isinstance(node, np.ndarray) or node != 0:
+            self.tiles[tileKey] = node
+            self.cachedKey = tileKey
+            self.cachedTile = tile
+        else:
+            self.tiles.pop(tileKey, None)
+            if self.cachedKey == tileKey:
+                self.cachedKey = None
+                self.cachedTile = None
+
+    def _readTile(self, tileKey, tileSlices, out):
+        if tileKey == self.cachedKey:
+            out[...] = self.cachedTile[tileSlices]
+            return
+        ranges = [(tileSlice.start, tileSlice.stop) for tileSlice in tileSlices]
+        self._readNode(self.tiles[tileKey], (0, 0, 0), self.tile, ranges, out)
+
+    def _nodeStats(self, node, nodeSize, stats):
+        if isinstance(node, list):
+            stats['branchBlocks'] = stats['branchBlocks'] + 1
+            for child in node:
+                self._nodeStats(child, nodeSize // 2, stats)
+        elif isinstance(node, np.ndarray):
+            stats['fineBlocks'] = stats['fineBlocks'] + 1
+            stats['fineVoxels'] = stats['fineVoxels'] + node.size
+            stats['storedBytes'] = stats['storedBytes'] + node.nbytes
+        else:
+            stats['coarseBlocks'] = stats['coarseBlocks'] + 1
+            stats['coarseVoxels'] = stats['coarseVoxels'] + nodeSize**3
+            stats['storedBytes'] = stats['storedBytes'] + self.dtype.itemsize
+
+    def getStats(self):
+        ''' Computes the statistics of the octree
+
+            Returns a dict with the number of allocated 'tiles', of 'coarseBlocks' (uniform blocks
+            stored as a single value) and of the voxels they contain ('coarseVoxels'), of 'fineBlocks'
+            (dense leaf blocks) and of the voxels they contain ('fineVoxels'), of 'branchBlocks'
+            (blocks split in sub-blocks), and the 'storedBytes' of the voxel values
+            (excluding the Python object overhead)
+    '''
+        stats = {'tiles': len(self.tiles), 'coarseBlocks': 0, 'coarseVoxels': 0, 'fineBlocks': 0,
+                 'fineVoxels': 0, 'branchBlocks': 0, 'storedBytes': 0}
+        for node in self.tiles.values():
+            self._nodeStats(node, self.tile, stats)
+        return stats
+
+    @property
+    def nbytes(self):
+        return self.getStats()['storedBytes']
+
+class VoxelCache:
+    ''' On-disk cache of VHConductor voxelizations
+
+    Each voxelization is stored as a compressed Numpy archive of the indexes of the voxels
+    inside the conductor, relative to the conductor voxel sub-box. The entries are keyed
+    by the conductor geometry hash, the voxel size, the offset of the voxel grid with respect
+    to the conductor and the inside check method, so the same solid voxelized on the same grid is found again also across
+    sessions and documents. When the total size exceeds the limit, the least recently used
+    entries are removed.
+    '''
+    def __init__(self, folder, maxSize):
+        ''' 'folder' is the cache folder path
+            'maxSize' is the maximum total size of the cache, in bytes
+    '''
+        self.folder = folder
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    @staticmethod
+    def makeKey(geometryHash, delta, gridOffset, size, insideCheck):
+        ''' Builds the cache key of a voxelization
+
+            'geometryHash' is the hash of the conductor geometry (see getGeometryHash() of the VHConductor)
+            'delta' is the voxels size length
+            'gridOffset' is the (x,y,z) position of the conductor voxel sub-box origin,
+                relative to the minimum point of the conductor bounding box
+            'size' is the (x,y,z) size of the conductor voxel sub-box, in voxels
+            'insideCheck' is the method used to classify the voxels intersecting the conductor
+                surface (see the 'InsideCheck' property of the VHConductor)
+
+            Returns the key as an hexadecimal string
+    '''
+        key = hashlib.sha1(str(geometryHash).encode())
+        key.update(repr(float(delta)).encode())
+        key.update(repr(tuple(np.round(np.asarray(gridOffset) / delta, EMVHSOLVER_VOXELCACHE_DIGITS).tolist())).encode())
+        key.update(repr(tuple(int(dim) for dim in size)).encode())
+        key.update(str(insideCheck).encode())
+        return key.hexdigest()
+
+    def getFilename(self, key):
+        return os.path.join(self.folder, key + ".npz")
+
+    def get(self, key, size):
+        ''' Retrieves a voxelization from the cache
+
+            'key' is the cache key (see makeKey())
+            'size' is the (x,y,z) size of the conductor voxel sub-box
+
+            Returns the boolean 3D mask of the voxels inside the conductor, or None if not found
+    '''
+        filename = self.getFilename(key)
+        try:
+            with np.load(filename) as entry:
+                if tuple(entry['size'].tolist()) != tuple(int(dim) for dim in size):
+                    raise ValueError("voxel cache entry size mismatch")
+                indexes = entry['indexes']
+            inside_mask = np.zeros(tuple(int(dim) for dim in size), dtype=bool)
+            inside_mask[tuple(indexes.T)] = True
+            # mark as recently used
+            os.utime(filename)
+        except (OSError, IOError, KeyError, ValueError, IndexError):
+            self.misses = self.misses + 1
+            return None
+        self.hits = self.hits + 1
+        return inside_mask
+
+    def put(self, key, inside_mask):
+        ''' Stores a voxelization in the cache, evicting the least recently used entries if needed
+
+            'key' is the cache key (see makeKey())
+            'inside_mask' is the boolean 3D mask of the voxels inside the conductor
+    '''
+        indexes = np.argwhere(inside_mask)
+        # indexes are relative to the conductor sub-box, so they usually fit in 16 bits
+        indexType = np.uint16 if max(inside_mask.shape) <= 65536 else np.uint32
+        try:
+            if not os.path.isdir(self.folder):
+                os.makedirs(self.folder)
+            # write to a temporary file first, so an interrupted write never leaves a corrupted entry
+            tempFilename = self.getFilename(key) + "." + str(os.getpid()) + ".tmp"
+            with open(tempFilename, 'wb') as fid:
+                np.savez_compressed(fid, size=np.array(inside_mask.shape), indexes=indexes.astype(indexType))
+            os.replace(tempFilename, self.getFilename(key))
+        except (OSError, IOError) as e:
+            FreeCAD.Console.PrintWarning(translate("EM","Cannot store the voxelization in the cache folder ") + "'" + self.folder + "' (" + str(e) + ")\n")
+            return
+        self.stores = self.stores + 1
+        self.evict()
+
+    def evict(self):
+        ''' Removes the least recently used entries, until the total size is below the limit
+    '''
+        entries = []
+        for filename in os.listdir(self.folder):
+            if filename.endswith(".npz"):
+                try:
+                    stat = os.stat(os.path.join(self.folder, filename))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, filename))
+        totalSize = sum([entry[1] for entry in entries])
+        for mtime, fileSize, filename in sorted(entries):
+            if totalSize <= self.maxSize:
+                break
+            try:
+                os.remove(os.path.join(self.folder, filename))
+            except OSError:
+                continue
+            totalSize = totalSize - fileSize
+
+    def clear(self):
+        ''' Removes all the entries from the cache
+    '''
+        if os.path.isdir(self.folder):
+            for filename in os.listdir(self.folder):
+                if filename.endswith(".npz"):
+                    os.remove(os.path.join(self.folder, filename))
+
+class VoxelProfiler:
+    ''' Registry of the durations and counters of the voxelization and export stages
+
+    The entries are kept per object Name (VHConductor, VHPort or VHSolver), and for each object
+    per stage. Every stage records the total duration, the number of runs, and the largest memory
+    used by a run ('peakMemory', in bytes, or None if not known). The memory of the stages timed
+    with stage() is the peak of the memory traced by tracemalloc during the stage, above the memory
+    already allocated when the stage starts, and is recorded only while tracing (see setTracing()).
+    As tracemalloc counts the allocations of all the threads, stage() must be used in the main
+    thread only; the stages run by the voxelization workers report their own memory to addTime().
+    The counters (e.g. facets, surface voxels, isInside calls) are summed per object.
+    Example:
+        with profiler.stage(obj.Name, "mesh"):
+            ...
+        profiler.count(obj.Name, "facets", facetCount)
+    '''
+    def __init__(self):
+        self.entries = {}
+        # traced memory of the running (nested) stages: memory at the stage start, and peak of the inner stages
+        self.memoryStack = []
+        self.startedTracing = False
+
+    def setTracing(self, enable):
+        ''' Starts or stops tracing the memory allocations with tracemalloc.
+            Tracing slows down the allocations, so it should be enabled only when the profile is needed.
+            Tracing started elsewhere is never stopped.
+
+            'enable' is True to trace the memory
+    '''
+        if enable and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.startedTracing = True
+        elif not enable and self.startedTracing:
+            if len(self.memoryStack) == 0:
+                tracemalloc.stop()
+                self.startedTracing = False
+
+    def getEntry(self, name):
+        if not name in self.entries:
+            self.entries[name] = {'stages': {}, 'counts': {}, 'peakMemory': None}
+        return self.entries[name]
+
+    @contextlib.contextmanager
+    def stage(self, name, stage):
+        ''' Context manager timing a stage of the object 'name'
+    '''
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            if len(self.memoryStack) > 0:
+                # the peak is reset for this stage, so save it for the outer stage
+                self.memoryStack[-1]['peak'] = max(self.memoryStack[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+            self.memoryStack.append({'start': current, 'peak': current})
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            memory = None
+            if tracing:
+                frame = self.memoryStack.pop()
+                peak = max(frame['peak'], tracemalloc.get_traced_memory()[1]) if tracemalloc.is_tracing() else frame['peak']
+                memory = peak - frame['start']
+                if len(self.memoryStack) > 0:
+                    self.memoryStack[-1]['peak'] = max(self.memoryStack[-1]['peak'], peak)
+            self.addTime(name, stage, duration, memory)
+
+    def addTime(self, name, stage, duration, memory=None):
+        ''' Adds a run of a stage of the object 'name'. Used directly for the stages
+            timed elsewhere, e.g. by a voxelization worker
+
+            'duration' is the stage duration in seconds
+            'memory' is the memory used by the stage run, in bytes, or None if not known
+    '''
+        entry = self.getEntry(name)
+        if not stage in entry['stages']:
+            entry['stages'][stage] = {'time': 0.0, 'runs': 0, 'peakMemory': None}
+        stageEntry = entry['stages'][stage]
+        stageEntry['time'] = stageEntry['time'] + duration
+        stageEntry['runs'] = stageEntry['runs'] + 1
+        if memory is not None:
+            stageEntry['peakMemory'] = max(stageEntry['peakMemory'] or 0, int(memory))
+            entry['peakMemory'] = max(entry['peakMemory'] or 0, int(memory))
+
+    def count(self, name, counter, value=1):
+        ''' Adds 'value' to the counter 'counter' of the object 'name'
+    '''
+        counts = self.getEntry(name)['counts']
+        counts[counter] = counts.get(counter, 0) + int(value)
+
+    def getTime(self, name, stage):
+        ''' Returns the total duration of a stage of the object 'name', in seconds (0.0 if never run)
+    '''
+        stageEntry = self.entries.get(name, {'stages': {}})['stages'].get(stage)
+        return stageEntry['time'] if stageEntry is not None else 0.0
+
+    def getCount(self, name, counter):
+        ''' Returns the value of a counter of the object 'name' (0 if never counted)
+    '''
+        return self.entries.get(name, {'counts': {}})['counts'].get(counter, 0)
+
+    def getReport(self):
+        ''' Returns a copy of all the entries, as a dict of plain Python objects
+            (see the class description for the layout)
+    '''
+        return json.loads(json.dumps(self.entries))
+
+    def clear(self, name=None):
+        ''' Removes the entries of the object 'name', or all the entries if 'name' is None
+    '''
+        if name is None:
+            self.entries = {}
+        else:
+            self.entries.pop(name, None)
+
+    def clearStage(self, stage):
+        ''' Removes the stage 'stage' from the entries of all the objects
+    '''
+        for entry in self.entries.values():
+            entry['stages'].pop(stage, None)
+
+    def dump(self, filename):
+        ''' Writes the entries to the JSON file 'filename'
+    '''
+        with open(filename, 'w') as fid:
+            json.dump({'date': time.strftime("%Y-%m-%d %H:%M:%S"), 'objects': self.entries}, fid, indent=1)
+
 def makeVHSolver(units=None,fmin=None,fmax=None,ndec=None,folder=None,filename=None,name='VHSolver'):
     ''' Creates a VoxHenry Solver object (all statements needed for the simulation, and container for objects)
 
@@ -151,17 +878,39 @@ class _VHSolver:
         obj.addProperty("App::PropertyString","Filename","EM",QT_TRANSLATE_NOOP("App::Property","Simulation filename when exporting to VoxHenry input file format"))
         obj.addProperty("App::PropertyBool","voxelSpaceValid","EM",QT_TRANSLATE_NOOP("App::Property","Flags the validity of the voxel space (read only)"),1)
         obj.addProperty("App::PropertyInteger","condIndexGenerator","EM",QT_TRANSLATE_NOOP("App::Property","Latest index for conductor numbering (hidden)"),4)
+        obj.addProperty("App::PropertyInteger","Workers","EM",QT_TRANSLATE_NOOP("App::Property","Number of workers used to voxelize the VHConductors (1 means no parallel voxelization). The workers are processes without GUI, threads otherwise"))
+        obj.addProperty("App::PropertyBool","VoxelCache","EM",QT_TRANSLATE_NOOP("App::Property","Store the VHConductor voxelizations in an on-disk cache, and re-use them when voxelizing the same solids"))
+        obj.addProperty("App::PropertyPath","VoxelCacheFolder","EM",QT_TRANSLATE_NOOP("App::Property","Folder of the on-disk voxelization cache (if empty, a folder in the user application data folder is used)"))
+        obj.addProperty("App::PropertyInteger","VoxelCacheSize","EM",QT_TRANSLATE_NOOP("App::Property","Maximum size of the on-disk voxelization cache (MB). The least recently used voxelizations are removed first"))
+        obj.addProperty("App::PropertyFileIncluded","VoxelSpaceFile","EM",QT_TRANSLATE_NOOP("App::Property","Binary file containing the voxel space, stored in the FreeCAD document (hidden)"),4)
+        obj.addProperty("App::PropertyEnumeration","VoxelSpaceBackend","EM",QT_TRANSLATE_NOOP("App::Property","Storage of the voxel space: 'Dense' array, 'Sparse' tiles for large, mostly empty voxel spaces, 'Octree' tiles also storing the uniform blocks (e.g. conductor interiors) as single values, or 'Memmap' array mapped on a scratch file, for voxel spaces larger than the memory"))
+        obj.addProperty("App::PropertyBool","DumpProfile","EM",QT_TRANSLATE_NOOP("App::Property","Write the durations and counters of the voxelization and export stages as a JSON file next to the VoxHenry input file"))
         obj.Proxy = self
         obj.delta = EMVHSOLVER_DEF_DELTA
         obj.units = EMVHSOLVER_UNITS
         obj.voxelSpaceValid = False
         obj.condIndexGenerator = 0
+        obj.Workers = EMVHSOLVER_DEF_WORKERS
+        obj.VoxelSpaceBackend = EMVHSOLVER_VOXELSPACE_BACKENDS
+        obj.VoxelCache = EMVHSOLVER_DEF_VOXELCACHE
+        obj.VoxelCacheFolder = ""
+        obj.VoxelCacheSize = EMVHSOLVER_DEF_VOXELCACHE_SIZE
+        obj.VoxelSpaceBackend = EMVHSOLVER_DEF_VOXELSPACE_BACKEND
+        obj.DumpProfile = EMVHSOLVER_DEF_DUMPPROFILE
         obj.freq = []
         obj.fmin = (EMVHSOLVER_DEFFMIN, EMVHSOLVER_DEF_MINFREQ, 1e+20, EMVHSOLVER_DEF_MINFREQ)
         obj.fmax = (EMVHSOLVER_DEFFMAX, EMVHSOLVER_DEF_MINFREQ, 1e+20, EMVHSOLVER_DEF_MINFREQ)
         obj.fmin = EMVHSOLVER_DEFFMIN
         self.bbox = FreeCAD.BoundBox()
-        self.voxelSpace = np.full((0,0,0), 0, np.int16)
+        self.voxelSpace = np.full((0,0,0), 0, np.uint8)
+        # bounding box on which the current 'voxelSpace' grid is built
+        self.voxelSpaceBBox = FreeCAD.BoundBox()
+        # per-VHConductor voxelization info (geometry hash, CondIndex and owned voxel sub-box), by object Name
+        self.condVoxelInfo = {}
+        # generation of the voxel space content, and generation stored in the 'VoxelSpaceFile'
+        # (see flagVoxelSpaceChanged() and updateVoxelSpaceFile())
+        self.voxelSpaceGeneration = 0
+        self.voxelSpaceFileGeneration = -1
         self.oldDelta = obj.delta
         self.Type = "VHSolver"
         # save the object in the class, to store or retrieve specific data from it
@@ -174,6 +923,8 @@ class _VHSolver:
     '''
         if self.bbox.isValid():
             obj.Shape = Part.makeBox(self.bbox.XLength,self.bbox.YLength,self.bbox.ZLength,Vector(self.bbox.XMin,self.bbox.YMin,self.bbox.ZMin))
+        # store the changed voxels in the document
+        self.updateVoxelSpaceFile()
 
     def onChanged(self, obj, prop):
         ''' take action if an object property 'prop' changed
@@ -190,8 +941,19 @@ class _VHSolver:
                 if obj.delta != self.oldDelta:
                     self.oldDelta = obj.delta
                     # if changing 'Delta', must flag the voxel space as invalid
+                    # (and the existing voxels cannot be re-embedded in the new grid)
                     obj.voxelSpaceValid = False
+                    self.voxelSpace = np.full((0,0,0), 0, np.uint8)
+                    self.condVoxelInfo = {}
+                    self.flagVoxelSpaceChanged()
                     self.flagVoxelizationInvalidAll()
+                    self.removeScratchFiles()
+        if prop == "VoxelSpaceBackend":
+            # at creation 'voxelSpace' does not yet exist (created after 'VoxelSpaceBackend');
+            # otherwise convert the existing voxel space, so there is no need to voxelize again
+            if hasattr(self,"voxelSpace"):
+                self.voxelSpace = self.convertVoxelSpace(self.voxelSpace, obj.VoxelSpaceBackend)
+                self.removeScratchFiles()
         if prop == "VoxelSpaceX" or prop == "VoxelSpaceY" or prop == "VoxelSpaceZ" or prop == "VoxelSpaceDim":
             # if just changed read-only properties, clear the recompute flag (not needed)
             obj.purgeTouched()
@@ -213,6 +975,10 @@ class _VHSolver:
     def computeContainingBBox(self):
         ''' Get the bounding box containing all the VHConductors in the document
 
+            If a voxel space already exists, the bounding box origin is aligned to the
+            existing voxel grid, so the voxel space can be re-embedded in the new bounding box
+            without re-voxelizing the VHConductors (see reembedVoxelSpace())
+
             Returns the global bounding box.
             If there are no VHConductors, or if the VHConductors Base objects have no Shape,
             the returned BoundBox is invalid (.isValid() on the returned BoundBox gives False)
@@ -231,25 +997,71 @@ class _VHSolver:
         # if the the old bbox or the newly computed bbox is invalid, flag the voxel space as invalid
         if (not gbbox.isValid()) or (not self.bbox.isValid()):
             self.Object.voxelSpaceValid = False
-        else:
+        elif (self.voxelSpace.size == 0) or (not self.voxelSpaceBBox.isValid()):
+            # no voxel grid to align to
+            if not self.isSameGrid(gbbox, self.bbox):
+                self.Object.voxelSpaceValid = False
+        elif self.justLoaded and self.voxelSpaceBBox.isInside(gbbox):
             # if we just re-loaded the model, do not flag the bbox as invalid.
             # the problem is that the Shape.BoundBox of the base objects of the VHConductors
             # can be different if the object actually has a visible shape or not.
             # At load time, if the object is invisible, its boundbox may be different.
             # However, if we knew it was valid at save time, no reason to invalidate it
-            if not self.justLoaded:
-                if (not gbbox.isInside(self.bbox)) and (not self.bbox.isInside(gbbox)):
-                    self.Object.voxelSpaceValid = False
-            else:
-                self.justLoaded = False
+            gbbox = FreeCAD.BoundBox(self.voxelSpaceBBox)
+        else:
+            # align to the existing voxel grid; if the grid changes, the voxel space
+            # will be re-embedded at the next getVoxelSpace()
+            gbbox = self.alignBBox(gbbox, self.voxelSpaceBBox, self.Object.delta)
+            if not self.isSameGrid(gbbox, self.voxelSpaceBBox):
+                self.Object.voxelSpaceValid = False
+        self.justLoaded = False
         self.bbox = gbbox
         return gbbox
 
-    def createVoxelSpace(self, bbox=None, delta=None):
+    def alignBBox(self, bbox, gridBBox, delta):
+        ''' Aligns the bounding box origin to the voxel grid built on 'gridBBox'
+
+            'bbox' is the FreeCAD.BoundBox to align
+            'gridBBox' is the FreeCAD.BoundBox whose minimum point is the voxel grid origin
+            'delta' is the voxels size length
+
+            Returns a FreeCAD.BoundBox containing 'bbox', whose minimum point is
+            on the voxel grid (apart from floating point rounding)
+    '''
+        bboxMin = np.array((bbox.XMin, bbox.YMin, bbox.ZMin))
+        gridMin = np.array((gridBBox.XMin, gridBBox.YMin, gridBBox.ZMin))
+        steps = np.floor((bboxMin - gridMin) / delta)
+        # never exceed 'bbox' because of rounding, the VHConductors must be inside the aligned bbox
+        alignedMin = np.minimum(gridMin + steps * delta, bboxMin)
+        return FreeCAD.BoundBox(alignedMin[0], alignedMin[1], alignedMin[2], bbox.XMax, bbox.YMax, bbox.ZMax)
+
+    def isSameGrid(self, bbox1, bbox2):
+        ''' Checks if two bounding boxes define the same voxel grid, i.e. the same origin
+            and the same number of voxels along each axis
+
+            'bbox1', 'bbox2' are the FreeCAD.BoundBox objects to compare
+
+            Returns True if the voxel grids are the same
+    '''
+        if (not bbox1.isValid()) or (not bbox2.isValid()):
+            return False
+        delta = self.Object.delta
+        tol = delta * EMVHSOLVER_GRID_TOL
+        for min1, min2 in ((bbox1.XMin, bbox2.XMin), (bbox1.YMin, bbox2.YMin), (bbox1.ZMin, bbox2.ZMin)):
+            if abs(min1 - min2) > tol:
+                return False
+        for len1, len2 in ((bbox1.XLength, bbox2.XLength), (bbox1.YLength, bbox2.YLength), (bbox1.ZLength, bbox2.ZLength)):
+            if int(len1/delta + 1.0) != int(len2/delta + 1.0):
+                return False
+        return True
+
+    def createVoxelSpace(self, bbox=None, delta=None, dtype=None):
         ''' Creates the voxel tensor (3D array) in the given bounding box
 
             'bbox' is the overall FreeCAD.BoundBox bounding box
             'delta' is the voxels size length
+            'dtype' is the Numpy type of the voxels. If None, the narrowest type
+                containing all the conductor indexes is used (see getVoxelSpaceDtype())
 
             Returns a voxel tensor as a Numpy 3D array.
             If gbbox is None, returns None
@@ -271,10 +1083,241 @@ class _VHSolver:
         self.Object.VoxelSpaceY = stepsY
         self.Object.VoxelSpaceZ = stepsZ
         self.Object.VoxelSpaceDim = stepsX*stepsY*stepsZ
-        # create the 3D array of nodes as 16-bit integers (max 65k different conductivities)
-        voxelSpace=np.full((stepsX+1,stepsY+1,stepsZ+1), 0, np.int16)
+        # create the 3D array of nodes as unsigned integers, of the narrowest type
+        # that can contain all the conductor indexes
+        if dtype is None:
+            dtype = self.getVoxelSpaceDtype(self.getMaxCondIndex())
+        if self.getVoxelSpaceBackend() == "Sparse":
+            voxelSpace = SparseVoxelSpace((stepsX+1,stepsY+1,stepsZ+1), dtype)
+        elif self.getVoxelSpaceBackend() == "Octree":
+            voxelSpace = OctreeVoxelSpace((stepsX+1,stepsY+1,stepsZ+1), dtype)
+        elif self.getVoxelSpaceBackend() == "Memmap":
+            voxelSpace = self.createMemmapVoxelSpace((stepsX+1,stepsY+1,stepsZ+1), dtype)
+        else:
+            voxelSpace=np.full((stepsX+1,stepsY+1,stepsZ+1), 0, dtype)
         return voxelSpace
 
+    def getScratchFolder(self):
+        ''' Retrieves the folder of the scratch files of the memory-mapped voxel space.
+            This is the transient folder of the document, removed by FreeCAD when the document is closed.
+            If the document has no transient folder, this is a private temporary folder of the VHSolver,
+            removed on exit; the shared temporary folder is never used, as the scratch files there
+            could belong to other FreeCAD sessions (see removeScratchFiles()).
+
+            Returns the folder path
+    '''
+        doc = self.Object.Document
+        if doc is not None and os.path.isdir(doc.TransientDir):
+            return doc.TransientDir
+        if not hasattr(self,"scratchFolder") or not os.path.isdir(self.scratchFolder):
+            self.scratchFolder = tempfile.mkdtemp(prefix="EM_VHSolver_")
+            atexit.register(shutil.rmtree, self.scratchFolder, True)
+        return self.scratchFolder
+
+    def removeScratchFiles(self):
+        ''' Removes the scratch files of this VHSolver, apart from the file mapped by the current voxel space
+    '''
+        keep = None
+        if hasattr(self,"voxelSpace") and isinstance(self.voxelSpace, np.memmap):
+            keep = os.path.abspath(self.voxelSpace.filename)
+        folder = self.getScratchFolder()
+        for filename in os.listdir(folder):
+            if filename.startswith(self.Object.Name + "_") and filename.endswith(EMVHSOLVER_MEMMAP_SUFFIX):
+                filename = os.path.abspath(os.path.join(folder, filename))
+                if filename != keep:
+                    try:
+                        os.remove(filename)
+                    except OSError:
+                        # still mapped (on Windows), will be removed later
+                        pass
+
+    def createMemmapVoxelSpace(self, shape, dtype):
+        ''' Creates a voxel tensor mapped on a new scratch file (see getScratchFolder()).
+            The previous scratch files of this VHSolver are removed, apart from the one
+            mapped by the current voxel space.
+
+            'shape' is the (x,y,z) tuple of the voxel space dimensions
+            'dtype' is the Numpy type of the voxels
+
+            Returns the voxel tensor as a Numpy memmap, filled with zeros
+            (or as a Numpy array, if the voxel space is empty)
+    '''
+        shape = tuple(int(dim) for dim in shape)
+        if 0 in shape:
+            return np.full(shape, 0, dtype)
+        self.removeScratchFiles()
+        fileHandle, filename = tempfile.mkstemp(dir=self.getScratchFolder(), prefix=self.Object.Name + "_", suffix=EMVHSOLVER_MEMMAP_SUFFIX)
+        os.close(fileHandle)
+        return np.memmap(filename, dtype=dtype, mode='w+', shape=shape)
+
+    def isOwnScratchFile(self, filename, modified=None):
+        ''' Checks if a scratch file belongs to this VHSolver in this document, i.e. it is in the
+            transient folder of the document, and its name starts with the VHSolver Name.
+            A copy of the VHSolver (e.g. pasted, or in another document, or in the same document
+            opened twice) has a different Name or transient folder, so it never writes in the scratch file
+            of the original.
+
+            'filename' is the scratch file path
+            'modified' (optional) is the modification time of the scratch file when the voxel space
+                was stored. If the file was modified afterwards, it does not belong to this voxel space.
+
+            Returns True if the scratch file can be mapped as the voxel space of this VHSolver
+    '''
+        doc = self.Object.Document
+        if filename is None or doc is None or not os.path.isdir(doc.TransientDir):
+            return False
+        filename = os.path.abspath(filename)
+        if os.path.normcase(os.path.dirname(filename)) != os.path.normcase(os.path.abspath(doc.TransientDir)):
+            return False
+        if not os.path.basename(filename).startswith(self.Object.Name + "_") or not filename.endswith(EMVHSOLVER_MEMMAP_SUFFIX):
+            return False
+        if modified is not None and os.path.isfile(filename) and os.path.getmtime(filename) > modified:
+            return False
+        return True
+
+    def openMemmapVoxelSpace(self, filename, shape, dtype):
+        ''' Maps an existing scratch file as voxel tensor. The file is not read,
+            the voxels are loaded by the operating system only when accessed.
+            The caller must make sure the file belongs to this VHSolver (see isOwnScratchFile()).
+
+            'filename' is the scratch file path
+            'shape' is the (x,y,z) tuple of the voxel space dimensions
+            'dtype' is the Numpy type of the voxels
+
+            Returns the voxel tensor as a Numpy memmap, or None if the file does not exist
+            or does not match 'shape' and 'dtype'
+    '''
+        shape = tuple(int(dim) for dim in shape)
+        if filename is None or 0 in shape or not os.path.isfile(filename):
+            return None
+        if os.path.getsize(filename) != int(np.prod(shape)) * np.dtype(dtype).itemsize:
+            return None
+        return np.memmap(filename, dtype=dtype, mode='r+', shape=shape)
+
+    def copyToMemmap(self, voxelSpace, function=None, dtype=None):
+        ''' Copies a voxel space to a new memory-mapped voxel space, in slabs along x
+
+            'voxelSpace' is the voxel tensor (of any backend)
+            'function' (optional) maps an array of voxel values to an array of the same shape
+                and of type 'dtype'. The empty voxels (zero) must be mapped to zero
+            'dtype' is the Numpy type of the new voxel space. If None, the type is not changed
+
+            Returns the new memory-mapped voxel tensor
+    '''
+        if dtype is None:
+            dtype = voxelSpace.dtype
+        shape = voxelSpace.shape
+        newVoxelSpace = self.createMemmapVoxelSpace(shape, dtype)
+        slab = max(1, EMVHSOLVER_MEMMAP_SLAB // max(1, shape[1] * shape[2]))
+        for slabX in range(0, shape[0], slab):
+            values = voxelSpace[slabX:slabX+slab, :, :]
+            if function is not None:
+                values = function(values)
+            newVoxelSpace[slabX:slabX+slab, :, :] = values
+        return newVoxelSpace
+
+    def getVoxelSpaceDtype(self, maxIndex):
+        ''' Selects the voxel space type
+
+            'maxIndex' is the maximum conductor index that the voxel space must contain
+
+            Returns the narrowest Numpy type of EMVHSOLVER_VOXELSPACE_DTYPES that can contain 'maxIndex'
+    '''
+        for dtype in EMVHSOLVER_VOXELSPACE_DTYPES:
+            if maxIndex <= np.iinfo(dtype).max:
+                return np.dtype(dtype)
+        return np.dtype(EMVHSOLVER_VOXELSPACE_DTYPES[-1])
+
+    def getMaxCondIndex(self):
+        ''' Retrieves the maximum conductor index of the VHConductors in the document,
+            and of the VHConductor voxelization records
+
+            Returns the maximum index, or zero if there are no VHConductors
+    '''
+        indexes = [info['index'] for info in self.condVoxelInfo.values()]
+        doc = self.Object.Document
+        if doc is not None:
+            indexes = indexes + [cond.CondIndex for cond in doc.Objects if Draft.getType(cond) == "VHConductor"]
+        return max(indexes + [0])
+
+    def getVoxelSpaceMax(self):
+        ''' Returns the maximum value contained in the voxel space (zero if empty)
+    '''
+        if self.voxelSpace.size == 0:
+            return 0
+        return int(self.voxelSpace.max())
+
+    def mapVoxelSpace(self, function, dtype):
+        ''' Transforms the values of the voxel space, whatever the storage backend
+
+            'function' maps an array of voxel values to an array of the same shape and of type 'dtype'.
+                The empty voxels (zero) must be mapped to zero
+            'dtype' is the Numpy type of the new voxel space
+    '''
+        if isinstance(self.voxelSpace, SparseVoxelSpace):
+            self.voxelSpace = self.voxelSpace.mapValues(function, dtype)
+        elif isinstance(self.voxelSpace, np.memmap):
+            self.voxelSpace = self.copyToMemmap(self.voxelSpace, function, dtype)
+            self.removeScratchFiles()
+        else:
+            self.voxelSpace = function(self.voxelSpace).astype(dtype, copy=False)
+
+    def fitVoxelSpaceDtype(self, maxIndex=None):
+        ''' Converts the voxel space to the narrowest type that can contain the conductor indexes
+            (see getVoxelSpaceDtype()). The type is widened if needed, and narrowed only if all
+            the values already in the voxel space fit in the narrower type.
+
+            'maxIndex' is the maximum conductor index that the voxel space must contain.
+                If None, it is the maximum index of the VHConductors (see getMaxCondIndex())
+    '''
+        if maxIndex is None:
+            maxIndex = self.getMaxCondIndex()
+        dtype = self.getVoxelSpaceDtype(maxIndex)
+        if dtype == self.voxelSpace.dtype:
+            return
+        if dtype.itemsize < np.dtype(self.voxelSpace.dtype).itemsize:
+            dtype = self.getVoxelSpaceDtype(max(maxIndex, self.getVoxelSpaceMax()))
+            if dtype == self.voxelSpace.dtype:
+                return
+        self.mapVoxelSpace(lambda values: values.astype(dtype), dtype)
+
+    def getVoxelSpaceBackend(self):
+        ''' Retrieves the voxel space storage backend
+
+            Returns one of EMVHSOLVER_VOXELSPACE_BACKENDS
+    '''
+        if hasattr(self.Object,"VoxelSpaceBackend"):
+            return self.Object.VoxelSpaceBackend
+        return EMVHSOLVER_DEF_VOXELSPACE_BACKEND
+
+    def convertVoxelSpace(self, voxelSpace, backend):
+        ''' Converts a voxel space to the given storage backend
+
+            'voxelSpace' is the voxel tensor, either a Numpy 3D array (possibly a memmap), a SparseVoxelSpace
+                or an OctreeVoxelSpace
+            'backend' is one of EMVHSOLVER_VOXELSPACE_BACKENDS
+
+            Returns the converted voxel tensor (or 'voxelSpace' itself, if already using 'backend')
+    '''
+        if backend == "Sparse":
+            if type(voxelSpace) is SparseVoxelSpace:
+                return voxelSpace
+            return SparseVoxelSpace.fromArray(voxelSpace, EMVHSOLVER_SPARSE_TILE)
+        elif backend == "Octree":
+            if type(voxelSpace) is OctreeVoxelSpace:
+                return voxelSpace
+            return OctreeVoxelSpace.fromArray(voxelSpace, EMVHSOLVER_OCTREE_TILE)
+        elif backend == "Memmap":
+            if isinstance(voxelSpace, np.memmap) or voxelSpace.size == 0:
+                return voxelSpace
+            return self.copyToMemmap(voxelSpace)
+        else:
+            if isinstance(voxelSpace, SparseVoxelSpace):
+                return voxelSpace.toArray()
+            if isinstance(voxelSpace, np.memmap):
+                return np.array(voxelSpace)
+            return voxelSpace
+
     def getVoxelSpace(self,force=False):
         ''' Retrieves the voxel space. If not computed yet, or invalid, forces computation.
 
@@ -291,12 +1334,23 @@ class _VHSolver:
         self.computeContainingBBox()
         # if the bounding box is invalid, no voxel space, no matter what
         if not self.bbox.isValid():
-            self.voxelSpace = np.full((0,0,0), 0, np.int16)
+            self.voxelSpace = np.full((0,0,0), 0, np.uint8)
+            self.voxelSpaceBBox = FreeCAD.BoundBox()
+        # else if only the bounding box changed, re-embed the existing voxels in the new voxel space
+        elif (self.voxelSpace.size > 0) and self.voxelSpaceBBox.isValid() and (not self.Object.voxelSpaceValid) and (not force):
+            self.reembedVoxelSpace()
+            self.voxelSpaceBBox = FreeCAD.BoundBox(self.bbox)
+            self.Object.voxelSpaceValid = True
+            self.flagVoxelSpaceChanged()
         # else if voxel space invalid, or forcing recalculation, let's compute it
         elif (self.voxelSpace.size == 0) or (not self.Object.voxelSpaceValid) or force:
-            # create voxel space
+            # create voxel space (releasing the scratch file of the old voxel space, if memory-mapped)
             self.voxelSpace = self.createVoxelSpace(self.bbox, self.Object.delta)
+            self.removeScratchFiles()
+            self.voxelSpaceBBox = FreeCAD.BoundBox(self.bbox)
+            self.condVoxelInfo = {}
             self.Object.voxelSpaceValid = True
+            self.flagVoxelSpaceChanged()
             # now flag all VHConductor and VHPort voxelizations as invalid
             # get all the VHConductors
             conds = [obj for obj in doc.Objects if Draft.getType(obj) == "VHConductor"]
@@ -309,6 +1363,366 @@ class _VHSolver:
         # return the voxel space (may also be None)
         return self.voxelSpace
 
+    def getVoxelSpaceStats(self):
+        ''' Computes the memory statistics of the voxel space
+
+            Returns a dict with the 'backend', the voxel space 'shape', the number of 'voxels',
+            the bytes of the equivalent dense array ('denseBytes') and the bytes actually used
+            to store the voxels ('storedBytes'). For the 'Octree' backend, also contains
+            the octree statistics (see OctreeVoxelSpace.getStats())
+    '''
+        voxelSpace = self.voxelSpace
+        stats = {'backend': self.getVoxelSpaceBackend(),
+                 'shape': [int(dim) for dim in voxelSpace.shape],
+                 'voxels': int(voxelSpace.size),
+                 'denseBytes': int(voxelSpace.size) * np.dtype(voxelSpace.dtype).itemsize}
+        if isinstance(voxelSpace, OctreeVoxelSpace):
+            stats.update(voxelSpace.getStats())
+        else:
+            stats['storedBytes'] = int(voxelSpace.nbytes)
+        if isinstance(voxelSpace, np.memmap):
+            # the voxels are stored in the scratch file, and loaded in memory only when accessed
+            stats['scratchFile'] = voxelSpace.filename
+        return stats
+
+    def reembedVoxelSpace(self):
+        ''' Re-embeds the existing voxel space, built on 'voxelSpaceBBox', in a new voxel space
+            built on the current (grid-aligned) 'bbox', keeping the voxelization of the VHConductors.
+
+            Only the VHConductors whose geometry changed (see getGeometryHash() of the VHConductor)
+            or that do not fit any more in the voxel space, and the VHConductors overlapping them,
+            are flagged as not voxelized and removed from the voxel space.
+            VHPort voxel contacts are shifted as well, but are flagged as not voxelized
+            if any VHConductor changed.
+    '''
+        X, Y, Z = 0, 1, 2
+        delta = self.Object.delta
+        oldVoxelSpace = self.voxelSpace
+        oldMin = np.array((self.voxelSpaceBBox.XMin, self.voxelSpaceBBox.YMin, self.voxelSpaceBBox.ZMin))
+        newMin = np.array((self.bbox.XMin, self.bbox.YMin, self.bbox.ZMin))
+        # offset to add to the old voxel indexes to get the new voxel indexes
+        # ('bbox' is aligned on the old grid, so this is integer, apart from rounding)
+        offset = np.rint((oldMin - newMin) / delta).astype(int)
+        self.voxelSpace = self.createVoxelSpace(self.bbox, delta, oldVoxelSpace.dtype)
+        newShape = np.array(self.voxelSpace.shape)
+        if isinstance(oldVoxelSpace, SparseVoxelSpace):
+            # move only the non-empty voxels
+            coords = oldVoxelSpace.nonzero()
+            values = oldVoxelSpace[coords]
+            newCoords = np.array(coords) + offset.reshape(3,1)
+            fits = np.all((newCoords >= 0) & (newCoords < newShape.reshape(3,1)), axis=0)
+            self.voxelSpace[tuple(newCoords[:,fits])] = values[fits]
+        else:
+            # copy the overlapping part of the old voxel space
+            oldStart = np.maximum(0, -offset)
+            oldStop = np.minimum(np.array(oldVoxelSpace.shape), newShape - offset)
+            if np.all(oldStart < oldStop):
+                self.voxelSpace[oldStart[X]+offset[X]:oldStop[X]+offset[X],
+                                oldStart[Y]+offset[Y]:oldStop[Y]+offset[Y],
+                                oldStart[Z]+offset[Z]:oldStop[Z]+offset[Z]] = oldVoxelSpace[oldStart[X]:oldStop[X],
+                                                                                             oldStart[Y]:oldStop[Y],
+                                                                                             oldStart[Z]:oldStop[Z]]
+        # release the scratch file of the old voxel space, if memory-mapped
+        oldVoxelSpace = None
+        self.removeScratchFiles()
+        FreeCAD.Console.PrintMessage(translate("EM","Global bounding box changed, voxel space re-embedded with voxel offset ") + str(tuple(offset.tolist())) + "\n")
+        # shift the voxel sub-boxes owned by the VHConductors
+        for info in self.condVoxelInfo.values():
+            info['box'] = [index + int(offset[axis % 3]) for axis, index in enumerate(info['box'])]
+        # get all VHConductors and VHPorts
+        doc = self.Object.Document
+        conds = [obj for obj in doc.Objects if Draft.getType(obj) == "VHConductor"]
+        ports = [obj for obj in doc.Objects if Draft.getType(obj) == "VHPort"]
+        # remove the voxels of the VHConductors that do not exist any more
+        condNames = [cond.Name for cond in conds]
+        for name in [name for name in self.condVoxelInfo if not name in condNames]:
+            self.clearVoxels(self.condVoxelInfo.pop(name))
+        # find which VHConductors changed, and must be voxelized again
+        changed = set()
+        for cond in conds:
+            info = self.condVoxelInfo.get(cond.Name)
+            if info is None and (not cond.isVoxelized):
+                # not in the voxel space
+                continue
+            elif info is None or (not cond.isVoxelized):
+                changed.add(cond.Name)
+            elif min(info['box'][0:3]) < 0 or np.any(np.array(info['box'][3:6]) >= newShape):
+                changed.add(cond.Name)
+            elif self.isConductorChanged(cond):
+                changed.add(cond.Name)
+        changed = self.getOverlappingConductors(conds, changed)
+        for cond in conds:
+            if cond.Name in changed:
+                self.clearConductorVoxels(cond)
+                cond.Proxy.flagVoxelizationInvalid()
+        for port in ports:
+            if len(changed) > 0:
+                port.Proxy.flagVoxelizationInvalid()
+            elif np.any(offset != 0):
+                port.Proxy.shiftVoxelization(offset, newShape)
+
+    def isConductorChanged(self, cond):
+        ''' Checks if the geometry of a VHConductor changed since it was voxelized
+
+            'cond' is the VHConductor object
+
+            Returns True if the VHConductor changed, or if there is no record of its voxelization
+    '''
+        info = self.condVoxelInfo.get(cond.Name)
+        if info is None:
+            return True
+        return cond.Proxy.getGeometryHash() != info['hash']
+
+    def getConductorVoxelBoxes(self, cond):
+        ''' Retrieves the voxel sub-boxes that a VHConductor occupies, or occupied
+            when it was voxelized
+
+            'cond' is the VHConductor object
+
+            Returns a list of [min_x, min_y, min_z, max_x, max_y, max_z] voxel index boxes
+    '''
+        boxes = []
+        info = self.condVoxelInfo.get(cond.Name)
+        if info is not None:
+            boxes.append(info['box'])
+        bbox = cond.Proxy.getBBox()
+        if bbox.isValid() and self.bbox.isValid():
+            delta = self.Object.delta
+            gbboxMin = np.array((self.bbox.XMin, self.bbox.YMin, self.bbox.ZMin))
+            boxMin = np.floor((np.array((bbox.XMin, bbox.YMin, bbox.ZMin)) - gbboxMin)/delta).astype(int)
+            boxMax = np.floor((np.array((bbox.XMax, bbox.YMax, bbox.ZMax)) - gbboxMin)/delta).astype(int)
+            boxes.append(boxMin.tolist() + boxMax.tolist())
+        return boxes
+
+    def getOverlappingConductors(self, conds, names):
+        ''' Extends a set of VHConductors with all the VHConductors overlapping them.
+
+            If a VHConductor is voxelized again, it may overwrite, or leave holes in, the voxels
+            of the other VHConductors it overlaps (when VHConductors overlap, the voxels belong
+            to the last voxelized one), so the overlapping VHConductors must be voxelized again as well.
+
+            'conds' is the list of all the VHConductor objects
+            'names' is the set of the Names of the VHConductors to extend
+
+            Returns the extended set of VHConductor Names
+    '''
+        boxes = {cond.Name: self.getConductorVoxelBoxes(cond) for cond in conds}
+        names = set(names)
+        pending = list(names)
+        while len(pending) > 0:
+            name = pending.pop()
+            for cond in conds:
+                if cond.Name in names:
+                    continue
+                for box1 in boxes.get(name, []):
+                    if any(all(box1[axis] <= box2[axis+3] and box2[axis] <= box1[axis+3] for axis in range(3)) for box2 in boxes[cond.Name]):
+                        names.add(cond.Name)
+                        pending.append(cond.Name)
+                        break
+        return names
+
+    def registerConductorVoxelization(self, cond, geometryHash, boxMin, boxMax):
+        ''' Records the voxelization of a VHConductor, for the incremental re-voxelization
+
+            'cond' is the VHConductor object
+            'geometryHash' is the hash of the VHConductor geometry at voxelization time
+            'boxMin', 'boxMax' are the (x,y,z) voxel indexes of the voxel sub-box owned by the VHConductor
+    '''
+        self.condVoxelInfo[cond.Name] = {'hash': geometryHash,
+                                         'index': int(cond.CondIndex),
+                                         'box': [int(index) for index in boxMin] + [int(index) for index in boxMax]}
+        self.flagVoxelSpaceChanged()
+
+    def clearConductorVoxels(self, cond):
+        ''' Removes all the voxels of a VHConductor from the voxel space
+
+            'cond' is the VHConductor object
+    '''
+        info = self.condVoxelInfo.pop(cond.Name, None)
+        if info is None:
+            # no record of the owned sub-box, must scan the whole voxel space
+            self.voxelSpace[self.voxelSpace == cond.CondIndex] = 0
+        else:
+            self.clearVoxels(info)
+        self.flagVoxelSpaceChanged()
+
+    def clearVoxels(self, info):
+        ''' Removes the voxels of the 'info' voxelization record (see registerConductorVoxelization())
+            from the voxel space
+    '''
+        boxMin = np.maximum(np.array(info['box'][0:3]), 0)
+        boxMax = np.minimum(np.array(info['box'][3:6]), np.array(self.voxelSpace.shape) - 1)
+        if np.any(boxMin > boxMax):
+            return
+        subSpaceSlices = tuple(slice(boxMin[axis], boxMax[axis]+1) for axis in range(3))
+        voxelSubSpace = self.voxelSpace[subSpaceSlices]
+        voxelSubSpace[voxelSubSpace == info['index']] = 0
+        self.voxelSpace[subSpaceSlices] = voxelSubSpace
+
+    def writeVoxelSpaceFile(self, filename):
+        ''' Writes the voxel space to a compressed binary file
+
+            'filename' is the full path of the file
+
+            For each conductor index found in the voxel space, the file contains the voxel sub-box
+            enclosing all the voxels with that index, and the bit-packed mask of these voxels
+            in the sub-box. The file is a compressed Numpy archive.
+    '''
+        voxelSpace = self.voxelSpace
+        condIndexes = []
+        boxes = []
+        bits = []
+        if isinstance(voxelSpace, SparseVoxelSpace):
+            coords = np.array(voxelSpace.nonzero())
+            values = voxelSpace[tuple(coords)]
+            for condIndex in np.unique(values):
+                condCoords = coords[:, values == condIndex]
+                boxMin = condCoords.min(axis=1)
+                boxMax = condCoords.max(axis=1)
+                mask = np.zeros(boxMax - boxMin + 1, dtype=bool)
+                mask[tuple(condCoords - boxMin.reshape(3,1))] = True
+                condIndexes.append(condIndex)
+                boxes.append(boxMin.tolist() + boxMax.tolist())
+                bits.append(np.packbits(mask))
+        elif voxelSpace.size > 0:
+            # find the sub-box of each conductor index with a single scan of the voxel space
+            for index, slices in enumerate(ndimage.find_objects(voxelSpace)):
+                if slices is None:
+                    continue
+                condIndex = index + 1
+                mask = voxelSpace[slices] == condIndex
+                condIndexes.append(condIndex)
+                boxes.append([sl.start for sl in slices] + [sl.stop - 1 for sl in slices])
+                bits.append(np.packbits(mask))
+        bitsOffsets = np.cumsum([0] + [len(condBits) for condBits in bits])
+        with open(filename, 'wb') as fid:
+            np.savez_compressed(fid,
+                                version=np.array([EMVHSOLVER_VOXELSPACE_FILE_VERSION]),
+                                shape=np.array(voxelSpace.shape),
+                                condIndexes=np.array(condIndexes, dtype=np.int64),
+                                boxes=np.array(boxes, dtype=np.int64).reshape(-1,6),
+                                bitsOffsets=bitsOffsets,
+                                bits=np.concatenate(bits) if len(bits) > 0 else np.zeros(0, dtype=np.uint8))
+
+    def readVoxelSpaceFile(self, filename):
+        ''' Reads the voxel space from a compressed binary file written by writeVoxelSpaceFile()
+
+            'filename' is the full path of the file
+
+            The voxels are written in the current 'voxelSpace', that must have the same shape
+    '''
+        with np.load(filename) as data:
+            if int(data['version'][0]) > EMVHSOLVER_VOXELSPACE_FILE_VERSION:
+                raise ValueError("unsupported voxel space file version " + str(int(data['version'][0])))
+            if tuple(data['shape'].tolist()) != tuple(self.voxelSpace.shape):
+                raise ValueError("voxel space file shape " + str(tuple(data['shape'].tolist())) + " does not match the voxel space shape " + str(tuple(self.voxelSpace.shape)))
+            bits = data['bits']
+            bitsOffsets = data['bitsOffsets']
+            # widen the voxel space type, if needed to contain the stored indexes
+            self.fitVoxelSpaceDtype(max([int(condIndex) for condIndex in data['condIndexes']] + [0]))
+            for condIndex, box, bitsStart, bitsStop in zip(data['condIndexes'], data['boxes'], bitsOffsets[:-1], bitsOffsets[1:]):
+                size = box[3:6] - box[0:3] + 1
+                mask = np.unpackbits(bits[bitsStart:bitsStop], count=int(np.prod(size))).reshape(size).astype(bool)
+                subSpaceSlices = tuple(slice(box[axis], box[axis+3]+1) for axis in range(3))
+                voxelSubSpace = self.voxelSpace[subSpaceSlices]
+                voxelSubSpace[mask] = condIndex
+                self.voxelSpace[subSpaceSlices] = voxelSubSpace
+
+    def flagVoxelSpaceChanged(self):
+        ''' Flags the voxel space content as changed, so the 'VoxelSpaceFile' is written again
+            on the next recompute (see updateVoxelSpaceFile())
+    '''
+        self.voxelSpaceGeneration = self.voxelSpaceGeneration + 1
+        self.Object.touch()
+
+    def isVoxelSpaceFileValid(self):
+        ''' Checks if the 'VoxelSpaceFile' contains the current voxel space
+
+            Returns True if the file is up to date
+    '''
+        if not hasattr(self.Object,"VoxelSpaceFile"):
+            return False
+        if self.Object.VoxelSpaceFile == "" or not os.path.isfile(self.Object.VoxelSpaceFile):
+            return False
+        return self.voxelSpaceFileGeneration == self.voxelSpaceGeneration
+
+    def updateVoxelSpaceFile(self):
+        ''' Writes the voxel space to the 'VoxelSpaceFile' property, if changed since the last write,
+            so it is stored in the FreeCAD document as a binary file when saving.
+            If the file is not up to date when saving, the voxel space is stored in the JSON state.
+
+            Returns True if the 'VoxelSpaceFile' contains the current voxel space
+    '''
+        if not hasattr(self.Object,"VoxelSpaceFile"):
+            return False
+        if self.isVoxelSpaceFileValid():
+            return True
+        if self.voxelSpace.size == 0:
+            return False
+        fileHandle, tempFilename = tempfile.mkstemp(prefix="VoxelSpace", suffix=".npz")
+        os.close(fileHandle)
+        try:
+            self.writeVoxelSpaceFile(tempFilename)
+            # FreeCAD copies the file in the document transient folder
+            self.Object.VoxelSpaceFile = tempFilename
+        finally:
+            if os.path.isfile(tempFilename):
+                os.remove(tempFilename)
+        self.voxelSpaceFileGeneration = self.voxelSpaceGeneration
+        return True
+
+    def getVoxelCache(self):
+        ''' Retrieves the on-disk voxelization cache
+
+            Returns the VoxelCache object, or None if the cache is disabled
+    '''
+        if not hasattr(self.Object,"VoxelCache"):
+            return None
+        if not self.Object.VoxelCache:
+            return None
+        folder = self.Object.VoxelCacheFolder
+        if folder == "":
+            folder = os.path.join(FreeCAD.getUserAppDataDir(), EMVHSOLVER_VOXELCACHE_FOLDER)
+        maxSize = max(0, self.Object.VoxelCacheSize) * 1048576
+        # keep the same object (and counters) as long as the settings do not change
+        if hasattr(self,"voxelCache"):
+            if self.voxelCache.folder == folder:
+                self.voxelCache.maxSize = maxSize
+                return self.voxelCache
+        self.voxelCache = VoxelCache(folder, maxSize)
+        return self.voxelCache
+
+    def getProfiler(self):
+        ''' Retrieves the registry of the durations and counters of the voxelization and export stages.
+            The profile is not stored in the document, and each VHConductor or VHPort entry
+            is reset when the object is voxelized again.
+
+            Returns the VoxelProfiler object
+    '''
+        if not hasattr(self,"profiler"):
+            self.profiler = VoxelProfiler()
+        # the memory of the stages is traced only if the profile is written
+        self.profiler.setTracing(hasattr(self.Object,"DumpProfile") and self.Object.DumpProfile)
+        return self.profiler
+
+    def dumpProfile(self, filename):
+        ''' Writes the voxelization and export profile as a JSON file, if the 'DumpProfile' property is True
+
+            'filename' is the full path of the VoxHenry input file. The profile is written
+                in the same folder, replacing the extension with EMVHSOLVER_PROFILE_SUFFIX
+    '''
+        if not hasattr(self.Object,"DumpProfile"):
+            return
+        if not self.Object.DumpProfile:
+            return
+        profileFilename = os.path.splitext(filename)[0] + EMVHSOLVER_PROFILE_SUFFIX
+        try:
+            self.getProfiler().dump(profileFilename)
+        except (OSError, IOError) as e:
+            FreeCAD.Console.PrintWarning(translate("EM","Cannot write the voxelization profile file ") + "'" + profileFilename + "' (" + str(e) + ")\n")
+            return
+        FreeCAD.Console.PrintMessage(translate("EM","Voxelization profile written to ") + "'" + profileFilename + "'\n")
+
     def getGlobalBBox(self):
         ''' Retrieves the bounding box. If not calculated yet, forces calculation
 
@@ -348,18 +1762,75 @@ class _VHSolver:
     '''
         self.Object.voxelSpaceValid = False
 
+    def releaseDeletedConductors(self, conds):
+        ''' Removes from the voxel space the voxels of the VHConductors that do not exist any more,
+            so their conductor indexes can be re-used
+
+            'conds' is the list of the VHConductor objects in the document
+    '''
+        condNames = [cond.Name for cond in conds]
+        for name in [name for name in self.condVoxelInfo if not name in condNames]:
+            self.clearVoxels(self.condVoxelInfo.pop(name))
+            self.flagVoxelSpaceChanged()
+
     def getNextCondIndex(self):
         ''' Generates a unique conductor index for marking the different VHConductors in the voxel space.
+            The lowest index not used by any VHConductor in the document is recycled, and the voxel space
+            type is widened, if needed, to contain the index (see fitVoxelSpaceDtype()).
 
             Returns a unique integer.
     '''
-        self.Object.condIndexGenerator = self.Object.condIndexGenerator + 1
-        if self.Object.condIndexGenerator > EMVHSOLVER_COND_ID_OVERFLOW:
-            FreeCAD.Console.PrintWarning(translate("EM","Conductor index generator overflowed int16 capacity! Cannot reliably mark VHConductors any more in the voxel space"))
-        return self.Object.condIndexGenerator
+        conds = []
+        if self.Object.Document is not None:
+            conds = [obj for obj in self.Object.Document.Objects if Draft.getType(obj) == "VHConductor"]
+        self.releaseDeletedConductors(conds)
+        usedIndexes = set([cond.CondIndex for cond in conds])
+        condIndex = 1
+        while condIndex in usedIndexes:
+            condIndex = condIndex + 1
+        if condIndex > EMVHSOLVER_COND_ID_OVERFLOW:
+            FreeCAD.Console.PrintWarning(translate("EM","Conductor index generator overflowed the voxel space capacity! Cannot reliably mark VHConductors any more in the voxel space"))
+        self.Object.condIndexGenerator = condIndex
+        self.fitVoxelSpaceDtype(max(usedIndexes | set([condIndex])))
+        return condIndex
+
+    def compactCondIndexes(self):
+        ''' Renumbers the VHConductors with consecutive conductor indexes, starting from 1 in document order,
+            remapping the voxels already in the voxel space, and narrows the voxel space type if possible.
+            The voxels not belonging to any VHConductor in the document are removed.
+            Called by voxelizeAll() when the conductor indexes have gaps, e.g. after deleting VHConductors.
+    '''
+        doc = self.Object.Document
+        if doc is None:
+            FreeCAD.Console.PrintWarning(translate("EM","No active document available. Cannot compact the conductor indexes."))
+            return
+        conds = [obj for obj in doc.Objects if Draft.getType(obj) == "VHConductor"]
+        self.releaseDeletedConductors(conds)
+        dtype = self.getVoxelSpaceDtype(len(conds))
+        lookup = np.zeros(max([self.getVoxelSpaceMax()] + [cond.CondIndex for cond in conds]) + 1, dtype=dtype)
+        newIndexes = {}
+        for newIndex, cond in enumerate(conds, 1):
+            # if more VHConductors share the same index, they keep sharing it
+            if lookup[cond.CondIndex] == 0:
+                lookup[cond.CondIndex] = newIndex
+            newIndexes[cond.Name] = int(lookup[cond.CondIndex])
+        self.mapVoxelSpace(lambda values: lookup[values], dtype)
+        self.flagVoxelSpaceChanged()
+        for info in self.condVoxelInfo.values():
+            info['index'] = int(lookup[info['index']])
+        for cond in conds:
+            if cond.CondIndex != newIndexes[cond.Name]:
+                cond.CondIndex = newIndexes[cond.Name]
+        self.Object.condIndexGenerator = max([0] + list(newIndexes.values()))
 
-    def voxelizeAll(self):
+    def voxelizeAll(self,workers=None,changedOnly=False):
         ''' Voxelize all VHConductors and VHPorts in the voxelSpace of the VHSolver object
+
+            'workers' is the number of workers used to voxelize the VHConductors (see voxelizeConductors()).
+                If None, the 'Workers' property value is used.
+            'changedOnly' if True voxelizes only the VHConductors not voxelized, or whose geometry
+                changed since the voxelization (and the VHConductors overlapping them).
+                Otherwise all the VHConductors are voxelized again.
     '''
         # get the document containing this object
         doc = self.Object.Document
@@ -368,11 +1839,84 @@ class _VHSolver:
             return None
         # get all VHConductors and VHPorts
         conds = [obj for obj in doc.Objects if Draft.getType(obj) == "VHConductor"]
-        for cond in conds:
-            cond.Proxy.voxelizeConductor()
+        # after deleting VHConductors, the conductor indexes have gaps; renumber them, so the voxel space
+        # type is as narrow as possible (the voxels already there are remapped, and stay valid)
+        condIndexes = sorted(set([cond.CondIndex for cond in conds]))
+        if condIndexes != list(range(1, len(condIndexes) + 1)):
+            self.compactCondIndexes()
+        if changedOnly:
+            # update the voxel space first (this may re-embed it, flagging the changed VHConductors)
+            if self.getVoxelSpace() is None:
+                return None
+            changed = set([cond.Name for cond in conds if (not cond.isVoxelized) or self.isConductorChanged(cond)])
+            changed = self.getOverlappingConductors(conds, changed)
+            if len(changed) < len(conds):
+                FreeCAD.Console.PrintMessage(str(len(conds)-len(changed)) + translate("EM"," VHConductors are already voxelized and did not change, skipping them\n"))
+            conds = [cond for cond in conds if cond.Name in changed]
+        self.voxelizeConductors(conds,workers)
         ports = [obj for obj in doc.Objects if Draft.getType(obj) == "VHPort"]
         for port in ports:
             port.Proxy.voxelizePort()
+        if isinstance(self.voxelSpace, SparseVoxelSpace):
+            stats = self.getVoxelSpaceStats()
+            FreeCAD.Console.PrintMessage(translate("EM","Voxel space memory: ") + "{:.3g}".format(stats['storedBytes']/1048576.0) + translate("EM"," MB, instead of ") +
+                                         "{:.3g}".format(stats['denseBytes']/1048576.0) + translate("EM"," MB as a dense array\n"))
+
+    def voxelizeConductors(self,conds,workers=None):
+        ''' Voxelize a list of VHConductors in the voxelSpace of the VHSolver object
+
+            'conds' is the list of VHConductor objects
+            'workers' is the number of workers used to voxelize the VHConductors.
+                If None, the 'Workers' property value is used.
+
+            The voxelization of each VHConductor is prepared in the main thread (meshing),
+            then the pure Numpy part of the voxelization runs in a pool of 'workers' workers,
+            and finally the results are merged in the voxel space in the main thread.
+            Without GUI, the workers are forked processes, as large parts of the voxelization
+            (e.g. the region labelling and the many small array operations) hold the GIL.
+            Forking the FreeCAD GUI is not safe, so with GUI (or if forking is not available)
+            the workers are threads, which still run the large Numpy array operations in parallel
+            (see the 'workers' stages of benchmark_voxelization.py).
+            The workers return the voxel indexes (see EM.compact_voxelization()), so the results
+            waiting to be merged do not hold the arrays of the whole conductor boxes.
+            The results are always merged in the order of 'conds', so if VHConductors overlap,
+            the voxels belong to the last VHConductor in the list, exactly as when voxelizing
+            the VHConductors one after the other.
+    '''
+        if workers is None:
+            workers = self.Object.Workers if hasattr(self.Object,"Workers") else EMVHSOLVER_DEF_WORKERS
+        profiler = self.getProfiler()
+        jobs = [(cond, cond.Proxy.prepareVoxelization()) for cond in conds]
+        meshJobs = [job for cond, job in jobs if job is not None and not 'result' in job]
+        results = {}
+        if workers > 1 and len(meshJobs) > 1:
+            if not FreeCAD.GuiUp and "fork" in multiprocessing.get_all_start_methods():
+                FreeCAD.Console.PrintMessage(translate("EM","Voxelizing ") + str(len(meshJobs)) + translate("EM"," conductors with ") + str(workers) + translate("EM"," worker processes...\n"))
+                executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"))
+            else:
+                FreeCAD.Console.PrintMessage(translate("EM","Voxelizing ") + str(len(meshJobs)) + translate("EM"," conductors with ") + str(workers) + translate("EM"," worker threads...\n"))
+                executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+            with profiler.stage(self.Object.Name, "worker pool"), executor:
+                futures = [(job['name'], executor.submit(EM.voxelize_mesh_compact, job)) for job in meshJobs]
+                for name, future in futures:
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        FreeCAD.Console.PrintWarning(translate("EM","Voxelization worker failed for ") + name + " (" + str(e) + "), " + translate("EM","voxelizing in the main thread\n"))
+        # merge the results in the voxel space, in order
+        for cond, job in jobs:
+            if job is None:
+                continue
+            if 'result' in job:
+                result = job['result']
+            elif job['name'] in results:
+                result = results[job['name']]
+            else:
+                result = EM.voxelize_mesh(job)
+            cond.Proxy.applyVoxelization(job, result)
+        voxelCache = self.getVoxelCache()
+        if voxelCache is not None:
+            FreeCAD.Console.PrintMessage(translate("EM","Voxelization cache: ") + str(voxelCache.hits) + translate("EM"," hits, ") + str(voxelCache.misses) + translate("EM"," misses\n"))
 
     def flagVoxelizationInvalidAll(self):
         ''' Invalidate the voxelization of all VHConductors and VHPorts
@@ -413,12 +1957,32 @@ class _VHSolver:
     def __getstate__(self):
         voxelspacedim = (self.Object.VoxelSpaceX+1,self.Object.VoxelSpaceY+1,self.Object.VoxelSpaceZ+1)
         bboxcoord = (self.bbox.XMin,self.bbox.YMin,self.bbox.ZMin,self.bbox.XMax,self.bbox.YMax,self.bbox.ZMax)
-        voxelSpaceConds =  self.voxelSpace.nonzero()
-        voxelSpaceVals = self.voxelSpace[voxelSpaceConds].tolist()
-        voxelSpaceCoordX = voxelSpaceConds[0].tolist()
-        voxelSpaceCoordY = voxelSpaceConds[1].tolist()
-        voxelSpaceCoordZ = voxelSpaceConds[2].tolist()
-        dictForJSON = {'oldD':self.oldDelta,'vsDim':voxelspacedim,'vsX':voxelSpaceCoordX,'vsY':voxelSpaceCoordY,'vsZ':voxelSpaceCoordZ,'vsVals':voxelSpaceVals,'bbox':bboxcoord,'type':self.Type}
+        # if the 'VoxelSpaceFile' is up to date (written on recompute, see updateVoxelSpaceFile()),
+        # the voxel space is stored in the document as a binary file, otherwise in the JSON state
+        voxelSpaceInFile = self.voxelSpace.size > 0 and self.isVoxelSpaceFileValid()
+        if voxelSpaceInFile:
+            voxelSpaceVals = []
+            voxelSpaceCoordX = []
+            voxelSpaceCoordY = []
+            voxelSpaceCoordZ = []
+        else:
+            voxelSpaceConds =  self.voxelSpace.nonzero()
+            voxelSpaceVals = self.voxelSpace[voxelSpaceConds].tolist()
+            voxelSpaceCoordX = voxelSpaceConds[0].tolist()
+            voxelSpaceCoordY = voxelSpaceConds[1].tolist()
+            voxelSpaceCoordZ = voxelSpaceConds[2].tolist()
+        vsbboxcoord = (self.voxelSpaceBBox.XMin,self.voxelSpaceBBox.YMin,self.voxelSpaceBBox.ZMin,self.voxelSpaceBBox.XMax,self.voxelSpaceBBox.YMax,self.voxelSpaceBBox.ZMax) if self.voxelSpaceBBox.isValid() else None
+        # the scratch file of a memory-mapped voxel space can be mapped again when this state is restored
+        # in the same session, if the file is still there, unchanged (see isOwnScratchFile()),
+        # without reading the voxels. When the document is opened again, the transient folder
+        # is a new one, so the voxels are read from the document.
+        memmapFile = None
+        memmapTime = None
+        if isinstance(self.voxelSpace, np.memmap):
+            self.voxelSpace.flush()
+            memmapFile = self.voxelSpace.filename
+            memmapTime = os.path.getmtime(memmapFile)
+        dictForJSON = {'oldD':self.oldDelta,'vsDim':voxelspacedim,'vsX':voxelSpaceCoordX,'vsY':voxelSpaceCoordY,'vsZ':voxelSpaceCoordZ,'vsVals':voxelSpaceVals,'bbox':bboxcoord,'vsBackend':self.getVoxelSpaceBackend(),'vsBBox':vsbboxcoord,'condInfo':self.condVoxelInfo,'vsFile':voxelSpaceInFile,'vsMmap':memmapFile,'vsMmapTime':memmapTime,'type':self.Type}
         #FreeCAD.Console.PrintMessage("Save\n"+str(dictForJSON)+"\n") #debug
         return dictForJSON
 
@@ -429,12 +1993,79 @@ class _VHSolver:
             bboxcoord = dictForJSON['bbox']
             self.bbox = FreeCAD.BoundBox(bboxcoord[0],bboxcoord[1],bboxcoord[2],bboxcoord[3],bboxcoord[4],bboxcoord[5])
             voxelspacedim = dictForJSON['vsDim']
-            self.voxelSpace = np.full(voxelspacedim,0,np.int16)
-            voxelSpaceConds = (np.array(dictForJSON['vsX']),np.array(dictForJSON['vsY']),np.array(dictForJSON['vsZ']))
-            self.voxelSpace[voxelSpaceConds] = dictForJSON['vsVals']
+            # the voxel space type is the narrowest containing the stored indexes (older documents used int16)
+            dtype = self.getVoxelSpaceDtype(max(dictForJSON['vsVals'] + [info['index'] for info in dictForJSON.get('condInfo', {}).values()] + [0]))
+            if dictForJSON.get('vsBackend', EMVHSOLVER_DEF_VOXELSPACE_BACKEND) == "Sparse":
+                self.voxelSpace = SparseVoxelSpace(voxelspacedim,dtype)
+            elif dictForJSON.get('vsBackend', EMVHSOLVER_DEF_VOXELSPACE_BACKEND) == "Octree":
+                self.voxelSpace = OctreeVoxelSpace(voxelspacedim,dtype)
+            elif dictForJSON.get('vsBackend', EMVHSOLVER_DEF_VOXELSPACE_BACKEND) == "Memmap":
+                # the memory-mapped voxel space is created in onDocumentRestored(),
+                # when the document (and its transient folder) is known
+                self.voxelSpace = None
+            else:
+                self.voxelSpace = np.full(voxelspacedim,0,dtype)
+            voxelSpaceConds = (np.array(dictForJSON['vsX'],dtype=np.int64),np.array(dictForJSON['vsY'],dtype=np.int64),np.array(dictForJSON['vsZ'],dtype=np.int64))
+            if self.voxelSpace is None:
+                self.pendingVoxelSpace = {'shape': voxelspacedim, 'dtype': dtype, 'coords': voxelSpaceConds, 'values': dictForJSON['vsVals'],
+                                          'mmap': dictForJSON.get('vsMmap'), 'mmapTime': dictForJSON.get('vsMmapTime')}
+                self.voxelSpace = np.full((0,0,0),0,dtype)
+            else:
+                self.voxelSpace[voxelSpaceConds] = dictForJSON['vsVals']
+            # older documents do not store the voxel grid bbox and the VHConductor voxelization info.
+            # In this case, assume the grid is built on 'bbox' (as it was before the bbox could be re-embedded)
+            vsbboxcoord = dictForJSON.get('vsBBox', bboxcoord)
+            if vsbboxcoord is not None:
+                self.voxelSpaceBBox = FreeCAD.BoundBox(vsbboxcoord[0],vsbboxcoord[1],vsbboxcoord[2],vsbboxcoord[3],vsbboxcoord[4],vsbboxcoord[5])
+            else:
+                self.voxelSpaceBBox = FreeCAD.BoundBox()
+            self.condVoxelInfo = dictForJSON.get('condInfo', {})
+            # if the voxel space is stored in the 'VoxelSpaceFile', it is read in onDocumentRestored(),
+            # when the properties are available (older documents store the voxels in the JSON coordinate lists)
+            self.voxelSpaceInFile = dictForJSON.get('vsFile', False)
+            self.voxelSpaceGeneration = 0
+            self.voxelSpaceFileGeneration = 0 if self.voxelSpaceInFile else -1
             self.Type = dictForJSON['type']
         self.justLoaded = True
 
+    def onDocumentRestored(self, obj):
+        ''' Called when the document containing the object has been restored
+    '''
+        self.Object = obj
+        # documents saved before the 'Octree' backend have a shorter list of backends
+        if hasattr(obj,"VoxelSpaceBackend"):
+            if obj.getEnumerationsOfProperty("VoxelSpaceBackend") != EMVHSOLVER_VOXELSPACE_BACKENDS:
+                backend = obj.VoxelSpaceBackend
+                obj.VoxelSpaceBackend = EMVHSOLVER_VOXELSPACE_BACKENDS
+                obj.VoxelSpaceBackend = backend
+        if getattr(self,"pendingVoxelSpace",None) is not None:
+            pending = self.pendingVoxelSpace
+            self.pendingVoxelSpace = None
+            voxelSpace = None
+            # map again the scratch file only if it belongs to this VHSolver in this document, and did not change
+            if self.isOwnScratchFile(pending['mmap'], pending['mmapTime']):
+                voxelSpace = self.openMemmapVoxelSpace(pending['mmap'], pending['shape'], pending['dtype'])
+            if voxelSpace is not None:
+                self.voxelSpace = voxelSpace
+                # the scratch file already contains the voxels
+                self.voxelSpaceInFile = False
+            else:
+                # otherwise build a new scratch file from the voxels stored in the document
+                self.voxelSpace = self.createMemmapVoxelSpace(pending['shape'], pending['dtype'])
+                self.voxelSpace[pending['coords']] = pending['values']
+        if hasattr(self,"voxelSpaceInFile"):
+            if self.voxelSpaceInFile:
+                self.voxelSpaceInFile = False
+                try:
+                    self.readVoxelSpaceFile(obj.VoxelSpaceFile)
+                except (OSError, IOError, KeyError, ValueError, AttributeError) as e:
+                    FreeCAD.Console.PrintWarning(translate("EM","Cannot read the voxel space stored in the document (") + str(e) + translate("EM","), the VHConductors and VHPorts must be voxelized again\n"))
+                    self.voxelSpace = np.full((0,0,0), 0, np.uint8)
+                    self.voxelSpaceFileGeneration = -1
+                    self.condVoxelInfo = {}
+                    obj.voxelSpaceValid = False
+                    self.flagVoxelizationInvalidAll()
+
 class _ViewProviderVHSolver:
     def __init__(self, vobj):
         ''' Set this object to the proxy object of the actual view provider '''
@@ -514,7 +2145,7 @@ class _CommandVHVoxelizeAll:
             if hasattr(FreeCAD.ActiveDocument, 'VHSolver'):
                 FreeCAD.ActiveDocument.openTransaction(translate("EM","Voxelize all VHConductors and VHPorts"))
                 FreeCADGui.addModule("EM")
-                FreeCADGui.doCommand('FreeCAD.ActiveDocument.VHSolver.Proxy.voxelizeAll()')
+                FreeCADGui.doCommand('FreeCAD.ActiveDocument.VHSolver.Proxy.voxelizeAll(changedOnly=True)')
                 FreeCAD.ActiveDocument.commitTransaction()
                 # recompute the document (assuming something has changed; otherwise this is dummy)
                 FreeCAD.ActiveDocument.recompute()
@@ -0,0 +1,1277 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2019                                                    *
+#*   FastFieldSolvers S.R.L., http://www.fastfieldsolvers.com              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+
+__title__="FreeCAD E.M. Workbench VoxHenry voxelization engine"
+__author__ = "FastFieldSolvers S.R.L."
+__url__ = "http://www.fastfieldsolvers.com"
+
+# The voxelization engine works on plain Numpy arrays (triangle meshes, voxel tensors,
+# bounding box min points and voxel sizes) and does not depend on FreeCAD,
+# so it can also run in worker threads or processes, on headless compute nodes and in benchmarks.
+# The VHConductor, VHPort and VHSolver objects are adapters from the FreeCAD document
+# objects to this engine.
+
+# max number of (facet, voxel) pairs tested at once by the batched triangle-box intersection
+EMVHVOXEL_SAT_CHUNK = 262144
+# max number of voxel centers evaluated at once by the analytic voxelizers
+EMVHVOXEL_ANALYTIC_CHUNK = 1048576
+# absolute length tolerance for the geometric checks
+EMVHVOXEL_LENTOL = 1e-8
+# max number of ray-parity buckets along x and y
+EMVHVOXEL_RAYPARITY_MAXBUCKETS = 256
+# ray-parity epsilon for rays passing through triangle edges, relative to the ambiguity tolerance
+EMVHVOXEL_RAYPARITY_EPS = 1e-6
+# maximum number of (point, triangle) pairs processed at once when computing the distances
+EMVHVOXEL_DIST_CHUNK = 1048576
+# max number of voxels labelled at once when finding the contiguous voxel regions.
+# Larger conductor boxes are labelled in slabs along x (see label_regions())
+EMVHVOXEL_LABEL_CHUNK = 67108864
+# vertex offsets (in voxel units) of the voxel faces orthogonal to the x, y and z directions
+EMVHVOXEL_SHELL_QUADS = [[[0,0,0], [0,0,1], [0,1,1], [0,1,0]],
+                         [[0,0,0], [1,0,0], [1,0,1], [0,0,1]],
+                         [[0,0,0], [0,1,0], [1,1,0], [1,0,0]]]
+
+import time
+import numpy as np
+from scipy import ndimage
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+def intersects_box(triangle, box_center, box_extents):
+    X, Y, Z = 0, 1, 2
+
+    # Translate triangle as conceptually moving AABB to origin
+    v0 = triangle[0] - box_center
+    v1 = triangle[1] - box_center
+    v2 = triangle[2] - box_center
+
+    # Compute edge vectors for triangle
+    f0 = triangle[1] - triangle[0]
+    f1 = triangle[2] - triangle[1]
+    f2 = triangle[0] - triangle[2]
+
+    ## region Test axes a00..a22 (category 3)
+
+    # Test axis a00
+    a00 = np.array([0, -f0[Z], f0[Y]])
+    p0 = np.dot(v0, a00)
+    p1 = np.dot(v1, a00)
+    p2 = np.dot(v2, a00)
+    r = box_extents[Y] * abs(f0[Z]) + box_extents[Z] * abs(f0[Y])
+    if (max(-max(p0, p1, p2), min(p0, p1, p2))) > r:
+        return False
+
+    # Test axis a01
+    a01 = np.array([0, -f1[Z], f1[Y]])
+    p0 = np.dot(v0, a01)
+    p1 = np.dot(v1, a01)
+    p2 = np.dot(v2, a01)
+    r = box_extents[Y] * abs(f1[Z]) + box_extents[Z] * abs(f1[Y])
+    if (max(-max(p0, p1, p2), min(p0, p1, p2))) > r:
+        return False
+
+    # Test axis a02
+    a02 = np.array([0, -f2[Z], f2[Y]])
+    p0 = np.dot(v0, a02)
+    p1 = np.dot(v1, a02)
+    p2 = np.dot(v2, a02)
+    r = box_extents[Y] * abs(f2[Z]) + box_extents[Z] * abs(f2[Y])
+    if (max(-max(p0, p1, p2), min(p0, p1, p2))) > r:
+        return False
+
+    # Test axis a10
+    a10 = np.array([f0[Z], 0, -f0[X]])
+    p0 = np.dot(v0, a10)
+    p1 = np.dot(v1, a10)
+    p2 = np.dot(v2, a10)
+    r = box_extents[X] * abs(f0[Z]) + box_extents[Z] * abs(f0[X])
+    if (max(-max(p0, p1, p2), min(p0, p1, p2))) > r:
+        return False
+
+    # Test axis a11
+    a11 = np.array([f1[Z], 0, -f1[X]])
+    p0 = np.dot(v0, a11)
+    p1 = np.dot(v1, a11)
+    p2 = np.dot(v2, a11)
+    r = box_extents[X] * abs(f1[Z]) + box_extents[Z] * abs(f1[X])
+    if (max(-max(p0, p1, p2), min(p0, p1, p2))) > r:
+        return False
+
+    # Test axis a12
+    a11 = np.array([f2[Z], 0, -f2[X]])
+    p0 = np.dot(v0, a11)
+    p1 = np.dot(v1, a11)
+    p2 = np.dot(v2, a11)
+    r = box_extents[X] * abs(f2[Z]) + box_extents[Z] * abs(f2[X])
+    if (max(-max(p0, p1, p2), min(p0, p1, p2))) > r:
+        return False
+
+    # Test axis a20
+    a20 = np.array([-f0[Y], f0[X], 0])
+    p0 = np.dot(v0, a20)
+    p1 = np.dot(v1, a20)
+    p2 = np.dot(v2, a20)
+    r = box_extents[X] * abs(f0[Y]) + box_extents[Y] * abs(f0[X])
+    if (max(-max(p0, p1, p2), min(p0, p1, p2))) > r:
+        return False
+
+    # Test axis a21
+    a21 = np.array([-f1[Y], f1[X], 0])
+    p0 = np.dot(v0, a21)
+    p1 = np.dot(v1, a21)
+    p2 = np.dot(v2, a21)
+    r = box_extents[X] * abs(f1[Y]) + box_extents[Y] * abs(f1[X])
+    if (max(-max(p0, p1, p2), min(p0, p1, p2))) > r:
+        return False
+
+    # Test axis a22
+    a22 = np.array([-f2[Y], f2[X], 0])
+    p0 = np.dot(v0, a22)
+    p1 = np.dot(v1, a22)
+    p2 = np.dot(v2, a22)
+    r = box_extents[X] * abs(f2[Y]) + box_extents[Y] * abs(f2[X])
+    if (max(-max(p0, p1, p2), min(p0, p1, p2))) > r:
+        return False
+
+    ## endregion
+
+    ## region Test the three axes corresponding to the face normals of AABB b (category 1)
+
+    # Exit if...
+    # ... [-extents.X, extents.X] and [min(v0.X,v1.X,v2.X), max(v0.X,v1.X,v2.X)] do not overlap
+    if max(v0[X], v1[X], v2[X]) < -box_extents[X] or min(v0[X], v1[X], v2[X]) > box_extents[X]:
+        return False
+
+    # ... [-extents.Y, extents.Y] and [min(v0.Y,v1.Y,v2.Y), max(v0.Y,v1.Y,v2.Y)] do not overlap
+    if max(v0[Y], v1[Y], v2[Y]) < -box_extents[Y] or min(v0[Y], v1[Y], v2[Y]) > box_extents[Y]:
+        return False
+
+    # ... [-extents.Z, extents.Z] and [min(v0.Z,v1.Z,v2.Z), max(v0.Z,v1.Z,v2.Z)] do not overlap
+    if max(v0[Z], v1[Z], v2[Z]) < -box_extents[Z] or min(v0[Z], v1[Z], v2[Z]) > box_extents[Z]:
+        return False
+
+    ## endregion
+
+    ## region Test separating axis corresponding to triangle face normal (category 2)
+
+    plane_normal = np.cross(f0, f1)
+    plane_distance = np.abs(np.dot(plane_normal, v0))
+
+    # Compute the projection interval radius of b onto L(t) = b.c + t * p.n
+    r = box_extents[X] * abs(plane_normal[X]) + box_extents[Y] * abs(plane_normal[Y]) + box_extents[Z] * abs(
+        plane_normal[Z])
+
+    # Intersection occurs when plane distance falls within [-r,+r] interval
+    if plane_distance > r:
+        return False
+
+    ## endregion
+
+    return True
+
+
+def intersects_box_batch(triangles, box_centers, box_extents):
+    ''' Batched version of intersects_box(), testing N (triangle, box) pairs at once
+
+        'triangles' is a (N,3,3) array of triangle vertex coordinates
+        'box_centers' is a (N,3) array of box centers
+        'box_extents' is the (3,) array of the box half sizes (common to all the boxes)
+
+        The separating axis tests are the same of intersects_box(), in the same order
+        and with the same floating point operations, so the results are identical.
+
+        Returns a (N,) boolean array, True where the triangle intersects the box
+    '''
+    X, Y, Z = 0, 1, 2
+    ex, ey, ez = box_extents[X], box_extents[Y], box_extents[Z]
+
+    # Translate triangles as conceptually moving AABBs to origin
+    v0 = triangles[:, 0, :] - box_centers
+    v1 = triangles[:, 1, :] - box_centers
+    v2 = triangles[:, 2, :] - box_centers
+
+    # Compute edge vectors for triangles
+    f0 = triangles[:, 1, :] - triangles[:, 0, :]
+    f1 = triangles[:, 2, :] - triangles[:, 1, :]
+    f2 = triangles[:, 0, :] - triangles[:, 2, :]
+
+    hit = np.ones(np.size(triangles, 0), dtype=bool)
+
+    ## region Test axes a00..a22 (category 3)
+
+    # axis (0, -f[Z], f[Y])
+    for f in (f0, f1, f2):
+        p0 = v0[:, Y] * -f[:, Z] + v0[:, Z] * f[:, Y]
+        p1 = v1[:, Y] * -f[:, Z] + v1[:, Z] * f[:, Y]
+        p2 = v2[:, Y] * -f[:, Z] + v2[:, Z] * f[:, Y]
+        r = ey * np.abs(f[:, Z]) + ez * np.abs(f[:, Y])
+        hit &= np.maximum(-np.maximum(np.maximum(p0, p1), p2), np.minimum(np.minimum(p0, p1), p2)) <= r
+
+    # axis (f[Z], 0, -f[X])
+    for f in (f0, f1, f2):
+        p0 = v0[:, X] * f[:, Z] + v0[:, Z] * -f[:, X]
+        p1 = v1[:, X] * f[:, Z] + v1[:, Z] * -f[:, X]
+        p2 = v2[:, X] * f[:, Z] + v2[:, Z] * -f[:, X]
+        r = ex * np.abs(f[:, Z]) + ez * np.abs(f[:, X])
+        hit &= np.maximum(-np.maximum(np.maximum(p0, p1), p2), np.minimum(np.minimum(p0, p1), p2)) <= r
+
+    # axis (-f[Y], f[X], 0)
+    for f in (f0, f1, f2):
+        p0 = v0[:, X] * -f[:, Y] + v0[:, Y] * f[:, X]
+        p1 = v1[:, X] * -f[:, Y] + v1[:, Y] * f[:, X]
+        p2 = v2[:, X] * -f[:, Y] + v2[:, Y] * f[:, X]
+        r = ex * np.abs(f[:, Y]) + ey * np.abs(f[:, X])
+        hit &= np.maximum(-np.maximum(np.maximum(p0, p1), p2), np.minimum(np.minimum(p0, p1), p2)) <= r
+
+    ## endregion
+
+    ## region Test the three axes corresponding to the face normals of AABB b (category 1)
+
+    for axis in (X, Y, Z):
+        vmax = np.maximum(np.maximum(v0[:, axis], v1[:, axis]), v2[:, axis])
+        vmin = np.minimum(np.minimum(v0[:, axis], v1[:, axis]), v2[:, axis])
+        hit &= ~((vmax < -box_extents[axis]) | (vmin > box_extents[axis]))
+
+    ## endregion
+
+    ## region Test separating axis corresponding to triangle face normal (category 2)
+
+    plane_normal = np.cross(f0, f1)
+    plane_distance = np.abs(plane_normal[:, X] * v0[:, X] + plane_normal[:, Y] * v0[:, Y] + plane_normal[:, Z] * v0[:, Z])
+
+    # Compute the projection interval radius of b onto L(t) = b.c + t * p.n
+    r = ex * np.abs(plane_normal[:, X]) + ey * np.abs(plane_normal[:, Y]) + ez * np.abs(plane_normal[:, Z])
+
+    # Intersection occurs when plane distance falls within [-r,+r] interval
+    hit &= plane_distance <= r
+
+    ## endregion
+
+    return hit
+
+
+def mesh_intersections_batch(facets, gbbox_min, local_vs_min, local_vs_size, delta, chunk_size=None):
+    ''' Find the voxels of a conductor-local voxel box that intersect a triangle mesh
+
+        'facets' is a (N,3,3) array of triangle vertex coordinates
+        'gbbox_min' is the (3,) array of the global bbox min point
+        'local_vs_min' is the (3,) int array of the min voxel of the local box, in global voxel coordinates
+        'local_vs_size' is the (3,) int array of the local box dimensions, in voxels
+        'delta' is the voxels size length
+        'chunk_size' is the maximum number of (facet, voxel) pairs tested at once,
+            to bound the memory usage. Defaults to EMVHVOXEL_SAT_CHUNK
+
+        Every facet is tested against all the voxels overlapping the facet bounding box,
+        as the per-facet loop calling intersects_box() did, limited to the local box.
+        The facets of a conductor mesh lie in the conductor box, so the limit only drops
+        candidate voxels outside the box, which the mask cannot hold anyway (the per-facet loop
+        failed on them beyond the upper end, and wrapped around to the opposite side below zero).
+
+        Returns a boolean array of shape 'local_vs_size', True for the voxels intersecting the mesh
+    '''
+    X, Y, Z = 0, 1, 2
+    if chunk_size is None:
+        chunk_size = EMVHVOXEL_SAT_CHUNK
+    local_vs_size = np.asarray(local_vs_size)
+    mesh_intersections = np.zeros(local_vs_size, dtype=bool)
+    n_facets = np.size(facets, 0)
+    if n_facets == 0:
+        return mesh_intersections
+    half_el_size_eps = delta / 2.0 + 1e-14
+    half_el_size = np.array((half_el_size_eps, half_el_size_eps, half_el_size_eps))
+    # get voxel indices of facet bb points, in conductor-local voxel coordinates,
+    # limited to the local voxel box
+    facet_min_voxel = np.floor((np.min(facets, 1) - gbbox_min) / delta).astype(np.int64) - local_vs_min
+    facet_max_voxel = np.floor((np.max(facets, 1) - gbbox_min) / delta).astype(np.int64) - local_vs_min
+    facet_min_voxel = np.clip(facet_min_voxel, 0, local_vs_size - 1)
+    facet_max_voxel = np.clip(facet_max_voxel, facet_min_voxel, local_vs_size - 1)
+    facet_ext = facet_max_voxel - facet_min_voxel + 1
+    # number of candidate voxels per facet, and chunk boundaries so that each chunk
+    # contains at most 'chunk_size' pairs (but at least one facet)
+    pair_counts = np.prod(facet_ext, axis=1)
+    pair_ends = np.cumsum(pair_counts)
+    start = 0
+    while start < n_facets:
+        pair_base = pair_ends[start] - pair_counts[start]
+        end = max(int(np.searchsorted(pair_ends, pair_base + chunk_size, side='right')), start + 1)
+        counts = pair_counts[start:end]
+        facet_index = np.repeat(np.arange(start, end), counts)
+        # position of each pair within its facet candidate box
+        local = np.arange(pair_ends[end - 1] - pair_base) - np.repeat(pair_ends[start:end] - counts - pair_base, counts)
+        ext = facet_ext[facet_index]
+        voxels = facet_min_voxel[facet_index]
+        voxels[:, Z] += local % ext[:, Z]
+        local //= ext[:, Z]
+        voxels[:, Y] += local % ext[:, Y]
+        voxels[:, X] += local // ext[:, Y]
+        hit = intersects_box_batch(triangles=facets[facet_index],
+                                   box_centers=get_voxel_center(gbbox_min, voxels + local_vs_min, delta),
+                                   box_extents=half_el_size)
+        voxels = voxels[hit]
+        mesh_intersections[voxels[:, X], voxels[:, Y], voxels[:, Z]] = True
+        start = end
+    return mesh_intersections
+
+
+def get_voxel_center(bb_min, voxel, delta):
+    return bb_min + (voxel + 0.5) * delta
+
+
+def analytic_voxelize(inside, gbbox_min, local_vs_min, local_vs_size, delta):
+    ''' Voxelize by evaluating a closed-form inside test on the voxel centers
+
+        'inside' is the inside test function (see get_analytic_inside())
+        'gbbox_min' is the (3,) array of the global bbox min point
+        'local_vs_min' is the (3,) int array of the min voxel of the local box, in global voxel coordinates
+        'local_vs_size' is the (3,) int array of the local box dimensions, in voxels
+        'delta' is the voxels size length
+
+        The voxel centers are evaluated in x slabs, to bound the memory usage.
+
+        Returns a boolean array of shape 'local_vs_size', True for the voxels inside the object
+    '''
+    X, Y, Z = 0, 1, 2
+    mask = np.zeros(local_vs_size, dtype=bool)
+    centers_y = get_voxel_center(gbbox_min[Y], np.arange(local_vs_size[Y]) + local_vs_min[Y], delta)
+    centers_z = get_voxel_center(gbbox_min[Z], np.arange(local_vs_size[Z]) + local_vs_min[Z], delta)
+    slab = max(1, EMVHVOXEL_ANALYTIC_CHUNK // max(1, local_vs_size[Y] * local_vs_size[Z]))
+    for x_start in range(0, local_vs_size[X], slab):
+        x_end = min(x_start + slab, local_vs_size[X])
+        centers_x = get_voxel_center(gbbox_min[X], np.arange(x_start, x_end) + local_vs_min[X], delta)
+        grid = np.stack(np.meshgrid(centers_x, centers_y, centers_z, indexing='ij'), axis=-1).reshape(-1, 3)
+        mask[x_start:x_end, :, :] = inside(grid).reshape(x_end - x_start, local_vs_size[Y], local_vs_size[Z])
+    return mask
+
+
+def to_local_frame(frame, points):
+    ''' Transform global points into a local frame
+
+        'frame' is a tuple (rotation, translation) of the (3,3) rotation matrix and of the (3,)
+            translation from the global to the local coordinates, or None for the global frame
+        'points' is a (N,3) array of global coordinates
+
+        Returns a (N,3) array of local coordinates
+    '''
+    if frame is None:
+        return points
+    rotation, translation = frame
+    return points @ np.asarray(rotation).T + np.asarray(translation)
+
+
+def inside_polygons_2d(u, v, polygons, tol):
+    ''' Even-odd point-in-polygon test, vectorized over the points
+
+        'u', 'v' are arrays of the 2D point coordinates
+        'polygons' is a list of (K,2) arrays of the vertexes of closed polygons.
+            Holes are handled by the even-odd rule.
+        'tol' is the distance from the polygon edges within which points are considered inside
+            (mimics the 'check points on faces' behavior of Shape.isInside)
+
+        Returns a boolean array, True for the points inside the polygons
+    '''
+    inside = np.zeros(u.shape, dtype=bool)
+    on_edge = np.zeros(u.shape, dtype=bool)
+    for poly in polygons:
+        for (ui, vi), (uj, vj) in zip(poly, np.roll(poly, -1, axis=0)):
+            crosses = (vi > v) != (vj > v)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                u_cross = ui + (uj - ui) * (v - vi) / (vj - vi)
+            inside ^= crosses & (u < u_cross)
+            # distance from the edge segment
+            du, dv = uj - ui, vj - vi
+            len2 = du * du + dv * dv
+            if len2 > 0.0:
+                t = np.clip(((u - ui) * du + (v - vi) * dv) / len2, 0.0, 1.0)
+            else:
+                t = 0.0
+            on_edge |= (u - ui - t * du) ** 2 + (v - vi - t * dv) ** 2 <= tol * tol
+    return inside | on_edge
+
+
+def box_inside(length, width, height, tol, frame=None):
+    ''' Closed-form inside test for a box with the lower corner in the origin of its local frame
+
+        'length', 'width', 'height' are the box dimensions along the local x, y, z
+        'tol' is the distance from the surface within which points are considered inside
+        'frame' is the local frame of the box (see to_local_frame())
+
+        Returns a function of a (N,3) array of points returning a (N,) boolean array,
+        True for the points inside the box (see analytic_voxelize())
+    '''
+    def inside(points):
+        p = to_local_frame(frame, points)
+        return ((p[:, 0] >= -tol) & (p[:, 0] <= length + tol) &
+                (p[:, 1] >= -tol) & (p[:, 1] <= width + tol) &
+                (p[:, 2] >= -tol) & (p[:, 2] <= height + tol))
+    return inside
+
+
+def cylinder_inside(radius, height, tol, frame=None):
+    ''' Closed-form inside test for a cylinder with the base centered in the origin
+        of its local frame, and the axis along the local z
+
+        'radius', 'height' are the cylinder dimensions
+        'tol' is the distance from the surface within which points are considered inside
+        'frame' is the local frame of the cylinder (see to_local_frame())
+
+        Returns the inside test function (see box_inside())
+    '''
+    def inside(points):
+        p = to_local_frame(frame, points)
+        return ((p[:, 0] ** 2 + p[:, 1] ** 2 <= (radius + tol) ** 2) &
+                (p[:, 2] >= -tol) & (p[:, 2] <= height + tol))
+    return inside
+
+
+def prism_inside(sides, circumradius, height, tol, frame=None):
+    ''' Closed-form inside test for a straight regular prism with the base centered in the origin
+        of its local frame, a vertex along the local x, and the axis along the local z
+
+        'sides' is the number of sides of the base polygon
+        'circumradius', 'height' are the prism dimensions
+        'tol' is the distance from the surface within which points are considered inside
+        'frame' is the local frame of the prism (see to_local_frame())
+
+        Returns the inside test function (see box_inside())
+    '''
+    angles = np.arange(sides) * (2.0 * np.pi / sides)
+    polygon = np.stack((circumradius * np.cos(angles), circumradius * np.sin(angles)), axis=1)
+    def inside(points):
+        p = to_local_frame(frame, points)
+        return ((p[:, 2] >= -tol) & (p[:, 2] <= height + tol) &
+                inside_polygons_2d(p[:, 0], p[:, 1], [polygon], tol))
+    return inside
+
+
+def extrusion_inside(origin, uaxis, vaxis, polygons, direction, length_fwd, length_rev, tol):
+    ''' Closed-form inside test for the extrusion of a planar profile made of straight edges,
+        without taper
+
+        'origin' is the (3,) origin of the profile plane
+        'uaxis', 'vaxis' are the (3,) orthonormal axes of the profile plane
+        'polygons' is the list of (K,2) arrays of the profile polygons, in (u,v) coordinates.
+            Holes are handled by the even-odd rule (see inside_polygons_2d())
+        'direction' is the (3,) unit extrusion direction, not parallel to the profile plane
+        'length_fwd', 'length_rev' are the extrusion lengths along 'direction' and opposite to it
+        'tol' is the distance from the surface within which points are considered inside
+
+        Returns the inside test function (see box_inside())
+    '''
+    normal = np.cross(uaxis, vaxis)
+    dir_normal = direction @ normal
+    def inside(points):
+        rel = points - origin
+        # extrusion parameter of each point, and projection along 'direction' on the profile plane
+        t = (rel @ normal) / dir_normal
+        proj = rel - t[:, None] * direction
+        return ((t >= -length_rev - tol) & (t <= length_fwd + tol) &
+                inside_polygons_2d(proj @ uaxis, proj @ vaxis, polygons, tol))
+    return inside
+
+
+def ray_parity_inside(facets, points, tol, chunk_size=None):
+    ''' Classify points as inside or outside a closed triangle mesh, by counting
+        the crossings of a ray shot from every point along +z (even-odd rule)
+
+        'facets' is a (N,3,3) array of triangle vertex coordinates
+        'points' is a (M,3) array of the points to classify
+        'tol' is the distance from the mesh within which the classification is ambiguous
+            (e.g. the mesh linear deflection w.r.t. the actual shape)
+        'chunk_size' is the maximum number of (point, triangle) pairs tested at once,
+            to bound the memory usage. Defaults to EMVHVOXEL_SAT_CHUNK
+
+        The triangles are indexed in a 2D grid of buckets on the x-y plane, so every ray
+        is tested only against the triangles overlapping its bucket.
+        A point is flagged as ambiguous if it is closer than 'tol' to the plane of a nearby
+        triangle, or if its ray passes (within a small epsilon) through a triangle edge or vertex.
+        Ambiguous points must be classified in some other way (e.g. with Shape.isInside).
+
+        Returns the tuple (inside, ambiguous) of (M,) boolean arrays
+    '''
+    X, Y, Z = 0, 1, 2
+    if chunk_size is None:
+        chunk_size = EMVHVOXEL_SAT_CHUNK
+    n_points = np.size(points, 0)
+    inside = np.zeros(n_points, dtype=bool)
+    ambiguous = np.zeros(n_points, dtype=bool)
+    if n_points == 0 or np.size(facets, 0) == 0:
+        return inside, ambiguous
+    tri_min = np.min(facets, 1)
+    tri_max = np.max(facets, 1)
+    # build the bucket grid on the x-y plane
+    grid_min = np.minimum(np.min(tri_min[:, :Z], 0), np.min(points[:, :Z], 0)) - tol
+    grid_max = np.maximum(np.max(tri_max[:, :Z], 0), np.max(points[:, :Z], 0)) + tol
+    cell = max(np.median(np.max(tri_max[:, :Z] - tri_min[:, :Z], 1)),
+               np.max(grid_max - grid_min) / EMVHVOXEL_RAYPARITY_MAXBUCKETS,
+               EMVHVOXEL_LENTOL)
+    grid_dims = (np.floor((grid_max - grid_min) / cell)).astype(np.int64) + 1
+    # register each triangle in all the buckets overlapping its x-y bounding box, grown by 'tol'
+    tri_bucket_min = np.clip(np.floor((tri_min[:, :Z] - tol - grid_min) / cell).astype(np.int64), 0, grid_dims - 1)
+    tri_bucket_max = np.clip(np.floor((tri_max[:, :Z] + tol - grid_min) / cell).astype(np.int64), 0, grid_dims - 1)
+    tri_bucket_ext = tri_bucket_max - tri_bucket_min + 1
+    tri_bucket_counts = np.prod(tri_bucket_ext, axis=1)
+    tri_ids = np.repeat(np.arange(np.size(facets, 0)), tri_bucket_counts)
+    local = np.arange(np.size(tri_ids)) - np.repeat(np.cumsum(tri_bucket_counts) - tri_bucket_counts, tri_bucket_counts)
+    bucket_ids = ((tri_bucket_min[tri_ids, X] + local // tri_bucket_ext[tri_ids, Y]) * grid_dims[Y] +
+                  tri_bucket_min[tri_ids, Y] + local % tri_bucket_ext[tri_ids, Y])
+    order = np.argsort(bucket_ids, kind='stable')
+    bucket_tris = tri_ids[order]
+    bucket_counts = np.bincount(bucket_ids, minlength=grid_dims[X] * grid_dims[Y])
+    bucket_starts = np.cumsum(bucket_counts) - bucket_counts
+    # bucket of each point
+    point_buckets = np.clip(np.floor((points[:, :Z] - grid_min) / cell).astype(np.int64), 0, grid_dims - 1)
+    point_buckets = point_buckets[:, X] * grid_dims[Y] + point_buckets[:, Y]
+    pair_counts = bucket_counts[point_buckets]
+    pair_ends = np.cumsum(pair_counts)
+    # small epsilon for the ray passing through edges or vertexes
+    eps = tol * EMVHVOXEL_RAYPARITY_EPS
+    crossings = np.zeros(n_points, dtype=np.int64)
+    start = 0
+    while start < n_points:
+        pair_base = pair_ends[start] - pair_counts[start]
+        end = max(int(np.searchsorted(pair_ends, pair_base + chunk_size, side='right')), start + 1)
+        counts = pair_counts[start:end]
+        point_index = np.repeat(np.arange(start, end), counts)
+        local = np.arange(pair_ends[end - 1] - pair_base) - np.repeat(pair_ends[start:end] - counts - pair_base, counts)
+        tri = bucket_tris[bucket_starts[point_buckets[point_index]] + local]
+        p = points[point_index]
+        a = facets[tri, 0, :]
+        b = facets[tri, 1, :]
+        c = facets[tri, 2, :]
+        # twice the signed area of the triangle projected on the x-y plane
+        area2 = (b[:, X] - a[:, X]) * (c[:, Y] - a[:, Y]) - (b[:, Y] - a[:, Y]) * (c[:, X] - a[:, X])
+        sign = np.where(area2 < 0.0, -1.0, 1.0)
+        # (scaled) barycentric coordinates of the ray on the projected triangle
+        w0 = sign * ((b[:, X] - p[:, X]) * (c[:, Y] - p[:, Y]) - (b[:, Y] - p[:, Y]) * (c[:, X] - p[:, X]))
+        w1 = sign * ((c[:, X] - p[:, X]) * (a[:, Y] - p[:, Y]) - (c[:, Y] - p[:, Y]) * (a[:, X] - p[:, X]))
+        w2 = sign * ((a[:, X] - p[:, X]) * (b[:, Y] - p[:, Y]) - (a[:, Y] - p[:, Y]) * (b[:, X] - p[:, X]))
+        # distance of the ray from the projected triangle edges (positive inside)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            edge_dist = np.minimum(np.minimum(w0 / np.hypot(c[:, X] - b[:, X], c[:, Y] - b[:, Y]),
+                                              w1 / np.hypot(a[:, X] - c[:, X], a[:, Y] - c[:, Y])),
+                                   w2 / np.hypot(b[:, X] - a[:, X], b[:, Y] - a[:, Y]))
+            z_hit = (w0 * a[:, Z] + w1 * b[:, Z] + w2 * c[:, Z]) / np.abs(area2)
+        valid = np.abs(area2) > EMVHVOXEL_LENTOL * EMVHVOXEL_LENTOL
+        hit = valid & (edge_dist > eps)
+        cross = hit & (z_hit > p[:, Z])
+        amb = valid & (np.abs(edge_dist) <= eps)
+        # points too close to the triangle (using the distance from the triangle plane,
+        # and the triangle bounding box grown by 'tol', as a conservative test)
+        normal = np.cross(b - a, c - a)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            plane_dist = np.abs(np.sum(normal * (p - a), axis=1)) / np.linalg.norm(normal, axis=1)
+        near = (np.all(p >= tri_min[tri] - tol, axis=1) & np.all(p <= tri_max[tri] + tol, axis=1) &
+                ~(plane_dist > tol))
+        amb |= near
+        crossings[start:end] = np.bincount(point_index[cross] - start, minlength=end - start)
+        ambiguous[start:end] = np.bincount(point_index[amb] - start, minlength=end - start) > 0
+        start = end
+    inside = (crossings % 2) == 1
+    return inside, ambiguous
+
+
+def label_regions(occupied, chunk=EMVHVOXEL_LABEL_CHUNK):
+    ''' Label the contiguous regions of the empty voxels of a box
+
+        'occupied' is a boolean 3D array, True for the occupied voxels
+        'chunk' is the max number of voxels labelled at once. Larger boxes are labelled
+            in slabs along x, and the regions touching across the slab boundaries are then merged
+
+        The labels are the same as returned by ndimage.label(~occupied), i.e. the regions are
+        face-connected, and are numbered from 1 in the order of their first voxel along x, y, z.
+
+        Returns a tuple (labels, count) where 'labels' is an int32 array of the shape of 'occupied',
+        zero for the occupied voxels, and 'count' is the number of regions
+    '''
+    X, Y, Z = 0, 1, 2
+    size = occupied.shape
+    if occupied.size <= chunk:
+        return ndimage.label(~occupied)
+    slab = max(1, chunk // max(1, size[Y] * size[Z]))
+    labels = np.zeros(size, dtype=np.int32)
+    count = 0
+    pairs = []
+    for start in range(0, size[X], slab):
+        end = min(start + slab, size[X])
+        # the x slab of a C-ordered array is contiguous, so the labels can be written in place
+        slabLabels = labels[start:end]
+        slabCount = ndimage.label(~occupied[start:end], output=slabLabels)
+        slabLabels[slabLabels > 0] += count
+        if start > 0:
+            # regions touching across the slab boundary
+            prev = labels[start - 1]
+            cur = labels[start]
+            touching = (prev > 0) & (cur > 0)
+            pairs.append(np.unique(np.stack((prev[touching], cur[touching]), axis=1), axis=0))
+        count = count + slabCount
+    if count == 0:
+        return labels, 0
+    pairs = np.concatenate(pairs) if len(pairs) > 0 else np.zeros((0, 2), dtype=np.int32)
+    graph = coo_matrix((np.ones(len(pairs), dtype=np.int8), (pairs[:, 0], pairs[:, 1])), shape=(count + 1, count + 1))
+    componentCount, components = connected_components(graph, directed=False)
+    # renumber the merged regions in the order of their first voxel, as ndimage.label().
+    # The slab labels are already in this order, so this is the order of the lowest slab label of each region
+    regions, firstLabels = np.unique(components[1:], return_index=True)
+    regionIds = np.zeros(componentCount, dtype=np.int32)
+    regionIds[regions[np.argsort(firstLabels)]] = np.arange(1, len(regions) + 1, dtype=np.int32)
+    lookup = regionIds[components]
+    lookup[0] = 0
+    for start in range(0, size[X], slab):
+        labels[start:start + slab] = lookup[labels[start:start + slab]]
+    return labels, len(regions)
+
+
+def region_samples(labels, count, chunk=EMVHVOXEL_LABEL_CHUNK):
+    ''' Find a sample voxel for each labelled region, in a single pass over the labels
+
+        'labels' is the int 3D array of the region labels (see label_regions())
+        'count' is the number of regions
+        'chunk' is the max number of voxels scanned at once
+
+        The sample is the first voxel of the region along x, y, z, i.e. the same as
+        np.argwhere(labels == label)[0], but without a full scan of the labels for every region.
+
+        Returns a (count,3) int array of the sample voxel of each region
+    '''
+    X, Y, Z = 0, 1, 2
+    size = labels.shape
+    planeSize = max(1, size[Y] * size[Z])
+    slab = max(1, chunk // planeSize)
+    # flat index of the first voxel of each region (the scan is in flat index order,
+    # so the first slab containing a region holds its first voxel)
+    first = np.full(count + 1, labels.size, dtype=np.int64)
+    for start in range(0, size[X], slab):
+        slabLabels = labels[start:start + slab].ravel()
+        indexes = np.flatnonzero(slabLabels)
+        np.minimum.at(first, slabLabels[indexes], indexes + start * planeSize)
+    return np.column_stack(np.unravel_index(first[1:], size)).astype(np.int64)
+
+
+def regions_mask(labels, regions):
+    ''' Find the voxels belonging to a set of regions, as np.isin(labels, regions),
+        but with a single lookup pass over the labels
+
+        'labels' is the int 3D array of the region labels (see label_regions())
+        'regions' is the array of the labels of the regions
+
+        Returns a boolean array of the shape of 'labels'
+    '''
+    regions = np.asarray(regions, dtype=np.int64)
+    if regions.size == 0:
+        return np.zeros(labels.shape, dtype=bool)
+    # the last lookup entry is False, for all the labels not in 'regions'
+    lookup = np.zeros(regions.max() + 2, dtype=bool)
+    lookup[regions] = True
+    return lookup[np.minimum(labels, len(lookup) - 1)]
+
+
+class VoxelMask:
+    ''' Boolean mask of a tiled voxel space (see SparseVoxelSpace), evaluated tile by tile
+
+    The mask is the result of the comparison 'voxelSpace == value' or 'voxelSpace != value',
+    or of the combination of such masks of the same voxel space with '&', '|', '^' and '~'.
+    It is used for the masked assignment 'voxelSpace[mask] = newValue', that evaluates the mask
+    on the allocated tiles only. The mask cannot be combined with Numpy arrays or used
+    as a truth value: call toArray() to materialize it as a dense boolean array.
+    '''
+    def __init__(self, voxel_space, evaluate, selects_empty):
+        ''' 'voxel_space' is the voxel space the mask refers to
+            'evaluate' is a function mapping an array of voxel values to the boolean mask array
+            'selects_empty' is True if the mask selects the empty (zero) voxels
+    '''
+        self.voxel_space = voxel_space
+        self.evaluate = evaluate
+        self.selects_empty = selects_empty
+
+    @classmethod
+    def compare(cls, voxel_space, value, equal=True):
+        ''' Creates the mask 'voxel_space == value' (or 'voxel_space != value' if 'equal' is False)
+    '''
+        if equal:
+            return cls(voxel_space, lambda values: values == value, value == 0)
+        return cls(voxel_space, lambda values: values != value, value != 0)
+
+    def _combine(self, other, operator):
+        if not isinstance(other, VoxelMask):
+            raise TypeError("a VoxelMask can only be combined with another VoxelMask, use toArray() to get a boolean array")
+        if other.voxel_space is not self.voxel_space:
+            raise ValueError("the VoxelMasks refer to different voxel spaces")
+        first = self.evaluate
+        second = other.evaluate
+        return VoxelMask(self.voxel_space, lambda values: operator(first(values), second(values)),
+                         bool(operator(self.selects_empty, other.selects_empty)))
+
+    def __and__(self, other):
+        return self._combine(other, np.logical_and)
+
+    def __or__(self, other):
+        return self._combine(other, np.logical_or)
+
+    def __xor__(self, other):
+        return self._combine(other, np.logical_xor)
+
+    def __invert__(self):
+        evaluate = self.evaluate
+        return VoxelMask(self.voxel_space, lambda values: ~evaluate(values), not self.selects_empty)
+
+    def __bool__(self):
+        raise ValueError("the truth value of a VoxelMask is ambiguous, use toArray() to get a boolean array")
+
+    def toArray(self):
+        ''' Returns the mask as a dense boolean Numpy 3D array
+    '''
+        return np.asarray(self.evaluate(self.voxel_space.toArray()), dtype=bool)
+
+
+def voxelize_mesh(job):
+    ''' Voxelize a conductor from its triangle mesh. This is the pure Numpy part
+        of the voxelization, so it can also run in a worker thread or process.
+
+        'job' is the voxelization job dict (e.g. built by _VHConductor.prepareVoxelization()), containing:
+            'facets' (N,3,3) array of the triangle mesh of the conductor
+            'gbbox_min' (3,) array of the global bbox min point
+            'delta' voxels size length
+            'local_vs_min' (3,) int array of the min voxel of the conductor box, in global voxel coordinates
+            'local_vs_size' (3,) int array of the conductor box dimensions, in voxels
+            'linear_deflection' mesh linear deflection w.r.t. the actual conductor shape
+            'use_ray_parity' (bool) if True, classify the voxels with ray_parity_inside()
+            'label_chunk' (optional) max number of voxels labelled at once (see label_regions())
+
+        Voxelization is done with the Shape.isInside function, sampled on voxel centers.
+        BUT isInside can be expensive (and cannot run here), so to minimize calls to isInside:
+          1. Find the set 'A' of voxels that intersect the mesh
+          2. For all voxels in 'A', the conductor index must be set (or not) based on isInside
+          3. Using the voxels 'A', find sets 'B', 'C', ... that are contiguous regions split up by 'A'
+          4. For region 'R_' in voxel sets 'B', 'C',...
+            a. 'R_' must be set (or not) based on a single arbitrary voxel in 'R' with inSide
+        If 'use_ray_parity' is True, steps 2. and 4.a. are done here by ray parity, leaving to isInside
+        only the ambiguous voxels.
+
+        The number of isInside calls should be approximately proportional to the conductor surface area.
+        The result should be identical to calling isInside for every voxel.
+
+        Returns a dict containing (all indices are in conductor-local voxel coordinates):
+            'inside_mask' boolean array of shape 'local_vs_size', True for the voxels inside the conductor
+            'check_voxels' (M,3) int array of the voxels to be checked individually with isInside
+            'region_labels' int array of shape 'local_vs_size', labelling the contiguous regions
+            'region_check_labels' (R,) int array of the labels of the regions to be checked with isInside
+            'region_check_samples' (R,3) int array of the sample voxel of each region to be checked
+            'stats' dict of the stage durations in seconds ('times'), of the stage memory in bytes
+                ('memory', the size of the arrays allocated by each stage), and of the counters ('counts'),
+                as the voxelization may run in a worker thread or process (see VoxelProfiler in EM_VHSolver)
+    '''
+    X, Y, Z = 0, 1, 2
+    facets = job['facets']
+    gbbox_min = job['gbbox_min']
+    delta = job['delta']
+    local_vs_min = job['local_vs_min']
+    local_vs_size = job['local_vs_size']
+
+    times = {}
+    memory = {}
+    # consider every mesh facet, and check for mesh intersections with voxels
+    intersection_start = time.perf_counter()
+    mesh_intersections = mesh_intersections_batch(facets=facets,
+                                                  gbbox_min=gbbox_min,
+                                                  local_vs_min=local_vs_min,
+                                                  local_vs_size=local_vs_size,
+                                                  delta=delta)
+    times['intersection'] = time.perf_counter() - intersection_start
+    memory['intersection'] = mesh_intersections.nbytes
+
+    # Identify contiguous voxel regions
+    labelling_start = time.perf_counter()
+    region_labels, n_features = label_regions(mesh_intersections, job.get('label_chunk', EMVHVOXEL_LABEL_CHUNK))
+
+    inside_mask = np.zeros(local_vs_size, dtype=bool)
+    # special case of label == 0. these are the voxels that intersected with the mesh. check each of these
+    # voxels individually
+    check_voxels = np.argwhere(mesh_intersections)
+    surface_voxel_count = len(check_voxels)
+    ray_parity_time = 0.0
+    ray_parity_memory = 0
+    if job['use_ray_parity']:
+        ray_parity_start = time.perf_counter()
+        # classify all the voxel centers at once against the mesh. Only the voxels
+        # too close to the mesh for a reliable answer are left to isInside
+        points = get_voxel_center(gbbox_min, check_voxels + local_vs_min, delta)
+        ray_inside, ray_ambiguous = ray_parity_inside(facets=facets,
+                                                      points=points,
+                                                      tol=job['linear_deflection'])
+        ray_parity_memory = points.nbytes + ray_inside.nbytes + ray_ambiguous.nbytes
+        inside_voxels = check_voxels[ray_inside & ~ray_ambiguous]
+        inside_mask[inside_voxels[:, X], inside_voxels[:, Y], inside_voxels[:, Z]] = True
+        check_voxels = check_voxels[ray_ambiguous]
+        ray_parity_time = time.perf_counter() - ray_parity_start
+
+    # a contiguous region of voxels that did NOT intersect with the mesh. these can be set all at once,
+    # checking if the whole region should be set by sampling a single voxel
+    region_check_labels = np.arange(1, n_features + 1)
+    region_check_samples = region_samples(region_labels, n_features)
+    times['labelling'] = time.perf_counter() - labelling_start - ray_parity_time
+    memory['labelling'] = region_labels.nbytes + inside_mask.nbytes + check_voxels.nbytes + region_check_samples.nbytes
+    if job['use_ray_parity'] and n_features > 0:
+        ray_parity_start = time.perf_counter()
+        points = get_voxel_center(gbbox_min, region_check_samples + local_vs_min, delta)
+        ray_inside, ray_ambiguous = ray_parity_inside(facets=facets,
+                                                      points=points,
+                                                      tol=job['linear_deflection'])
+        ray_parity_memory = max(ray_parity_memory, points.nbytes + ray_inside.nbytes + ray_ambiguous.nbytes)
+        inside_mask |= regions_mask(region_labels, region_check_labels[ray_inside & ~ray_ambiguous])
+        region_check_labels = region_check_labels[ray_ambiguous]
+        region_check_samples = region_check_samples[ray_ambiguous]
+        ray_parity_time = ray_parity_time + time.perf_counter() - ray_parity_start
+    if job['use_ray_parity']:
+        times['ray parity'] = ray_parity_time
+        memory['ray parity'] = ray_parity_memory
+
+    return {'inside_mask': inside_mask,
+            'check_voxels': check_voxels,
+            'region_labels': region_labels if np.size(region_check_labels) > 0 else None,
+            'region_check_labels': region_check_labels,
+            'region_check_samples': region_check_samples,
+            'stats': {'times': times,
+                      'memory': memory,
+                      'counts': {'facets': len(facets),
+                                 'surface voxels': surface_voxel_count,
+                                 'regions': n_features}}}
+
+
+def compact_voxelization(result):
+    ''' Convert a voxelize_mesh() result to a compact form, containing the voxel indexes
+        instead of the arrays spanning the whole conductor box, e.g. to keep the results
+        of many conductors until they are merged in the voxel space
+
+        'result' is the dict returned by voxelize_mesh()
+
+        Returns a dict with the same 'check_voxels', 'region_check_labels', 'region_check_samples'
+        and 'stats' as 'result', plus:
+            'inside_indexes' (N,) int array of the flat indexes in the conductor box of the inside voxels
+            'region_indexes' (M,) int array of the flat indexes of the voxels of the regions
+                still to be checked with isInside
+            'region_voxel_labels' (M,) int array of the region labels of these voxels
+        The dense result is rebuilt with expand_voxelization()
+    '''
+    compact = {'inside_indexes': np.flatnonzero(result['inside_mask']),
+               'check_voxels': result['check_voxels'],
+               'region_check_labels': result['region_check_labels'],
+               'region_check_samples': result['region_check_samples'],
+               'stats': result['stats']}
+    if result['region_labels'] is not None:
+        compact['region_indexes'] = np.flatnonzero(regions_mask(result['region_labels'], result['region_check_labels']))
+        compact['region_voxel_labels'] = result['region_labels'].ravel()[compact['region_indexes']]
+    else:
+        compact['region_indexes'] = np.zeros(0, dtype=np.int64)
+        compact['region_voxel_labels'] = np.zeros(0, dtype=np.int32)
+    return compact
+
+
+def expand_voxelization(compact, local_vs_size):
+    ''' Rebuild the voxelize_mesh() result from its compact form (see compact_voxelization())
+
+        'compact' is the dict returned by compact_voxelization()
+        'local_vs_size' is the (3,) int array of the conductor box dimensions, in voxels
+
+        The labels of the regions already classified are dropped, i.e. 'region_labels'
+        is zero outside the regions still to be checked.
+
+        Returns the result dict, as returned by voxelize_mesh()
+    '''
+    local_vs_size = tuple(int(size) for size in local_vs_size)
+    inside_mask = np.zeros(local_vs_size, dtype=bool)
+    inside_mask.ravel()[compact['inside_indexes']] = True
+    region_labels = None
+    if np.size(compact['region_check_labels']) > 0:
+        region_labels = np.zeros(local_vs_size, dtype=np.int32)
+        region_labels.ravel()[compact['region_indexes']] = compact['region_voxel_labels']
+    return {'inside_mask': inside_mask,
+            'check_voxels': compact['check_voxels'],
+            'region_labels': region_labels,
+            'region_check_labels': compact['region_check_labels'],
+            'region_check_samples': compact['region_check_samples'],
+            'stats': compact['stats']}
+
+
+def voxelize_mesh_compact(job):
+    ''' Voxelize a conductor from its triangle mesh, as voxelize_mesh(), returning the result
+        in compact form (see compact_voxelization()). This is the function run by the voxelization workers.
+    '''
+    return compact_voxelization(voxelize_mesh(job))
+
+
+def voxelize_triangles(facets, gbbox_min, delta, local_vs_min=None, local_vs_size=None, tol=0.0):
+    ''' Voxelize a closed triangle mesh, without any access to the exact solid shape
+
+        'facets' is a (N,3,3) array of triangle vertex coordinates
+        'gbbox_min' is the (3,) array of the global bbox min point
+        'delta' is the voxels size length
+        'local_vs_min' is the (3,) int array of the min voxel of the local box, in global voxel coordinates.
+            If None, the local box is the one containing the mesh bounding box
+        'local_vs_size' is the (3,) int array of the local box dimensions, in voxels.
+            If None, the local box is the one containing the mesh bounding box
+        'tol' is the mesh linear deflection w.r.t. the actual shape (see ray_parity_inside())
+
+        This is the headless version of the VHConductor voxelization: the voxels that
+        voxelize_mesh() leaves to Shape.isInside are classified by ray parity alone.
+
+        Returns a boolean array of shape 'local_vs_size', True for the voxels inside the mesh
+    '''
+    X, Y, Z = 0, 1, 2
+    gbbox_min = np.asarray(gbbox_min, dtype=np.float64)
+    if local_vs_min is None or local_vs_size is None:
+        local_vs_min = np.floor((np.min(facets, (0, 1)) - gbbox_min) / delta).astype(np.int64)
+        local_vs_size = np.floor((np.max(facets, (0, 1)) - gbbox_min) / delta).astype(np.int64) - local_vs_min + 1
+    result = voxelize_mesh({'facets': facets,
+                            'gbbox_min': gbbox_min,
+                            'delta': delta,
+                            'local_vs_min': np.asarray(local_vs_min),
+                            'local_vs_size': np.asarray(local_vs_size),
+                            'linear_deflection': tol,
+                            'use_ray_parity': True})
+    inside_mask = result['inside_mask']
+    check_voxels = result['check_voxels']
+    if len(check_voxels) > 0:
+        ray_inside, ray_ambiguous = ray_parity_inside(facets=facets,
+                                                      points=get_voxel_center(gbbox_min, check_voxels + local_vs_min, delta),
+                                                      tol=0.0)
+        inside_voxels = check_voxels[ray_inside]
+        inside_mask[inside_voxels[:, X], inside_voxels[:, Y], inside_voxels[:, Z]] = True
+    if np.size(result['region_check_labels']) > 0:
+        ray_inside, ray_ambiguous = ray_parity_inside(facets=facets,
+                                                      points=get_voxel_center(gbbox_min, result['region_check_samples'] + local_vs_min, delta),
+                                                      tol=0.0)
+        inside_mask |= regions_mask(result['region_labels'], result['region_check_labels'][ray_inside])
+    return inside_mask
+
+
+def exposed_voxel_sides(voxelSpace, box_min, box_max):
+    ''' Find the exposed voxel sides in a box of the voxel space, i.e. the sides of the non-empty
+        voxels whose neighbor voxel is empty
+
+        'voxelSpace' (Numpy 3D array) is the voxel tensor of the overall space
+        'box_min', 'box_max' are the (x,y,z) voxel indexes of the lower and upper box corners (included)
+
+        The neighbors beyond the upper end of the box, or beyond the voxel space, count as empty.
+
+        Returns a (N,4) int array of x,y,z,voxside where x, y, z are the voxel position indexes
+        and voxside is the index of the side in the order ['+x', '-x', '+y', '-y', '+z', '-z'].
+        The sides are in the same order as scanning the voxels along x, y, z and then the six sides.
+    '''
+    min_x, min_y, min_z = [int(index) for index in box_min]
+    max_x, max_y, max_z = [int(index) for index in box_max]
+    # array to find the six neighbors
+    sides = [(1,0,0), (-1,0,0), (0,1,0), (0,-1,0), (0,0,1), (0,0,-1)]
+    # 'occupied' is padded by one voxel on every side, and the lower padding is read from the voxel space, if any
+    lo_x, lo_y, lo_z = max(min_x-1, 0), max(min_y-1, 0), max(min_z-1, 0)
+    occupied = np.zeros((max_x-min_x+3, max_y-min_y+3, max_z-min_z+3), dtype=bool)
+    occupied[1-(min_x-lo_x):-1, 1-(min_y-lo_y):-1, 1-(min_z-lo_z):-1] = voxelSpace[lo_x:max_x+1, lo_y:max_y+1, lo_z:max_z+1] != 0
+    inner = occupied[1:-1, 1:-1, 1:-1]
+    candidates = []
+    for sideIndex, side in enumerate(sides):
+        neighbor = occupied[1+side[0]:occupied.shape[0]-1+side[0],
+                            1+side[1]:occupied.shape[1]-1+side[1],
+                            1+side[2]:occupied.shape[2]-1+side[2]]
+        exposed = np.argwhere(inner & ~neighbor)
+        candidates.append(np.column_stack((exposed + np.array((min_x, min_y, min_z)), np.full(len(exposed), sideIndex))))
+    candidates = np.concatenate(candidates).astype(np.int64)
+    # same order as scanning the voxels along x, y, z and then the six sides
+    return candidates[np.lexsort((candidates[:,3], candidates[:,2], candidates[:,1], candidates[:,0]))]
+
+
+def points_mesh_distance(points, triangles, chunk_size=None):
+    ''' Compute the minimum distance of each point from a triangle mesh
+
+        'points' is a (N,3) array of point coordinates
+        'triangles' is a (T,3,3) array of the triangle vertex coordinates
+        'chunk_size' is the maximum number of (point, triangle) pairs processed at once.
+            Defaults to EMVHVOXEL_DIST_CHUNK
+
+        Returns a (N,) array of the distances (infinite if there are no triangles)
+    '''
+    if chunk_size is None:
+        chunk_size = EMVHVOXEL_DIST_CHUNK
+    distances = np.full(len(points), np.inf)
+    if len(triangles) == 0 or len(points) == 0:
+        return distances
+    a = triangles[:, 0, :]
+    b = triangles[:, 1, :]
+    c = triangles[:, 2, :]
+    normals = np.cross(b - a, c - a)
+    norms = np.linalg.norm(normals, axis=1)
+    # degenerate triangles only contribute with their edges
+    valid = norms > 0.0
+    normals[valid] = normals[valid] / norms[valid, np.newaxis]
+    edges = [(a, b - a), (b, c - b), (c, a - c)]
+    points_per_chunk = max(1, chunk_size // len(triangles))
+    for start in range(0, len(points), points_per_chunk):
+        p = points[start:start + points_per_chunk, np.newaxis, :]
+        # distance from the triangle plane, if the projection of the point falls inside the triangle
+        plane_dist = np.einsum('ntk,tk->nt', p - a, normals)
+        projected = p - plane_dist[:, :, np.newaxis] * normals
+        inside = valid[np.newaxis, :]
+        for origin, edge in edges:
+            inside = inside & (np.einsum('ntk,tk->nt', np.cross(edge, projected - origin), normals) >= 0.0)
+        dist = np.where(inside, np.abs(plane_dist), np.inf)
+        # distance from the triangle edges
+        for origin, edge in edges:
+            edge_len2 = np.einsum('tk,tk->t', edge, edge)
+            t = np.einsum('ntk,tk->nt', p - origin, edge) / np.where(edge_len2 > 0.0, edge_len2, 1.0)
+            t = np.clip(t, 0.0, 1.0)
+            dist = np.minimum(dist, np.linalg.norm(p - (origin + t[:, :, np.newaxis] * edge), axis=2))
+        distances[start:start + points_per_chunk] = dist.min(axis=1)
+    return distances
+
+
+def voxelize_contact_mesh(voxelSpace, gbbox_min, delta, box_min, box_max, triangles, threshold, tess_tol):
+    ''' Find the voxel sides belonging to a contact surface, given as a tessellation
+
+        'voxelSpace' (Numpy 3D array) is the voxel tensor of the overall space
+        'gbbox_min' is the (3,) array of the global bbox min point
+        'delta' is the voxels size length
+        'box_min', 'box_max' are the (x,y,z) voxel indexes of the box containing the contact surface
+        'triangles' is a (T,3,3) array of the triangle vertex coordinates of the contact surface tessellation
+        'threshold' is the max distance of the center of a voxel side from the surface,
+            for the side to belong to the contact
+        'tess_tol' is the tessellation tolerance
+
+        The exposed voxel sides (see exposed_voxel_sides()) whose center is closer to the tessellation
+        than 'threshold' belong to the contact. The sides whose distance is within twice 'tess_tol'
+        from 'threshold' cannot be decided with the tessellation, and must be checked against
+        the exact surface (e.g. with distToShape()).
+
+        Returns a dict containing:
+            'sides' (N,4) int array of the exposed voxel sides (see exposed_voxel_sides())
+            'side_points' (N,3) array of the coordinates of the side centers
+            'distances' (N,) array of the distances of the side centers from the tessellation
+            'is_contact' (N,) boolean array, True for the sides belonging to the contact
+            'check' (M,) int array of the indexes of the sides to be checked against the exact surface
+    '''
+    halfdelta = delta/2.0
+    # centers of the sides, with respect to the lower corner (with the smallest coordinates)
+    sideCenters = np.array([(delta,halfdelta,halfdelta), (0.0,halfdelta,halfdelta),
+                            (halfdelta,delta,halfdelta), (halfdelta,0.0,halfdelta),
+                            (halfdelta,halfdelta,delta), (halfdelta,halfdelta,0.0)])
+    sides = exposed_voxel_sides(voxelSpace, box_min, box_max)
+    sidePoints = np.asarray(gbbox_min, dtype=np.float64) + sides[:,0:3] * delta + sideCenters[sides[:,3]]
+    distances = points_mesh_distance(sidePoints, triangles)
+    if len(triangles) > 0:
+        isContact = distances < threshold - 2.0*tess_tol
+        check = np.nonzero((~isContact) & (distances <= threshold + 2.0*tess_tol))[0]
+    else:
+        isContact = np.zeros(len(sides), dtype=bool)
+        check = np.arange(len(sides))
+    return {'sides': sides,
+            'side_points': sidePoints,
+            'distances': distances,
+            'is_contact': isContact,
+            'check': check}
+
+
+def voxelize_contact_triangles(voxelSpace, gbbox_min, delta, triangles, threshold):
+    ''' Find the voxel sides belonging to a contact surface given as a triangle mesh,
+        without any access to the exact surface
+
+        'voxelSpace' (Numpy 3D array) is the voxel tensor of the overall space
+        'gbbox_min' is the (3,) array of the global bbox min point
+        'delta' is the voxels size length
+        'triangles' is a (T,3,3) array of the triangle vertex coordinates of the contact surface
+        'threshold' is the max distance of the center of a voxel side from the surface,
+            for the side to belong to the contact
+
+        This is the headless version of the VHPort contact voxelization: the mesh is considered exact.
+
+        Returns the flat list of contacts in the format x,y,z,voxside (all integers) repeated n times
+        (see exposed_voxel_sides())
+    '''
+    if len(triangles) == 0:
+        return []
+    gbbox_min = np.asarray(gbbox_min, dtype=np.float64)
+    vs_size = np.array(voxelSpace.shape)
+    # find the voxel set that contains the triangles bounding box with a certain slack - it could be
+    # the next voxel, if the surface is at the boundary between voxels.
+    box_min = np.maximum(((np.min(triangles, (0, 1)) - gbbox_min) / delta).astype(np.int64) - 2, 0)
+    box_max = np.minimum(((np.max(triangles, (0, 1)) - gbbox_min) / delta).astype(np.int64) + 2, vs_size - 1)
+    result = voxelize_contact_mesh(voxelSpace, gbbox_min, delta, box_min, box_max, triangles, threshold, 0.0)
+    return result['sides'][result['distances'] < threshold].ravel().tolist()
+
+
+def merge_coplanar_faces(faces, axis):
+    ''' Merge the adjacent voxel faces lying on the same plane into rectangles
+
+        'faces' is a 3D boolean array, True where there is a voxel face orthogonal to 'axis'
+        'axis' is the index (0,1,2) of the direction orthogonal to the faces
+
+        The faces are first merged in runs along the last of the two in-plane directions,
+        then the runs with the same start and length on consecutive rows are stacked.
+        This is a greedy meshing that, while not guaranteeing the minimum number of rectangles,
+        reduces any rectangular region to a single rectangle.
+
+        Returns a tuple (origins, extents) of (N,3) integer arrays, where 'origins' are the indexes
+        of the first face of each rectangle, and 'extents' the number of faces spanned
+        along each direction (always 1 along 'axis')
+    '''
+    rowAxis, colAxis = [a for a in range(3) if a != axis]
+    faces = np.moveaxis(faces, (axis, rowAxis, colAxis), (0, 1, 2))
+    # find the start and the end of the runs of faces along the columns
+    edges = np.diff(np.pad(faces, ((0,0),(0,0),(1,1)), mode='constant').astype(np.int8), axis=2)
+    starts = np.argwhere(edges == 1)
+    # in every row, starts and ends alternate, so they are paired in C order
+    lengths = np.argwhere(edges == -1)[:, 2] - starts[:, 2]
+    plane, row, col = starts[:, 0], starts[:, 1], starts[:, 2]
+    # sort the runs so that the ones that can be stacked are consecutive, in row order
+    order = np.lexsort((row, lengths, col, plane))
+    plane, row, col, lengths = plane[order], row[order], col[order], lengths[order]
+    newRect = np.ones(len(order), dtype=bool)
+    newRect[1:] = ((plane[1:] != plane[:-1]) | (col[1:] != col[:-1]) |
+                   (lengths[1:] != lengths[:-1]) | (row[1:] != row[:-1] + 1))
+    first = np.flatnonzero(newRect)
+    origins = np.zeros((len(first), 3), dtype=np.int64)
+    origins[:, axis] = plane[first]
+    origins[:, rowAxis] = row[first]
+    origins[:, colAxis] = col[first]
+    extents = np.ones((len(first), 3), dtype=np.int64)
+    extents[:, rowAxis] = np.diff(np.append(first, len(order)))
+    extents[:, colAxis] = lengths[first]
+    return origins, extents
+
+
+def max_pool_mask(mask, factor):
+    ''' Downsample a voxel occupancy mask by max-pooling
+
+        'mask' is a 3D boolean array
+        'factor' is the integer downsampling factor along each direction
+
+        Returns the boolean array of shape ceil(mask.shape / factor), True where any of the
+        'factor' x 'factor' x 'factor' voxels of the corresponding block of 'mask' is True
+    '''
+    shape = -(-np.array(mask.shape) // factor)
+    padded = np.zeros(shape * factor, dtype=bool)
+    padded[0:mask.shape[0], 0:mask.shape[1], 0:mask.shape[2]] = mask
+    return padded.reshape(shape[0], factor, shape[1], factor, shape[2], factor).any(axis=(1, 3, 5))
+
+
+def voxel_shell_quads(mask, base, delta, dtype=np.float32, merge=False):
+    ''' Extract the boundary faces of a voxelized object as quadrilaterals
+
+        'mask' is a 3D array, non-zero where the voxels belong to the object
+        'base' is the (x,y,z) coordinate of the lower corner of the voxel mask[0,0,0]
+        'delta' is the voxels size length
+        'dtype' is the type of the returned vertex coordinates
+        'merge' if True, the adjacent coplanar voxel faces are merged into larger rectangles
+            (see merge_coplanar_faces())
+
+        Returns a tuple (points, numVertices) where 'points' is a flat (4*N,3) array
+        of the vertexes of the N boundary faces, and 'numVertices' is a (N,) int32 array
+        with the number of vertexes of each face. 'points' can be passed directly
+        to SoCoordinate3.point, while 'numVertices' must be converted to a list
+        for SoFaceSet.numVertices.
+        Faces are ordered as the x-orthogonal ones first, then y and z.
+    '''
+    # pad with one empty voxel in every direction, so the faces on the mask border are found as well
+    padded = np.pad(np.asarray(mask, dtype=bool), 1, mode='constant')
+    base = np.asarray(base, dtype=np.float64)
+    faceCorners = []
+    for axis, quad in enumerate(EMVHVOXEL_SHELL_QUADS):
+        quad = np.array(quad)
+        lower = [slice(None)] * 3
+        upper = [slice(None)] * 3
+        lower[axis] = slice(0, -1)
+        upper[axis] = slice(1, None)
+        # the boundaries are where the occupancy changes along 'axis'.
+        # Remark: the index along 'axis' is not the index of a voxel, but of the surface
+        # between two voxels
+        faces = padded[tuple(upper)] != padded[tuple(lower)]
+        if merge:
+            origins, extents = merge_coplanar_faces(faces, axis)
+        else:
+            origins = np.argwhere(faces)
+            extents = np.ones_like(origins)
+        # the other indexes must be shifted back because of the padding
+        origins[:, [a for a in range(3) if a != axis]] -= 1
+        faceCorners.append((origins[:, np.newaxis, :] + quad[np.newaxis, :, :] * extents[:, np.newaxis, :]).reshape(-1, 3))
+    corners = np.concatenate(faceCorners)
+    points = (base + corners * delta).astype(dtype)
+    numVertices = np.full(corners.shape[0] // 4, 4, dtype=np.int32)
+    return points, numVertices
+
+
+def contact_shell_quads(contacts, base, delta, offset, dtype=np.float32):
+    ''' Create the faces of the voxel contacts of a port as quadrilaterals
+
+        'contacts' is the flat list of contacts (see voxelizeContact() for the format)
+        'base' is the (x,y,z) coordinate of the lower corner of the voxel space
+        'delta' is the voxels size length
+        'offset' is the displacement of the faces from the voxel sides, as a fraction of 'delta'
+        'dtype' is the type of the returned vertex coordinates
+
+        Returns a tuple (points, numVertices) where 'points' is a flat (4*N,3) array
+        of the vertexes of the N contact faces, slightly offset from the voxel sides,
+        and 'numVertices' is a (N,) int32 array with the number of vertexes of each face.
+        'points' can be passed directly to SoCoordinate3.point, while 'numVertices' must be
+        converted to a list for SoFaceSet.numVertices.
+    '''
+    # small displacement w.r.t. delta, in voxel units
+    eps = offset
+    # vertexes of the six faces (with a slight offset), in voxel units.
+    # Order of the sides is ['+x', '-x', '+y', '-y', '+z', '-z']
+    vertexes = np.array([[[1+eps,0,0], [1+eps,1,0], [1+eps,1,1], [1+eps,0,1]],
+                         [[-eps,0,0], [-eps,0,1], [-eps,1,1], [-eps,1,0]],
+                         [[0,1+eps,0], [0,1+eps,1], [1,1+eps,1], [1,1+eps,0]],
+                         [[0,-eps,0], [1,-eps,0], [1,-eps,1], [0,-eps,1]],
+                         [[0,0,1+eps], [1,0,1+eps], [1,1,1+eps], [0,1,1+eps]],
+                         [[0,0,-eps], [0,1,-eps], [1,1,-eps], [1,0,-eps]]])
+    contacts = np.asarray(contacts, dtype=np.int64).reshape(-1, 4)
+    corners = contacts[:, np.newaxis, 0:3] + vertexes[contacts[:, 3]]
+    points = (np.asarray(base, dtype=np.float64) + corners.reshape(-1, 3) * delta).astype(dtype)
+    numVertices = np.full(contacts.shape[0], 4, dtype=np.int32)
+    return points, numVertices
+
+
+def pool_contacts(contacts, factor):
+    ''' Downsample the voxel contacts of a port
+
+        'contacts' is the flat list of contacts (see voxelizeContact() for the format)
+        'factor' is the integer downsampling factor of the voxel space along each direction
+
+        Returns the flat array of the contacts in the downsampled voxel space,
+        with the contacts falling on the same side of the same downsampled voxel merged
+    '''
+    pooled = np.asarray(contacts, dtype=np.int64).reshape(-1, 4).copy()
+    pooled[:, 0:3] //= factor
+    return np.unique(pooled, axis=0).ravel()
+
+
+def format_voxel_lines(voxCoords, condStr):
+    ''' Format a block of VoxHenry voxel statements with a single string operation
+
+        'voxCoords' is a (N,3) integer array of the (1-based) voxel indexes
+        'condStr' is the already formatted string of the voxel conductivity
+            (and superconductor lambda) values, common to all the voxels
+
+        Returns the string containing the 'V <index_x> <index_y> <index_z> <condStr>' lines.
+        The result is the same as np.savetxt() with fmt="V %d %d %d ...", but much faster
+        as the formatting is not done row by row.
+    '''
+    lineFormat = "V %d %d %d " + condStr.replace("%", "%%") + "\n"
+    return (lineFormat * voxCoords.shape[0]) % tuple(voxCoords.ravel().tolist())
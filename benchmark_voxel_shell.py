@@ -0,0 +1,89 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2019                                                    *
+#*   FastFieldSolvers S.R.L., http://www.fastfieldsolvers.com              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+# Benchmark of the voxel shell extraction used by VHConductor 'ShowVoxels',
+# comparing the plain voxel faces with the merged coplanar faces ('MergeVoxelFaces').
+# The voxel shell extraction does not depend on FreeCAD, so the benchmark can run
+# from the FreeCAD Python console as well as from a plain Python interpreter,
+# with the EM workbench folder in the Python path:
+#
+#   import benchmark_voxel_shell
+#   benchmark_voxel_shell.run()
+
+import time
+import numpy as np
+from EM_VHVoxel import voxel_shell_quads
+
+__title__="FreeCAD E.M. Workbench voxel shell benchmark"
+__author__ = "FastFieldSolvers S.R.L."
+__url__ = "http://www.fastfieldsolvers.com"
+
+DEF_SIZE = 200
+
+
+def reference_solids(size=DEF_SIZE):
+    ''' Build the reference voxelized solids
+
+        'size' is the number of voxels along each side of the voxel space
+
+        Returns a list of (name, mask) tuples, where 'mask' is a (size,size,size) boolean array
+    '''
+    x, y, z = np.indices((size, size, size))
+    c = size / 2.0
+    solids = []
+    # thin flat plate, the typical PCB plane
+    solids.append(("plate", (z >= size // 2) & (z < size // 2 + size // 20)))
+    # L-shaped trace
+    solids.append(("Ltrace", ((x < size // 4) | (y < size // 4)) & (z < size // 10)))
+    # sphere
+    solids.append(("sphere", (x - c)**2 + (y - c)**2 + (z - c)**2 < (0.45 * size)**2))
+    # array of cylindrical vias
+    pitch = size // 8
+    solids.append(("vias", ((x % pitch - pitch / 2.0)**2 + (y % pitch - pitch / 2.0)**2 < (pitch / 4.0)**2)))
+    # random noise, worst case for the face merging
+    solids.append(("noise", np.random.default_rng(0).random((size, size, size)) < 0.5))
+    return solids
+
+
+def run(size=DEF_SIZE):
+    ''' Run the benchmark, printing the number of faces and the build time
+        for the plain and merged voxel shells of each reference solid
+
+        'size' is the number of voxels along each side of the voxel space
+
+        Returns a list of dictionaries with the benchmark results
+    '''
+    results = []
+    print("solid       voxels    faces   time(s)   merged   time(s)")
+    for name, mask in reference_solids(size):
+        result = {'name': name, 'voxels': int(np.count_nonzero(mask))}
+        for merge in (False, True):
+            start = time.perf_counter()
+            points, numVertices = voxel_shell_quads(mask, (0.0, 0.0, 0.0), 1.0, merge=merge)
+            key = 'merged' if merge else 'plain'
+            result[key + '_faces'] = len(numVertices)
+            result[key + '_time'] = time.perf_counter() - start
+        print("%-8s %9d %8d %9.3f %8d %9.3f" % (name, result['voxels'], result['plain_faces'],
+                      result['plain_time'], result['merged_faces'], result['merged_time']))
+        results.append(result)
+    return results
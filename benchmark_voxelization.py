@@ -0,0 +1,449 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2019                                                    *
+#*   FastFieldSolvers S.R.L., http://www.fastfieldsolvers.com              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+# Benchmark of the voxelization stages, on synthetic triangle meshes at several voxel sizes.
+# The stages are the headless counterparts (see EM_VHVoxel) of VHConductor voxelizeConductor(),
+# VHPort voxelizeContact(), VHConductor createVoxelShellFast() and the voxel lines of
+# createVHInputFile(). The primitives that VHConductor voxelizes with a closed-form inside test
+# (boxes, cylinders, prisms, extrusions) are also voxelized along the analytic path, to compare
+# it with the mesh path ('analytic' stage). The reference geometries are also voxelized together,
+# as the conductors of VHSolver voxelizeConductors(): serially, and by pools of worker threads
+# and of worker processes ('workers' stages), to compare the speedups of the two pools.
+# For every stage the wall time, the peak memory allocated
+# during the stage (traced with tracemalloc, including the Numpy arrays) and the voxels per second
+# are appended to a JSON history file, and the times are compared with the previous run
+# to flag any regression.
+# The benchmark does not depend on FreeCAD, and can run from a plain Python interpreter
+# with the EM workbench folder in the Python path:
+#
+#   import benchmark_voxelization
+#   benchmark_voxelization.run()
+
+import os
+import sys
+import json
+import time
+import tempfile
+import platform
+import tracemalloc
+import multiprocessing
+import concurrent.futures
+import numpy as np
+from EM_VHVoxel import voxelize_triangles, voxelize_contact_triangles, voxel_shell_quads, format_voxel_lines
+from EM_VHVoxel import voxelize_mesh_compact
+from EM_VHVoxel import analytic_voxelize, box_inside, cylinder_inside, prism_inside, extrusion_inside
+
+__title__="FreeCAD E.M. Workbench voxelization benchmark"
+__author__ = "FastFieldSolvers S.R.L."
+__url__ = "http://www.fastfieldsolvers.com"
+
+# default voxel sizes (the reference geometries span a few units)
+DEF_DELTAS = [0.1, 0.05, 0.025]
+# default history file, in the benchmark folder
+DEF_HISTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_voxelization.json")
+# relative slowdown w.r.t. the previous run flagged as a regression
+DEF_REGRESSION_TOL = 0.2
+# stages faster than this (in seconds) are not checked for regressions, as too noisy
+DEF_REGRESSION_MINTIME = 0.05
+# contact distance threshold, as a fraction of the voxel size
+DEF_CONTACT_DIST = 0.55
+# tolerance of the analytic inside tests, relative to the voxel size (as EMVHCOND_ANALYTIC_TOL)
+DEF_ANALYTIC_TOL = 1e-9
+# default numbers of workers of the 'workers' stages
+DEF_WORKERS = [max(2, os.cpu_count() or 1)]
+
+
+def box_mesh(bmin, bmax):
+    ''' Triangle mesh of an axis-aligned box
+
+        'bmin', 'bmax' are the (x,y,z) box corners
+
+        Returns a (12,3,3) array of triangle vertex coordinates
+    '''
+    (x0, y0, z0), (x1, y1, z1) = bmin, bmax
+    v = np.array([(x0,y0,z0), (x1,y0,z0), (x1,y1,z0), (x0,y1,z0),
+                  (x0,y0,z1), (x1,y0,z1), (x1,y1,z1), (x0,y1,z1)], dtype=np.float64)
+    faces = [(0,2,1), (0,3,2), (4,5,6), (4,6,7), (0,1,5), (0,5,4),
+             (1,2,6), (1,6,5), (2,3,7), (2,7,6), (3,0,4), (3,4,7)]
+    return v[np.array(faces)]
+
+def tube_mesh(path, radius, sides=12):
+    ''' Triangle mesh of a closed tube with circular cross section swept along a path
+
+        'path' is a (K,3) array of the points of the path
+        'radius' is the tube radius
+        'sides' is the number of sides of the polygon approximating the cross section
+
+        Returns a (T,3,3) array of triangle vertex coordinates
+    '''
+    path = np.asarray(path, dtype=np.float64)
+    tangents = np.gradient(path, axis=0)
+    tangents = tangents / np.linalg.norm(tangents, axis=1)[:, np.newaxis]
+    # any reference direction not parallel to the path
+    ref = np.array((0.0, 0.0, 1.0)) if abs(tangents[0, 2]) < 0.9 else np.array((1.0, 0.0, 0.0))
+    normals = np.cross(tangents, ref)
+    normals = normals / np.linalg.norm(normals, axis=1)[:, np.newaxis]
+    binormals = np.cross(tangents, normals)
+    angles = np.arange(sides) * 2.0 * np.pi / sides
+    rings = (path[:, np.newaxis, :] + radius * (np.cos(angles)[np.newaxis, :, np.newaxis] * normals[:, np.newaxis, :] +
+                                                np.sin(angles)[np.newaxis, :, np.newaxis] * binormals[:, np.newaxis, :]))
+    a = rings[:-1]
+    b = np.roll(rings[:-1], -1, axis=1)
+    c = np.roll(rings[1:], -1, axis=1)
+    d = rings[1:]
+    side = np.concatenate((np.stack((a, b, c), axis=2), np.stack((a, c, d), axis=2))).reshape(-1, 3, 3)
+    caps = []
+    for ring, center in ((rings[0], path[0]), (rings[-1], path[-1])):
+        caps.append(np.stack((np.broadcast_to(center, ring.shape), ring, np.roll(ring, -1, axis=0)), axis=1))
+    return np.concatenate([side] + caps)
+
+def extrusion_mesh(polygon, direction):
+    ''' Triangle mesh of the extrusion of a convex polygon lying on the x-y plane
+
+        'polygon' is a (K,2) array of the polygon vertexes
+        'direction' is the (x,y,z) extrusion vector
+
+        Returns a (T,3,3) array of triangle vertex coordinates
+    '''
+    bottom = np.column_stack((polygon, np.zeros(len(polygon))))
+    top = bottom + np.asarray(direction, dtype=np.float64)
+    nextBottom = np.roll(bottom, -1, axis=0)
+    nextTop = np.roll(top, -1, axis=0)
+    side = np.concatenate((np.stack((bottom, nextBottom, nextTop), axis=1), np.stack((bottom, nextTop, top), axis=1)))
+    # fan triangulation of the (convex) caps
+    caps = [np.stack((np.broadcast_to(cap[0], cap[1:-1].shape), cap[1:-1], cap[2:]), axis=1) for cap in (bottom, top)]
+    return np.concatenate([side] + caps)
+
+def regular_polygon(sides, radius):
+    ''' Vertexes of a regular polygon centered in the origin, with a vertex along x, as the Part::Prism base
+
+        Returns a (sides,2) array of the polygon vertexes
+    '''
+    angles = np.arange(sides) * (2.0 * np.pi / sides)
+    return np.stack((radius * np.cos(angles), radius * np.sin(angles)), axis=1)
+
+def sphere_mesh(radius=1.0, sides=48):
+    ''' Triangle mesh of a sphere centered in the origin
+
+        Returns a (T,3,3) array of triangle vertex coordinates
+    '''
+    theta = np.linspace(0.0, np.pi, sides // 2 + 1)
+    phi = np.linspace(0.0, 2.0 * np.pi, sides + 1)
+    t, p = np.meshgrid(theta, phi, indexing='ij')
+    v = radius * np.stack((np.sin(t) * np.cos(p), np.sin(t) * np.sin(p), np.cos(t)), axis=-1)
+    a, b, c, d = v[:-1, :-1], v[:-1, 1:], v[1:, 1:], v[1:, :-1]
+    return np.concatenate((np.stack((a, d, c), axis=2).reshape(-1, 3, 3), np.stack((a, c, b), axis=2).reshape(-1, 3, 3)))
+
+def spiral_mesh(turns=4, length=4.0, width=0.2, spacing=0.15, thickness=0.12):
+    ''' Triangle mesh of a square spiral inductor, made of abutting boxes
+
+        Returns a (T,3,3) array of triangle vertex coordinates
+    '''
+    directions = [(1.0, 0.0), (0.0, 1.0), (-1.0, 0.0), (0.0, -1.0)]
+    pitch = width + spacing
+    point = np.zeros(2)
+    boxes = []
+    for segment in range(4 * turns):
+        d = np.array(directions[segment % 4])
+        seglen = length - pitch * ((segment - 1) // 2) if segment > 0 else length
+        # each box contains its start corner, the end corner belongs to the next segment
+        start = point - d * width / 2.0
+        end = point + d * (seglen - width / 2.0)
+        if segment == 4 * turns - 1:
+            end = end + d * width
+        across = np.array((-d[1], d[0])) * width / 2.0
+        corners = np.array((start + across, start - across, end + across, end - across))
+        boxes.append(box_mesh(np.append(corners.min(axis=0), 0.0), np.append(corners.max(axis=0), thickness)))
+        point = point + d * seglen
+    return np.concatenate(boxes)
+
+def vias_mesh(rows=4, cols=4, pitch=0.5, radius=0.1, height=1.0):
+    ''' Triangle mesh of an array of cylindrical vias
+
+        Returns a (T,3,3) array of triangle vertex coordinates
+    '''
+    vias = []
+    for row in range(rows):
+        for col in range(cols):
+            base = np.array((col * pitch, row * pitch, 0.0))
+            vias.append(tube_mesh(np.array((base, base + (0.0, 0.0, height / 2.0), base + (0.0, 0.0, height))), radius, 16))
+    return np.concatenate(vias)
+
+def bondwires_mesh(wires=4, pitch=0.4, length=3.0, loop=0.8, radius=0.05):
+    ''' Triangle mesh of an array of arched bond wires
+
+        Returns a (T,3,3) array of triangle vertex coordinates
+    '''
+    t = np.linspace(0.0, 1.0, 64)
+    meshes = []
+    for wire in range(wires):
+        path = np.stack((length * t, np.full(t.shape, wire * pitch), 4.0 * loop * t * (1.0 - t)), axis=1)
+        meshes.append(tube_mesh(path, radius, 12))
+    return np.concatenate(meshes)
+
+def reference_geometries():
+    ''' Build the reference geometries
+
+        Returns a list of (name, facets) tuples, where 'facets' is a (T,3,3) array of triangle vertex coordinates
+    '''
+    return [("sphere", sphere_mesh()),
+            ("spiral", spiral_mesh()),
+            ("vias", vias_mesh()),
+            ("bondwires", bondwires_mesh())]
+
+def reference_primitives():
+    ''' Build the reference primitives, that VHConductor voxelizes with a closed-form inside test
+        (see get_analytic_inside() in EM_VHConductor)
+
+        Returns a list of (name, facets, insideFactory) tuples, where 'facets' is a (T,3,3) array
+        of triangle vertex coordinates, and 'insideFactory' a function returning the closed-form
+        inside test of the primitive, given the tolerance
+    '''
+    trapezoid = np.array(((0.0, 0.0), (2.0, 0.0), (1.5, 1.0), (0.5, 1.0)))
+    # the extrusion is skewed, as Part::Extrusion with a 'Custom' direction
+    direction = np.array((0.3, 0.2, 1.0))
+    length = np.linalg.norm(direction)
+    return [("box", box_mesh((0.0, 0.0, 0.0), (3.0, 1.0, 0.5)),
+             lambda tol: box_inside(3.0, 1.0, 0.5, tol)),
+            ("cylinder", extrusion_mesh(regular_polygon(64, 1.0), (0.0, 0.0, 2.0)),
+             lambda tol: cylinder_inside(1.0, 2.0, tol)),
+            ("prism", extrusion_mesh(regular_polygon(6, 1.0), (0.0, 0.0, 1.5)),
+             lambda tol: prism_inside(6, 1.0, 1.5, tol)),
+            ("extrusion", extrusion_mesh(trapezoid, direction),
+             lambda tol: extrusion_inside(np.zeros(3), np.array((1.0, 0.0, 0.0)), np.array((0.0, 1.0, 0.0)),
+                                          [trapezoid], direction / length, length, 0.0, tol))]
+
+def local_box(facets, delta):
+    ''' Get the voxel grid of a geometry, with one empty voxel around it
+
+        Returns a tuple (gbbox_min, vs_size, local_vs_min, local_vs_size) of the global bbox min point,
+        of the voxel space dimensions, and of the min voxel and of the dimensions of the geometry box
+    '''
+    gbbox_min = facets.min(axis=(0, 1)) - delta
+    gbbox_max = facets.max(axis=(0, 1)) + delta
+    vs_size = np.ceil((gbbox_max - gbbox_min) / delta).astype(np.int64)
+    local_vs_min = np.floor((facets.min(axis=(0, 1)) - gbbox_min) / delta).astype(np.int64)
+    local_vs_size = np.minimum(np.floor((facets.max(axis=(0, 1)) - gbbox_min) / delta).astype(np.int64), vs_size - 1) - local_vs_min + 1
+    return gbbox_min, vs_size, local_vs_min, local_vs_size
+
+def run_stage(results, geometry, delta, stage, voxels, func, *args):
+    ''' Run a stage, and append its timing and peak memory to 'results'
+
+        'voxels' is the number of voxels processed by the stage, to compute the voxels/s
+
+        The peak memory is the peak of the memory traced by tracemalloc during the stage,
+        above the memory already allocated when the stage starts (tracemalloc must be tracing)
+
+        Returns the value returned by 'func'
+    '''
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    value = func(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    results.append({'geometry': geometry,
+                    'delta': delta,
+                    'stage': stage,
+                    'time': elapsed,
+                    'voxels': int(voxels),
+                    'voxels_per_s': voxels / elapsed if elapsed > 0.0 else None,
+                    'peak_mb': peak / 1048576.0})
+    return value
+
+def export_voxels(mask, filename):
+    ''' Write the voxel lines of a mask to a VoxHenry-like file, as createVHInputFile() does
+
+        Returns the number of bytes written
+    '''
+    with open(filename, "w") as fid:
+        return fid.write(format_voxel_lines(np.argwhere(mask) + 1, "5.800000e+07"))
+
+def run_geometry(results, name, facets, delta, folder):
+    ''' Run all the stages on a geometry at a given voxel size
+    '''
+    gbbox_min, vs_size, local_vs_min, local_vs_size = local_box(facets, delta)
+    mask = run_stage(results, name, delta, "voxelize", np.prod(local_vs_size),
+                     voxelize_triangles, facets, gbbox_min, delta, local_vs_min, local_vs_size)
+    voxelSpace = np.zeros(vs_size, dtype=np.int8)
+    voxelSpace[local_vs_min[0]:local_vs_min[0]+local_vs_size[0],
+               local_vs_min[1]:local_vs_min[1]+local_vs_size[1],
+               local_vs_min[2]:local_vs_min[2]+local_vs_size[2]] = mask
+    # the contact is the set of facets on the lower x end of the geometry
+    xmin, xmax = facets[:, :, 0].min(), facets[:, :, 0].max()
+    contact = facets[facets[:, :, 0].max(axis=1) <= xmin + 0.02 * (xmax - xmin)]
+    run_stage(results, name, delta, "contact", np.count_nonzero(mask),
+              voxelize_contact_triangles, voxelSpace, gbbox_min, delta, contact, delta * DEF_CONTACT_DIST)
+    run_stage(results, name, delta, "shell", np.count_nonzero(mask),
+              voxel_shell_quads, mask, gbbox_min + local_vs_min * delta, delta)
+    run_stage(results, name, delta, "export", np.count_nonzero(mask),
+              export_voxels, mask, os.path.join(folder, "benchmark_voxels.vhr"))
+
+def run_primitive(results, name, facets, insideFactory, delta):
+    ''' Voxelize a primitive at a given voxel size, both along the mesh and the analytic path
+    '''
+    gbbox_min, vs_size, local_vs_min, local_vs_size = local_box(facets, delta)
+    run_stage(results, name, delta, "voxelize", np.prod(local_vs_size),
+              voxelize_triangles, facets, gbbox_min, delta, local_vs_min, local_vs_size)
+    run_stage(results, name, delta, "analytic", np.prod(local_vs_size),
+              analytic_voxelize, insideFactory(delta * DEF_ANALYTIC_TOL), gbbox_min, local_vs_min, local_vs_size, delta)
+
+def voxelize_jobs(jobs, executor=None):
+    ''' Voxelize a list of voxelization jobs, as VHSolver voxelizeConductors() does
+
+        'executor' is the concurrent.futures pool of workers. If None, the jobs are voxelized serially
+
+        Returns the list of the compact voxelization results
+    '''
+    if executor is None:
+        return [voxelize_mesh_compact(job) for job in jobs]
+    return list(executor.map(voxelize_mesh_compact, jobs))
+
+def run_workers(results, geometries, delta, workers):
+    ''' Voxelize the geometries together at a given voxel size, serially and with pools of
+        worker threads and of worker processes, and record the speedups w.r.t. the serial run
+
+        'geometries' is a list of (name, facets) tuples
+        'workers' is the list of the numbers of workers of the pools
+
+        The peak memory is the one of the main process only
+    '''
+    jobs = []
+    for name, facets in geometries:
+        gbbox_min, vs_size, local_vs_min, local_vs_size = local_box(facets, delta)
+        # classify all the voxels by ray parity, as voxelize_triangles() does
+        jobs.append({'name': name,
+                     'facets': facets,
+                     'gbbox_min': gbbox_min,
+                     'delta': delta,
+                     'local_vs_min': local_vs_min,
+                     'local_vs_size': local_vs_size,
+                     'linear_deflection': 0.0,
+                     'use_ray_parity': True})
+    voxels = sum(np.prod(job['local_vs_size']) for job in jobs)
+    run_stage(results, "workers", delta, "serial", voxels, voxelize_jobs, jobs)
+    serial = results[-1]['time']
+    # the processes are forked where possible, as VHSolver does without GUI
+    context = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else None)
+    for count in workers:
+        if count < 2:
+            continue
+        # the pool start-up is part of the stage, as in VHSolver
+        for stage, pool in (("threads x%d" % count, lambda: concurrent.futures.ThreadPoolExecutor(max_workers=count)),
+                            ("processes x%d" % count, lambda: concurrent.futures.ProcessPoolExecutor(max_workers=count, mp_context=context))):
+            with pool() as executor:
+                run_stage(results, "workers", delta, stage, voxels, voxelize_jobs, jobs, executor)
+            results[-1]['workers'] = count
+            results[-1]['speedup'] = serial / results[-1]['time'] if results[-1]['time'] > 0.0 else None
+
+def find_regressions(results, previous, tolerance=DEF_REGRESSION_TOL, mintime=DEF_REGRESSION_MINTIME):
+    ''' Compare the results with the ones of a previous run
+
+        'results' is the list of stage results of the current run
+        'previous' is the list of stage results of the previous run
+        'tolerance' is the relative slowdown flagged as a regression
+        'mintime' is the min stage time (in seconds) checked for regressions
+
+        Returns the list of (result, previous result) tuples of the regressions
+    '''
+    prevTimes = {(r['geometry'], r['delta'], r['stage']): r for r in previous}
+    regressions = []
+    for result in results:
+        prev = prevTimes.get((result['geometry'], result['delta'], result['stage']))
+        if prev is None or max(result['time'], prev['time']) < mintime:
+            continue
+        if result['time'] > prev['time'] * (1.0 + tolerance):
+            regressions.append((result, prev))
+    return regressions
+
+def run(deltas=None, history=DEF_HISTORY, tolerance=DEF_REGRESSION_TOL, geometries=None, workers=None):
+    ''' Run the benchmark, append the results to the history file and flag the regressions
+        w.r.t. the previous run in the history
+
+        'deltas' is the list of voxel sizes. Defaults to DEF_DELTAS
+        'history' is the JSON history file name. If None, the results are not saved
+        'tolerance' is the relative slowdown flagged as a regression (only the times are checked)
+        'geometries' is a list of the names of the reference geometries and primitives to run. Defaults to all
+        'workers' is the list of the numbers of workers of the 'workers' stages. Defaults to DEF_WORKERS.
+            An empty list skips the 'workers' stages
+
+        Returns a tuple (results, regressions) of the list of the stage results
+        and of the (result, previous result) regressions
+    '''
+    if deltas is None:
+        deltas = DEF_DELTAS
+    if workers is None:
+        workers = DEF_WORKERS
+    runs = []
+    if history is not None and os.path.isfile(history):
+        with open(history, "r") as fid:
+            runs = json.load(fid).get('runs', [])
+    results = []
+    # trace the allocations, to get the peak memory of every stage
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    with tempfile.TemporaryDirectory() as folder:
+        for name, facets in reference_geometries():
+            if geometries is not None and not name in geometries:
+                continue
+            for delta in deltas:
+                run_geometry(results, name, facets, delta, folder)
+        for name, facets, insideFactory in reference_primitives():
+            if geometries is not None and not name in geometries:
+                continue
+            for delta in deltas:
+                run_primitive(results, name, facets, insideFactory, delta)
+        poolGeometries = [(name, facets) for name, facets in reference_geometries() if geometries is None or name in geometries]
+        if len(workers) > 0 and len(poolGeometries) > 0:
+            for delta in deltas:
+                run_workers(results, poolGeometries, delta, workers)
+    if not tracing:
+        tracemalloc.stop()
+    print("geometry     delta  stage           time(s)    voxels    voxels/s   peak(MB)")
+    for r in results:
+        print("%-10s %7.4f  %-12s %10.4f %9d %11.4g   %.1f" % (r['geometry'], r['delta'], r['stage'], r['time'], r['voxels'],
+              r['voxels_per_s'] or 0.0, r['peak_mb']))
+    for r in results:
+        if r.get('speedup') is not None:
+            print("SPEEDUP delta %g %s: %.2f (%d cores)" % (r['delta'], r['stage'], r['speedup'], os.cpu_count() or 1))
+    regressions = []
+    if len(runs) > 0:
+        regressions = find_regressions(results, runs[-1]['results'], tolerance)
+        for result, prev in regressions:
+            print("REGRESSION %s delta %g %s: %.4f s, was %.4f s" % (result['geometry'], result['delta'], result['stage'], result['time'], prev['time']))
+    if history is not None:
+        runs.append({'date': time.strftime("%Y-%m-%d %H:%M:%S"),
+                     'python': platform.python_version(),
+                     'numpy': np.__version__,
+                     'machine': platform.machine(),
+                     'cores': os.cpu_count(),
+                     'regressions': len(regressions),
+                     'results': results})
+        with open(history, "w") as fid:
+            json.dump({'runs': runs}, fid, indent=1)
+    return results, regressions
+
+if __name__ == "__main__":
+    results, regressions = run()
+    sys.exit(1 if len(regressions) > 0 else 0)
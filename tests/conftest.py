@@ -0,0 +1,5 @@
+# The workbench modules live in the repository root, which is not a package
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
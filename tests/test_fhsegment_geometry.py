@@ -0,0 +1,87 @@
+# Regression tests of the batched segment geometry in EM_Globals, against the
+# per-segment computation it replaced. Need FreeCAD (run with FreeCAD's Python):
+#
+#   python -m pytest tests
+
+import numpy as np
+import pytest
+
+FreeCAD = pytest.importorskip("FreeCAD")
+Part = pytest.importorskip("Part")
+
+from FreeCAD import Vector
+from EM_Globals import makeSegVertexes, makeSegShells, EMFHSEGMENT_LENTOL, EMFHSEGMENT_PARTOL
+
+
+def reference_seg_vertexes(n1, n2, width, height, ww):
+    ''' The vertexes of a segment, as computed by the original per-segment makeSegShape()
+        (v11, v12, v13, v14, v21, v22, v23, v24), or None for coincident nodes
+    '''
+    if (n2-n1).Length < EMFHSEGMENT_LENTOL:
+        return None
+    wl = n2-n1
+    wh = ww.cross(wl)
+    if ww.Length < EMFHSEGMENT_LENTOL or wh.Length < EMFHSEGMENT_LENTOL:
+        angle = wl.getAngle(Vector(0,0,1))*FreeCAD.Units.Radian
+        if angle < EMFHSEGMENT_PARTOL or angle > 180-EMFHSEGMENT_PARTOL:
+            ww = Vector(1,0,0)
+        else:
+            ww = (wl.cross(Vector(0,0,1))).normalize()
+        wh = ww.cross(wl)
+    wh.normalize()
+    wwHalf = Vector(ww)
+    wwHalf.normalize()
+    wwHalf.multiply(width / 2)
+    whHalf = Vector(wh)
+    whHalf.multiply(height / 2)
+    return [n1 - wwHalf - whHalf, n1 + wwHalf - whHalf, n1 + wwHalf + whHalf, n1 - wwHalf + whHalf,
+            n2 - wwHalf - whHalf, n2 + wwHalf - whHalf, n2 + wwHalf + whHalf, n2 - wwHalf + whHalf]
+
+
+def segment_cases():
+    ''' Random segments, plus the cases using the FastHenry default cross-section:
+        no 'ww', 'ww' parallel to the length, and length along the z axis
+    '''
+    rng = np.random.default_rng(5)
+    n1 = rng.uniform(-5.0, 5.0, (40, 3))
+    n2 = rng.uniform(-5.0, 5.0, (40, 3))
+    ww = rng.uniform(-1.0, 1.0, (40, 3))
+    ww[0] = 0.0
+    ww[1] = (n2[1]-n1[1]) * 2.0
+    n2[2] = n1[2] + (0.0, 0.0, 3.0)
+    ww[2] = 0.0
+    n2[3] = n1[3] - (0.0, 0.0, 1.0)
+    ww[3] = n2[3]-n1[3]
+    return n1, n2, ww
+
+
+def test_seg_vertexes_match_per_segment():
+    n1, n2, ww = segment_cases()
+    width = np.linspace(0.1, 2.0, len(n1))
+    vertexes = makeSegVertexes(n1, n2, width, 0.3, ww)
+    assert vertexes.shape == (len(n1), 8, 3)
+    for index in range(len(n1)):
+        reference = reference_seg_vertexes(Vector(*n1[index]), Vector(*n2[index]), width[index], 0.3, Vector(*ww[index]))
+        np.testing.assert_allclose(vertexes[index], [(v.x, v.y, v.z) for v in reference], atol=1e-9)
+
+
+def test_seg_vertexes_coincident_nodes_are_degenerate():
+    n1 = np.array(((1.0, 2.0, 3.0), (0.0, 0.0, 0.0)))
+    n2 = np.array(((1.0, 2.0, 3.0), (1.0, 0.0, 0.0)))
+    vertexes = makeSegVertexes(n1, n2, 1.0, 1.0, np.zeros((2, 3)))
+    assert np.all(np.isfinite(vertexes))
+    np.testing.assert_array_equal(vertexes[0], np.repeat(n1[0:1], 8, axis=0))
+    assert reference_seg_vertexes(Vector(*n1[0]), Vector(*n2[0]), 1.0, 1.0, Vector()) is None
+
+
+def test_seg_shells_match_per_segment():
+    n1, n2, ww = segment_cases()
+    vertexes = makeSegVertexes(n1, n2, 0.5, 0.2, ww)
+    shells = makeSegShells(vertexes)
+    assert len(shells) == len(n1)
+    for index, shell in enumerate(shells):
+        reference = reference_seg_vertexes(Vector(*n1[index]), Vector(*n2[index]), 0.5, 0.2, Vector(*ww[index]))
+        assert shell.isValid() and len(shell.Faces) == 6
+        assert shell.Area == pytest.approx(2*(0.5*0.2) + 2*(0.5+0.2)*np.linalg.norm(n2[index]-n1[index]))
+        np.testing.assert_allclose(sorted((v.X, v.Y, v.Z) for v in shell.Vertexes),
+                                   sorted((v.x, v.y, v.z) for v in reference), atol=1e-9)
@@ -0,0 +1,128 @@
+# Regression tests of the FreeCAD-free voxelization kernels in EM_VHVoxel.
+# Run from the workbench folder with:
+#
+#   python -m pytest tests
+
+import numpy as np
+import pytest
+
+from EM_VHVoxel import intersects_box, intersects_box_batch, mesh_intersections_batch, label_regions, compact_voxelization, expand_voxelization, VoxelMask
+
+
+def random_triangles(rng, count, low, high):
+    ''' Random triangles, half of them snapped to a coarse grid to get degenerate
+        and grid-aligned cases (zero-length edges, vertexes and edges on the voxel sides)
+    '''
+    triangles = rng.uniform(low, high, (count, 3, 3))
+    snapped = triangles[0:count // 2]
+    snapped[...] = np.round(snapped * 2.0) / 2.0
+    return triangles
+
+
+def test_intersects_box_batch_matches_scalar():
+    rng = np.random.default_rng(1)
+    triangles = random_triangles(rng, 4000, -2.0, 2.0)
+    centers = np.round(rng.uniform(-1.5, 1.5, (len(triangles), 3)) * 2.0) / 2.0
+    extents = np.array((0.25, 0.25, 0.25)) + 1e-14
+    batch = intersects_box_batch(triangles, centers, extents)
+    scalar = np.array([intersects_box(triangle, center, extents) for triangle, center in zip(triangles, centers)])
+    np.testing.assert_array_equal(batch, scalar)
+    # both outcomes must be exercised
+    assert batch.any() and not batch.all()
+
+
+def scalar_mesh_intersections(facets, gbbox_min, local_vs_min, local_vs_size, delta):
+    ''' The per-facet loop calling intersects_box(), skipping the candidate voxels outside the local box '''
+    mesh_intersections = np.zeros(local_vs_size, dtype=bool)
+    half_el_size = np.full(3, delta / 2.0 + 1e-14)
+    for facet in facets:
+        facet_min = np.floor((np.min(facet, 0) - gbbox_min) / delta).astype(int) - local_vs_min
+        facet_max = np.floor((np.max(facet, 0) - gbbox_min) / delta).astype(int) - local_vs_min
+        for x in range(facet_min[0], facet_max[0] + 1):
+            for y in range(facet_min[1], facet_max[1] + 1):
+                for z in range(facet_min[2], facet_max[2] + 1):
+                    if not (0 <= x < local_vs_size[0] and 0 <= y < local_vs_size[1] and 0 <= z < local_vs_size[2]):
+                        continue
+                    center = gbbox_min + (np.array((x, y, z)) + local_vs_min + 0.5) * delta
+                    if intersects_box(facet, center, half_el_size):
+                        mesh_intersections[x, y, z] = True
+    return mesh_intersections
+
+
+def test_mesh_intersections_batch_matches_scalar():
+    rng = np.random.default_rng(2)
+    gbbox_min = np.array((-1.0, -1.0, -1.0))
+    delta = 0.25
+    local_vs_min = np.array((2, 1, 3))
+    local_vs_size = np.array((6, 7, 5))
+    box_min = gbbox_min + local_vs_min * delta
+    box_max = box_min + local_vs_size * delta
+    # facets inside the local box, and facets crossing its sides (clipped by the batched version)
+    inner = random_triangles(rng, 150, box_min, box_max)
+    crossing = random_triangles(rng, 150, box_min - 2 * delta, box_max + 2 * delta)
+    for facets in (inner, crossing):
+        # small chunks, to test the facets split across chunks
+        batch = mesh_intersections_batch(facets, gbbox_min, local_vs_min, local_vs_size, delta, chunk_size=97)
+        scalar = scalar_mesh_intersections(facets, gbbox_min, local_vs_min, local_vs_size, delta)
+        np.testing.assert_array_equal(batch, scalar)
+
+
+def test_mesh_intersections_batch_no_facets():
+    result = mesh_intersections_batch(np.zeros((0, 3, 3)), np.zeros(3), np.zeros(3, dtype=int), np.array((2, 3, 4)), 1.0)
+    assert result.shape == (2, 3, 4) and not result.any()
+
+
+def test_compact_voxelization_round_trip():
+    rng = np.random.default_rng(3)
+    size = (9, 8, 7)
+    inside_mask = rng.uniform(size=size) > 0.4
+    region_labels, count = label_regions(inside_mask)
+    assert count > 2
+    result = {'inside_mask': inside_mask,
+              'check_voxels': np.zeros((0, 3), dtype=int),
+              'region_labels': region_labels,
+              'region_check_labels': np.array((1, count)),
+              'region_check_samples': np.zeros((2, 3), dtype=int),
+              'stats': {}}
+    expanded = expand_voxelization(compact_voxelization(result), np.array(size))
+    np.testing.assert_array_equal(expanded['inside_mask'], inside_mask)
+    # only the regions still to be checked are kept
+    pending = np.isin(region_labels, (1, count))
+    np.testing.assert_array_equal(expanded['region_labels'], np.where(pending, region_labels, 0))
+    # no regions left to check
+    result['region_labels'] = None
+    result['region_check_labels'] = np.zeros(0, dtype=int)
+    expanded = expand_voxelization(compact_voxelization(result), np.array(size))
+    np.testing.assert_array_equal(expanded['inside_mask'], inside_mask)
+    assert expanded['region_labels'] is None
+
+
+class DenseVoxelSpace:
+    ''' The minimal voxel space interface used by VoxelMask.toArray() '''
+    def __init__(self, array):
+        self.array = array
+        self.dtype = array.dtype
+
+    def toArray(self):
+        return self.array
+
+
+def test_voxel_mask_combinations():
+    rng = np.random.default_rng(4)
+    array = rng.integers(0, 4, (5, 6, 7)).astype(np.uint8)
+    voxelSpace = DenseVoxelSpace(array)
+    one = VoxelMask.compare(voxelSpace, 1)
+    notTwo = VoxelMask.compare(voxelSpace, 2, equal=False)
+    np.testing.assert_array_equal(one.toArray(), array == 1)
+    np.testing.assert_array_equal((one | ~notTwo).toArray(), (array == 1) | (array == 2))
+    np.testing.assert_array_equal((notTwo & ~one).toArray(), (array != 2) & (array != 1))
+    np.testing.assert_array_equal((one ^ notTwo).toArray(), (array == 1) ^ (array != 2))
+    # the empty voxels are selected by 'array != 2', and not by 'array == 1' or its combination
+    assert not one.selects_empty and notTwo.selects_empty
+    assert not (notTwo & one).selects_empty and (~one).selects_empty
+    with pytest.raises(TypeError):
+        one & (array == 3)
+    with pytest.raises(ValueError):
+        one & VoxelMask.compare(DenseVoxelSpace(array), 3)
+    with pytest.raises(ValueError):
+        bool(one)